@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measures the time to build the apt software inventory with a freshly opened apt
+cache, with the shared apt cache of AptPackageManager once it is open and from the
+dpkg status file read directly, buffered and mapped.
+
+    python -m benchmarks.bench_apt_inventory [runs]
+"""
+import statistics
+import sys
+import time
+
+from c8ydm.core.apt_package_manager import AptCache, AptPackageManager
+from c8ydm.core.dpkg_status import DPKG_STATUS
+
+
+def measure(runs, manager, cold):
+    durations = []
+    for _ in range(runs):
+        if cold:
+            manager.apt_cache = AptCache()
+        start = time.perf_counter()
+        software = manager.get_installed_software_json(False)
+        durations.append((time.perf_counter() - start) * 1000)
+    return len(software), durations
+
+
+def main(runs=5):
+    manager = AptPackageManager()
+    variants = (
+        ('fresh apt cache', True, None, False),
+        ('shared apt cache', False, None, False),
+        ('dpkg status', False, DPKG_STATUS, False),
+        ('dpkg status with mmap', False, DPKG_STATUS, True)
+    )
+    for name, cold, dpkg_status, use_mmap in variants:
+        # Without a dpkg status file the inventory is built from the apt cache
+        manager.dpkg_status = dpkg_status or '/nonexistent'
+        manager.dpkg_status_mmap = use_mmap
+        packages, durations = measure(runs, manager, cold)
+        print(f'Inventory of {packages} packages with {name} over {runs} runs: '
+              f'mean {statistics.mean(durations):.1f} ms, '
+              f'median {statistics.median(durations):.1f} ms, '
+              f'max {max(durations):.1f} ms')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measures the time DeviceStats needs to collect cpu, memory and disk stats per cycle.
+
+    python -m benchmarks.bench_device_stats [cycles]
+"""
+import statistics
+import sys
+import time
+
+from c8ydm.core.device_stats import DeviceStats
+
+
+def main(cycles=100):
+    stats = DeviceStats()
+    durations = []
+    for _ in range(cycles):
+        start = time.perf_counter()
+        stats.getCPUStats()
+        stats.getMemoryStats()
+        stats.getDiskStats()
+        durations.append((time.perf_counter() - start) * 1000)
+    print(f'DeviceStats collection over {cycles} cycles: '
+          f'mean {statistics.mean(durations):.3f} ms, '
+          f'median {statistics.median(durations):.3f} ms, '
+          f'max {max(durations):.3f} ms')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measures a c8y_LogfileRequest style query for one hour in the middle of a generated
+log against a full scan of the log.
+
+    python -m benchmarks.bench_log_query [megabytes]
+"""
+import pathlib
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from c8ydm.core.log_query import LogIndex, query, timestamp_key
+
+
+def generate(path, megabytes):
+    size = megabytes * 1000 * 1000
+    moment = datetime(2021, 5, 3)
+    written = 0
+    with open(path, 'w') as f:
+        while written < size:
+            line = (f'{moment:%Y-%m-%d %H:%M:%S},000 MainThread INFO c8ydm.core.device_stats '
+                    f'Collected cpu, memory and disk stats of the device {written}\n')
+            f.write(line)
+            written += len(line)
+            moment += timedelta(milliseconds=200)
+    return moment
+
+
+def full_scan(path, date_from, date_to, maximum_lines):
+    start, end = timestamp_key(date_from), timestamp_key(date_to)
+    found = []
+    with open(path, 'rb') as f:
+        for line in f:
+            key = timestamp_key(line)
+            if key is not None and start <= key <= end and len(found) < maximum_lines:
+                found.append(line)
+    return found
+
+
+def measure(name, func):
+    start = time.perf_counter()
+    result = func()
+    print(f'{name}: {(time.perf_counter() - start) * 1000:.1f} ms')
+    return result
+
+
+def main(megabytes=50):
+    with tempfile.TemporaryDirectory() as directory:
+        path = pathlib.Path(directory) / 'agent.log'
+        last = generate(path, megabytes)
+        middle = datetime(2021, 5, 3) + (last - datetime(2021, 5, 3)) / 2
+        date_from = middle.isoformat()
+        date_to = (middle + timedelta(hours=1)).isoformat()
+        print(f'Querying {date_from} - {date_to} with at most 1000 lines in a {megabytes} MB log')
+        measure('full scan', lambda: full_scan(path, date_from, date_to, 1000))
+        index = LogIndex(path)
+        measure('building the index', index.update)
+        measure('indexed query', lambda: list(query(path, date_from, date_to, '', 1000, index)))
+        with open(path, 'a') as f:
+            f.write(f'{last:%Y-%m-%d %H:%M:%S},000 MainThread INFO c8ydm.bench appended\n')
+        measure('indexed query after the log grew', lambda: list(query(path, date_from, date_to, '', 1000, index)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
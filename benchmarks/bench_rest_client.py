@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares the latency of a new connection per request (module level requests.request,
+as RestClient did before) with the pooled keep-alive session of RestClient.
+
+    python -m benchmarks.bench_rest_client [requests] [url]
+
+Without url a local HTTP server is used, which only shows the TCP part of the
+handshake. Pass an https url of a tenant (e.g. https://<tenant>/tenant/health)
+to include TLS and network latency.
+"""
+import pathlib
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import requests
+
+from c8ydm.client.rest_client import RestClient
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = b'{"status": "UP"}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Configuration:
+
+    def getValue(self, category, key):
+        return None
+
+    def getCredentials(self):
+        return ['t123', 'user', 'password']
+
+
+def _measure(call, count):
+    durations = []
+    for _ in range(count):
+        start = time.perf_counter()
+        call().raise_for_status()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def _report(name, durations):
+    print(f'{name:<28} mean {statistics.mean(durations):8.3f} ms  '
+          f'median {statistics.median(durations):8.3f} ms  max {max(durations):8.3f} ms')
+
+
+def main(count=200, url=None):
+    server = None
+    if url is None:
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_address[1]}/tenant/health'
+    with tempfile.TemporaryDirectory() as tmp:
+        agent = SimpleNamespace(serial='benchmark', configuration=_Configuration(),
+                                path=pathlib.Path(tmp), url=url, token=None)
+        client = RestClient(agent)
+        _report('requests.request (before)', _measure(lambda: requests.request('GET', url), count))
+        _report('RestClient session (after)', _measure(lambda: client._request('GET', url), count))
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200, sys.argv[2] if len(sys.argv) > 2 else None)
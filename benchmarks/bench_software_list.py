@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measures encoding a software list into 140/141 SmartREST messages which fit into
+the 16 KB MQTT payload limit.
+
+    python -m benchmarks.bench_software_list [packages] [runs]
+"""
+import statistics
+import sys
+import time
+
+from c8ydm.framework.smartrest import chunked_messages
+
+
+def main(packages=5000, runs=20):
+    groups = [[f'package-{i}', f'1:{i % 10}.{i % 100}-{i}ubuntu1', 'apt', 'test'] for i in range(packages)]
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        payloads = [message.getMessage() for message in chunked_messages('s/us', groups)]
+        durations.append((time.perf_counter() - start) * 1000)
+    sizes = [len(payload.encode('utf-8')) for payload in payloads]
+    print(f'Encoded {packages} packages into {len(payloads)} messages of at most {max(sizes)} bytes '
+          f'({sum(sizes)} bytes total) over {runs} runs: '
+          f'mean {statistics.mean(durations):.2f} ms, '
+          f'median {statistics.median(durations):.2f} ms, '
+          f'max {max(durations):.2f} ms')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
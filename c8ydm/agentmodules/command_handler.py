@@ -219,4 +219,7 @@ class CommandHandler(Listener):
         return [self.fragment]
 
     def getSupportedTemplates(self):
-        return []
\ No newline at end of file
+        return []
+
+    def getSupportedMessages(self):
+        return [('s/ds', self.command_message_id)]
@@ -40,6 +40,12 @@ class DownloadConfigfileInitializer(Initializer, Listener):
     def getSupportedTemplates(self):
         return []
 
+    def getSupportedMessages(self):
+        return [('s/ds', '524')]
+
+    def getConcurrency(self, message):
+        return ('resource', 'configuration')
+
     def _set_executing(self):
         executing = SmartRESTMessage('s/us', '501', [self.fragment])
         #print("Executing MSG send")
@@ -39,6 +39,9 @@ class UploadConfigfileInitializer(Initializer, Listener):
     def getSupportedTemplates(self):
         return []
 
+    def getSupportedMessages(self):
+        return [('s/ds', '526'), ('s/ds', '520')]
+
     def _set_executing(self):
         executing = SmartRESTMessage('s/us', '501', [self.fragment])
         self.agent.publishMessage(executing)
@@ -66,12 +69,8 @@ class UploadConfigfileInitializer(Initializer, Listener):
                 if configtype in configfiles:
                     path = pathlib.Path(configfiles[configtype])
                     if isfile(path):
-                        f = open(path, "rb")
-                        memFile = f.read()
-                        #payload = {'object' : '{"name" : "configfile'+ deviceid+'", "type" : "text/plain" }'}
-                        #file = [('file' , memFile)]
-                        files = {'object': (None, '{ "name": "'+configtype+'_'+deviceid +'", type: "text/plain" }'), 'file': (configtype+ '_'+ deviceid, memFile, 'text/plain')}
-                        binaryurl = self.agent.rest_client.upload_event_configfile(mo_id, files, configtype, str(path))
+                        # The file is streamed from disk by the rest client
+                        binaryurl = self.agent.rest_client.upload_event_configfile(mo_id, configtype + '_' + deviceid, configtype, path)
                         if binaryurl:
                             self._set_success(binaryurl)
                             self.logger.debug("UploadConfigHandler uploaded Binary under following URL: "+binaryurl)
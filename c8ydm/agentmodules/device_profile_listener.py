@@ -54,6 +54,20 @@ class DeviceProfileListener(Listener):
                     softwareToInstall, True, False)
         return errors
     
+    def _report_installed_software(self):
+        installed_software = self.apt_package_manager.get_installed_software_json(False)
+        self.agent.software_inventory.report(
+            installed_software, self._publish_delta, self._send_software_list,
+            device=self.agent.rest_client.get_device_key())
+
+    def _publish_delta(self, message):
+        # The delta is only remembered as reported once the broker received it
+        return self.agent.publishMessage(message, qos=1, wait_for_publish=True)
+
+    def _send_software_list(self, installed_software):
+        mo_id = self.agent.rest_client.get_internal_id(self.agent.serial)
+        return self.agent.rest_client.set_adv_software_list(mo_id, installed_software)
+
     def _process_device_profile_msg(self, message):
         operation_values = {'$FW': [], '$SW': [], '$CONF': []}
         active_operation = ''
@@ -78,8 +92,7 @@ class DeviceProfileListener(Listener):
             else:
                 # finished with errors
                 self._set_failed(errors)
-            self.agent.publishMessage(
-                self.apt_package_manager.getInstalledSoftware(True))
+            self._report_installed_software()
                     
         #TODO Configuration Block
 
@@ -110,4 +123,10 @@ class DeviceProfileListener(Listener):
     def getSupportedTemplates(self):
         return []
 
+    def getSupportedMessages(self):
+        return [('s/ds', self.device_profiles_message_id)]
+
+    def getConcurrency(self, message):
+        return ('resource', 'packages')
+
 
@@ -21,7 +21,7 @@ import logging, time, json
 import subprocess
 from c8ydm.framework.modulebase import Sensor, Initializer, Listener
 from c8ydm.framework.smartrest import SmartRESTMessage
-from c8ydm.core.docker_watcher import DockerWatcher
+from c8ydm.core.docker_watcher import DockerWatcher, ContainerStateTracker
 
 class DockerSensor(Sensor, Initializer, Listener):
     xid = 'c8y-dm-agent-v1.0'
@@ -29,11 +29,21 @@ class DockerSensor(Sensor, Initializer, Listener):
     docker_watcher = DockerWatcher()
     fragment = 'c8y_Docker'
 
+    def __init__(self, serial, agent):
+        super().__init__(serial, agent)
+        self.container_states = ContainerStateTracker(self.docker_watcher.client, self._publish_transition)
+
+    def _publish_transition(self, container_id, name, status):
+        update_msg = SmartRESTMessage(f's/us/{self.serial}_{container_id}', '104', [status])
+        self.agent.publishMessage(update_msg)
+
     def getSensorMessages(self):
         #self.logger.info(f'Docker Update Loop called...')
         payload = self.docker_watcher.get_stats()
         service_msgs = []
         if payload is not None:
+            # Docker may have been started after the agent, watch its events from now on
+            self.container_states.start()
             if self.agent.token_received.wait(timeout=self.agent.refresh_token_interval):
                 internal_id = self.agent.rest_client.get_internal_id(self.agent.serial)
                 self.agent.rest_client.update_managed_object(internal_id, json.dumps(payload))
@@ -46,13 +56,9 @@ class DockerSensor(Sensor, Initializer, Listener):
                     container_cpu = float(container['cpu'])
                     container_memory = float(container['memory_perc'])
                     #self.logger.info(f'Container found with name {container_name} id {container_id} status {container_status} cpu {container_cpu} memory {container_memory}')
-                    if container_status:
-                        if 'Up' in container_status:
-                            status = 'up'
-                        elif 'Exited' in container_status:
-                            status = 'down'
-                        else:
-                            status = container_status
+                    status = ContainerStateTracker.status_from_text(container_status)
+                    # Status is pushed by the events stream, polling only catches missed transitions
+                    if status and self.container_states.update(container['containerID'], status):
                         update_msg = SmartRESTMessage(f's/us/{container_id}', '104', [status])
                         service_msgs.append(update_msg)
                     if container_cpu:
@@ -69,28 +75,24 @@ class DockerSensor(Sensor, Initializer, Listener):
     def getMessages(self):
         self.logger.info(f'Docker Initializer called...')
         payload = self.docker_watcher.get_stats()
-        
+        service_msgs = []
 
         if payload is not None:
             
             if self.agent.token_received.wait(timeout=self.agent.refresh_token_interval):
                 internal_id = self.agent.rest_client.get_internal_id(self.agent.serial)
                 self.agent.rest_client.update_managed_object(internal_id, json.dumps(payload))
-            service_msgs = []
             for container in payload['c8y_Docker']:
                 container_id = f'{self.serial}_{container["containerID"]}'
                 container_name = container['name']
                 container_status = container['status']
                 #self.logger.info(f'Container found with name {container_name} id {container_id} status {container_status}')
-                if container_status:
-                    if 'Up' in container_status:
-                        status = 'up'
-                    elif 'Exited' in container_status:
-                        status = 'down'
-                    else:
-                        status = container_status
+                status = ContainerStateTracker.status_from_text(container_status)
+                if status:
+                    self.container_states.update(container['containerID'], status)
                     msg = SmartRESTMessage('s/us', '102', [container_id, 'docker', container_name, status])
                     service_msgs.append(msg)
+            self.container_states.start()
         return service_msgs
     
     def _set_executing(self):
@@ -144,4 +146,10 @@ class DockerSensor(Sensor, Initializer, Listener):
         return [self.fragment]
 
     def getSupportedTemplates(self):
-        return [self.xid]
\ No newline at end of file
+        return [self.xid]
+
+    def getSupportedMessages(self):
+        return [(f's/dc/{self.xid}', 'dm501')]
+
+    def stop(self):
+        self.container_states.stop()
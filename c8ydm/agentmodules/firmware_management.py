@@ -117,6 +117,9 @@ class FirmwareManagement(Listener, Initializer):
     def getSupportedTemplates(self):
         return []
 
+    def getSupportedMessages(self):
+        return [('s/ds', '515'), ('s/ds', '525')]
+
     def getMessages(self):
         #TODO Check current Firmware version, Update Operation, Update Fragment
         return self.get_firmware_msg()
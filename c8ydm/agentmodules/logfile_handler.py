@@ -17,15 +17,18 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
-import logging, io, re
-from datetime import datetime
+import logging, itertools
+from c8ydm.core.log_query import LogArchive
 from c8ydm.framework.modulebase import Initializer, Listener
 from c8ydm.framework.smartrest import SmartRESTMessage
 
 class LogfileInitializer(Initializer, Listener):
     logger = logging.getLogger(__name__)
     fragment = 'c8y_LogfileRequest'
-    
+
+    def __init__(self, serial, agent):
+        super().__init__(serial, agent)
+        self.archive = None
 
     def getMessages(self):
         msg = SmartRESTMessage('s/us', '118', ['agentlog'])
@@ -37,6 +40,9 @@ class LogfileInitializer(Initializer, Listener):
     def getSupportedTemplates(self):
         return []
 
+    def getSupportedMessages(self):
+        return [('s/ds', '522')]
+
     def _set_executing(self):
         executing = SmartRESTMessage('s/us', '501', [self.fragment])
         #print("Executing MSG send")
@@ -56,91 +62,31 @@ class LogfileInitializer(Initializer, Listener):
         mo_id = self.agent.rest_client.get_internal_id(self.agent.serial)  
         try:
             if 's/ds' in message.topic and message.messageId == '522':
-                # When multiple operations received just take the first one for further processing
-                #self.logger.debug("message received :" + str(message.values))
                 deviceid = message.values[0]
                 logname = message.values[1]
                 starttime = message.values[2]
                 endtime = message.values[3]
                 searchtext = message.values[4]
-                searchtext = searchtext.lower()
                 maximumlines = message.values[5]
-                #print('\n deviceid: {}\n starttime: {}\n endtime: {}\n searchtext:{}\n maximumlines:{} \n'.format(deviceid, starttime, endtime, searchtext, maximumlines))
                 self._set_executing()
-                #self.logger.info('LogFile HandleOperation Called for '+ deviceid)
-                starttime = starttime.replace("T", " ")
-                endtime = endtime.replace("T", " ")
-                starttime = datetime.fromisoformat(starttime[:16])
-                endtime = datetime.fromisoformat(endtime[:16])
-                fileLines = []
-                searchtextindata = False
-                path = self.agent.path
-                with open(path / 'agent.log', 'r') as f:
-                    for line in f:
-                        stripped_line = line.strip().lower()
-                        fileLines.append(stripped_line)
-
-                        if(searchtext in line and searchtext !=''):
-                            searchtextindata = True
-
-                    if searchtextindata == True:
-                        num_lines = len(fileLines)
-                        newOutput = ''
-                        outputfound = False
-                        while(outputfound == False):
-                            for index, line in enumerate(fileLines):
-                                linematch = re.match("[0-9][0-9][0-9][0-9][-][0-9][0-9]+", line[:16])
-                                linehaslogtime = bool(linematch)
-                                if(linehaslogtime == True and outputfound == False):
-                                    logtime = datetime.fromisoformat(line[:16])
-                                    # #self.logger.debug('Starttime: {}\nLogtime: {}\nEndtime:{}'.format(starttime,logtime,endtime))
-                                    if starttime <logtime <endtime:
-                                        if searchtext in line:
-                                            i = 0
-                                            while(i<int(maximumlines) and index+i < num_lines):
-                                                newOutput+= fileLines[index+i] + '\n'
-                                                i+=1
-                                                outputfound = True
-                        memFile = io.BytesIO(newOutput.encode('utf8'))
-                        files = {'object': (None, '{ "name": '+logname+'_'+ deviceid +', type: text/plain }'), 'file': (logname+'_'+ deviceid, memFile, 'text/plain')}
-                        binaryurl = self.agent.rest_client.upload_event_logfile(mo_id, files)
-                        if binaryurl:
-                            self._set_success(binaryurl)
-                            self.logger.debug("LogHandler uploaded Binary under following URL: "+binaryurl)
-                        else:
-                            self._set_failed('Could not upload logfile')
-                                            
-                    elif searchtext=='':
-                        num_lines = len(fileLines)
-                        newOutput = ''
-                        outputfound = False
-                        while(outputfound == False):
-                            for index, line in enumerate(fileLines):
-                                linematch = re.match("[0-9][0-9][0-9][0-9][-][0-9][0-9]+", line[:16])
-                                linehaslogtime = bool(linematch)
-                                if(linehaslogtime == True and outputfound == False):
-                                    logtime = datetime.fromisoformat(line[:16])
-                                    #self.logger.debug('Starttime: {}\nLogtime: {}\nEndtime:{}'.format(starttime,logtime,endtime))
-                                    if starttime <logtime <endtime:
-                                        i = 0
-                                        while(i<int(maximumlines) and index+i < num_lines):
-                                            newOutput+= fileLines[index+i] + '\n'
-                                            i+=1
-                                            outputfound = True
-                        memFile = io.BytesIO(newOutput.encode('utf8'))
-                        files = {'object': (None, '{ "name": '+logname+'_'+ deviceid +', type: text/plain }'), 'file': (logname+'_'+ deviceid, memFile, 'text/plain')}
-                        binaryurl = self.agent.rest_client.upload_event_logfile(mo_id, files)
-                        if binaryurl:
-                            self._set_success(binaryurl)
-                            self.logger.debug("LogHandler uploaded Binary under following URL: "+binaryurl)
-                        else:
-                            self._set_failed('Could not upload logfile')
-                    else:
-                        #print('Searchstring is not inside file.')
+                path = self.agent.path / 'agent.log'
+                if self.archive is None or self.archive.path != path:
+                    self.archive = LogArchive(path)
+                lines = self.archive.query(starttime, endtime, searchtext, maximumlines)
+                # Only peek at the first line, the rest is streamed while uploading
+                first = next(lines, None)
+                if first is None:
+                    if searchtext:
                         self._set_failed('Searchstring is not inside file')
-                #after the 'with' statement everything is closed to free the memorybuffer
-                f.close()
+                    else:
+                        self._set_failed('No log entries found in the requested time range')
+                    return
+                binaryurl = self.agent.rest_client.upload_event_logfile(mo_id, logname + '_' + deviceid, itertools.chain([first], lines))
+                if binaryurl:
+                    self._set_success(binaryurl)
+                    self.logger.debug("LogHandler uploaded Binary under following URL: "+binaryurl)
+                else:
+                    self._set_failed('Could not upload logfile')
                 self.logger.debug("logfilerequest handled")
         except Exception as e:
             self._set_failed(str(e))
-
@@ -39,6 +39,9 @@ class MeasurementRequestHandler(Initializer, Listener):
     def getSupportedTemplates(self):
         return []
 
+    def getSupportedMessages(self):
+        return [('s/ds', '517')]
+
     def _set_executing(self):
         executing = SmartRESTMessage('s/us', '501', [self.fragment])
         #print("Executing MSG send")
@@ -101,3 +101,7 @@ class RemoteAccessListener(Listener):
 
     def getSupportedTemplates(self):
         return [self.xid]
+
+    def getSupportedMessages(self):
+        return [('s/ds', self.remote_access_default_template),
+                (f's/dc/{self.xid}', self.remote_access_op_template)]
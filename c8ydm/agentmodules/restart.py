@@ -30,6 +30,8 @@ class Restart(Listener, Initializer):
             executing = SmartRESTMessage('s/us', '501', ['c8y_Restart'])
             self.agent.publishMessage(executing)
             try:
+                # A restart requested by the platform resyncs the full software list
+                self.agent.software_inventory.request_full()
                 if self.agent.simulated:
                     process = subprocess.Popen(["docker","restart",self.serial],stdout=subprocess.PIPE, stderr=subprocess.PIPE)
                     process.wait()
@@ -46,6 +48,12 @@ class Restart(Listener, Initializer):
     def getSupportedTemplates(self):
         return []
 
+    def getSupportedMessages(self):
+        return [('s/ds', '510')]
+
+    def getConcurrency(self, message):
+        return ('exclusive', None)
+
     def getMessages(self):
         response = SmartRESTMessage('s/us', '503', ['c8y_Restart', 'Restart Successful'])
         return [response]
\ No newline at end of file
@@ -21,14 +21,13 @@ import json
 import re
 import logging
 from operator import contains
-import time
 import subprocess as sp
 import pathlib
 from os.path import expanduser
 
 from c8ydm.core.apt_package_manager import AptPackageManager
 from c8ydm.framework.modulebase import Initializer, Listener
-from c8ydm.framework.smartrest import SmartRESTMessage
+from c8ydm.framework.smartrest import SmartRESTMessage, chunked_messages
 from c8ydm.utils import Configuration
 
 
@@ -108,10 +107,7 @@ class SoftwareManager(Listener, Initializer):
                         finished = SmartRESTMessage(
                             's/us', '502', ['c8y_SoftwareUpdate', ' - '.join(errors)])
                     self.agent.publishMessage(finished)
-                    if self.agent.token_received.wait(timeout=self.agent.refresh_token_interval):
-                        installed_software = self.apt_package_manager.get_installed_software_json(False)
-                        mo_id = self.agent.rest_client.get_internal_id(self.agent.serial)
-                        self.agent.rest_client.update_managed_object(mo_id, json.dumps(installed_software))
+                    self._report_installed_software()
                 else:
                     # Binary included in software update
                     self.logger.info(f'Software Updated with provided file {url}')
@@ -129,10 +125,7 @@ class SoftwareManager(Listener, Initializer):
                             finished = SmartRESTMessage(
                                 's/us', '503', ['c8y_SoftwareUpdate'])
                             self.agent.publishMessage(finished)
-                        if self.agent.token_received.wait(timeout=self.agent.refresh_token_interval):
-                            installed_software = self.apt_package_manager.get_installed_software_json(False)
-                            mo_id = self.agent.rest_client.get_internal_id(self.agent.serial)
-                            self.agent.rest_client.update_managed_object(mo_id, json.dumps(installed_software))
+                        self._report_installed_software()
                                 
 
             if 's/ds' in message.topic and message.messageId == '529' and self.packagemanager=="apt":
@@ -163,14 +156,8 @@ class SoftwareManager(Listener, Initializer):
                         softwareToInstall, True, True)
                     for software in software_installed:
                         self.logger.info(f'Software processed: {software}')
-                        action = software['action']
-                        name = software['name']
-                        type = software['type']
-                        version = software['version']
-                        if action == 'install' or action == 'update':
-                            self.agent.publishMessage(SmartRESTMessage('s/us', '141', [name, version, type, 'test']))
-                        if action == 'delete':
-                            self.agent.publishMessage(SmartRESTMessage('s/us', '142', [name, version]))
+                    # Added and removed packages are reported as 141/142 delta
+                    self._report_installed_software()
                     self.logger.info('Finished all software update')
                     if len(errors) == 0:
                         # finished without errors
@@ -199,7 +186,7 @@ class SoftwareManager(Listener, Initializer):
                         else:
                             finished = SmartRESTMessage(
                                 's/us', '503', ['c8y_SoftwareUpdate'])
-                            self.agent.publishMessage(SmartRESTMessage('s/us', '141', [name, version, type, '']))
+                            self._report_installed_software()
                             self.agent.publishMessage(finished)
                             #self.agent.publishMessage(
                             #    self.apt_package_manager.getInstalledSoftware(False))
@@ -219,24 +206,15 @@ class SoftwareManager(Listener, Initializer):
                 softwareToInstall = [messages[x:x + 5]
                                      for x in range(0, len(messages), 5)]
                 for software in softwareToInstall:
-                    name = software[0]
-                    version = software[1]
-                    type = software[2]
                     url = software[3]
-                    action = software[4]
                     if 'binaries' in url:
                         # File provided
                         binary_included = True
+                # Changed snaps are reported as 141/142 by installSnap
                 errors = self.installSnap(softwareToInstall)
-                self.logger.debug("---------------------")
                 for software in softwareToInstall:
                     self.logger.info(f'Software processed: {software}')
-                    name = software
-                    type = 'snap'
-                    version = software[0]
                 self.logger.info('Finished all software update')
-                self.logger.debug("Sending all installed software via mqtt")
-                self.agent.publishMessage(self.getInstalledSnaps())
                 if len(errors) == 0:
                     # finished without errors
                     finished = SmartRESTMessage(
@@ -273,12 +251,8 @@ class SoftwareManager(Listener, Initializer):
                     # finished with errors
                     finished = SmartRESTMessage(
                         's/us', '502', ['c8y_SoftwareList', ' - '.join(errors)])
-                installed_software = self.apt_package_manager.get_installed_software_json(False)
-                mo_id = self.agent.rest_client.get_internal_id(self.agent.serial)
-                self.agent.rest_client.update_managed_object(mo_id, json.dumps(installed_software))
+                self._report_installed_software()
                 self.agent.publishMessage(finished)
-                self.agent.publishMessage(
-                    self.apt_package_manager.getInstalledSoftware(False))
                 
             if 's/ds' in message.topic and message.messageId == '516' and self.packagemanager=="snap":
                 # When multiple operations received just take the first one for further processing
@@ -293,33 +267,18 @@ class SoftwareManager(Listener, Initializer):
                 self.agent.publishMessage(executing)
                 softwareToInstall = [messages[x:x + 3]
                                      for x in range(0, len(messages), 3)]
-                if not self.agent.snapdClient.isBusy:
-                    self.agent.snapdClient.isBusy = True
-                    installedSoftware = self.getFormatedSnaps()
-                    errors = self.installSnap(installedSoftware, softwareToInstall)
-                    logging.info('Finished all software update')
-                    if len(errors) == 0:
-                        # finished without errors
-                        finished = SmartRESTMessage('s/us', '503', ['c8y_SoftwareList'])
-                    else:
-                        # finished with errors
-                        finished = SmartRESTMessage('s/us', '502', ['c8y_SoftwareList', ' - '.join(errors)])
-                    self.agent.publishMessage(finished)
-                    self.agent.publishMessage(self.getInstalledSnaps())
-                    self.agent.snapdClient.isBusy = False
-                else:
-                    executing = SmartRESTMessage(
-                    's/us', '502', ['c8y_SoftwareList','Snapd is busy'])
-                self.agent.publishMessage(executing)
-                self.logger.info('Finished all software update')
+                # Listed snaps are installed or refreshed, unlisted ones are not removed
+                snapshot = self.agent.snapdClient.inventory.snapshot()
+                errors = self.installSnap(snapshot.updateActions(softwareToInstall))
+                logging.info('Finished all software update')
                 if len(errors) == 0:
                     # finished without errors
-                    finished = SmartRESTMessage(
-                        's/us', '503', ['c8y_SoftwareList'])
+                    finished = SmartRESTMessage('s/us', '503', ['c8y_SoftwareList'])
                 else:
                     # finished with errors
-                    finished = SmartRESTMessage(
-                        's/us', '502', ['c8y_SoftwareList', ' - '.join(errors)])
+                    finished = SmartRESTMessage('s/us', '502', ['c8y_SoftwareList', ' - '.join(errors)])
+                self.agent.publishMessage(finished)
+                self._publish_installed_snaps()
         except Exception as e:
             self.logger.exception(e)
             failed = SmartRESTMessage(
@@ -339,122 +298,101 @@ class SoftwareManager(Listener, Initializer):
     def getSupportedTemplates(self):
         return []
 
+    def getSupportedMessages(self):
+        return [('s/ds', '528'), ('s/ds', '529'), ('s/ds', '516')]
+
+    def getConcurrency(self, message):
+        # apt and snapd operations must not run at the same time
+        return ('resource', 'packages')
+
     def getMessages(self):
         if self.packagemanager == "apt": 
-            installed_software = self.apt_package_manager.get_installed_software_json(False)
-            if self.agent.token_received.wait(timeout=self.agent.refresh_token_interval):
-                mo_id = self.agent.rest_client.get_internal_id(self.agent.serial)
-                #self.agent.rest_client.update_managed_object(mo_id, json.dumps(installed_software))
-                self.agent.rest_client.set_adv_software_list(mo_id, installed_software)
+            self._report_installed_software()
             #return self.apt_package_manager.getInstalledSoftware(True)
         elif self.packagemanager == "snap":
-            installed_software = self.getInstalledSnaps()
-            return [installed_software]
+            return self._getSnapMessages()
         return None
     
+    def _report_installed_software(self, full=False):
+        installed_software = self.apt_package_manager.get_installed_software_json(False)
+        self.agent.software_inventory.report(
+            installed_software, self._publish_delta, self._send_software_list, full, self._device_key())
+
+    def _device_key(self):
+        if not self.agent.token_received.wait(timeout=self.agent.refresh_token_interval):
+            return None
+        return self.agent.rest_client.get_device_key()
+
+    def _publish_delta(self, message):
+        # The delta is only remembered as reported once the broker received it
+        return self.agent.publishMessage(message, qos=1, wait_for_publish=True)
+
+    def _send_software_list(self, installed_software):
+        if not self.agent.token_received.wait(timeout=self.agent.refresh_token_interval):
+            return False
+        mo_id = self.agent.rest_client.get_internal_id(self.agent.serial)
+        return self.agent.rest_client.set_adv_software_list(mo_id, installed_software)
+
+    def _publish_installed_snaps(self):
+        for message in self._getSnapMessages():
+            self.agent.publishMessage(message)
+
+    def _getSnapMessages(self):
+        """
+        Returns the messages reporting the installed snaps: the full list on the
+        first report, afterwards only the changes since the last report.
+        """
+        inventory = self.agent.snapdClient.inventory
+        snapshot, added, removed = inventory.unreported()
+        if added is None:
+            messages = self.getInstalledSnaps(snapshot)
+        else:
+            messages = []
+            if removed:
+                messages += chunked_messages('s/us', [[snap.name, snap.version + ' - ' + snap.channel]
+                                                      for snap in removed], '142', '142')
+            if added:
+                messages += chunked_messages('s/us', [[snap.name, snap.version + ' - ' + snap.channel, 'snap', ' ']
+                                                      for snap in added], '141', '141')
+        inventory.markReported(snapshot)
+        return messages
+
     def getFormatedSnaps(self):
-        snapd = self.agent.snapdClient
-        installedSnaps = snapd.getInstalledSnaps()
         allInstalled = {}
-        for snap in installedSnaps['result']:
-            allInstalled[snap['name']] = {
-                'version': snap['version'],
-                'channel': snap['channel'],
+        for snap in self.agent.snapdClient.inventory.snapshot():
+            allInstalled[snap.name] = {
+                'version': snap.version,
+                'channel': snap.channel,
                 'softwareType': 'snap',
                 'url': ' '
             }
         return allInstalled
     
-    def getInstalledSnaps(self):
-        snapd = self.agent.snapdClient
-        installedSnaps = snapd.getInstalledSnaps()
-        logging.debug(installedSnaps)
+    def getInstalledSnaps(self, snapshot=None):
+        if snapshot is None:
+            snapshot = self.agent.snapdClient.inventory.snapshot()
         allInstalled = []
-        for snap in installedSnaps['result']:
-            snapInfo = []
-            # Name
-            snapInfo.append(snap['name'])
-            # Version
-            snapInfo.append(snap['version'] + ' - ' + snap['channel'])
-            # Software Type
-            snapInfo.append('snap')
-            # URL
-            snapInfo.append(' ')
-            allInstalled.extend(snapInfo)
-        return SmartRESTMessage('s/us', '140', allInstalled)
+        for snap in snapshot:
+            # Name, Version, Software Type, URL
+            allInstalled.append([snap.name, snap.version + ' - ' + snap.channel, 'snap', ' '])
+        # 140 with the first snaps, further ones are appended with 141
+        return chunked_messages('s/us', allInstalled)
     
     def installSnap(self, toBeInstalled):
         snapd = self.agent.snapdClient
-        wantedSnaps = []
-        errors = []
+        actions = {'install': 'install', 'update': 'refresh', 'delete': 'remove'}
+        requested = []
         for software in toBeInstalled:
             name = software[0]
-            wantedSnaps.append(name)
-            channel = software[1].split('##')[-1]
-            toBeVersion = software[1].split('##')[0]
-            action = software[4]
-            if action == "install":
-                # try install
-                logging.info('Install snap "%s" with channel "%s"', name, channel)
-                response = snapd.installSnap(name, channel)
-                if response['status-code'] >= 400:
-                    logging.error('Snap %s error: %s', name, response['result']['message'])
-                    errors.append('Snap' + name + ' error: ' + response['result']['message'])
-                elif response['status-code'] == 202 or response['status-code']== 200 or response['status-code']  == 201:
-                    changeId = response['change']
-                    changeStatus = self.getChangeStatus(changeId)
-                    while not changeStatus['finished']:
-                        time.sleep(3)
-                        changeStatus = self.getChangeStatus(changeId)
-                    logging.debug('Finished snap ' + name)
-                    self.agent.publishMessage(SmartRESTMessage('s/us', '141', [name, toBeVersion, 'version', ' ']))
-                    if changeStatus['error']:
-                        errors.append(changeStatus['error'])
-            elif action == "update":
-                # try update
-                    logging.info('Update snap "%s" with channel "%s"', name, channel)
-                    response = snapd.updateSnaps(name, channel)
-                    if response['status-code'] >= 400:
-                        logging.error('Snap %s error: %s', name, response['result']['message'])
-                        errors.append('Snap' + name + ' error: ' + response['result']['message'])
-                    elif response['status-code'] == 202 or response['status-code']== 200 or response['status-code']  == 201:
-                        changeId = response['change']
-                        changeStatus = self.getChangeStatus(changeId)
-                        while not changeStatus['finished']:
-                            time.sleep(3)
-                            changeStatus = self.getChangeStatus(changeId)
-                        logging.debug('Finished snap ' + name)
-                        if changeStatus['error']:
-                            errors.append(changeStatus['error'])
-            elif action == "delete":
-                # try remove
-                    logging.info('Remove snap "%s" with channel "%s"', name, channel)
-                    response = snapd.deleteSnap(name)
-                    if response['status-code'] >= 400:
-                        logging.error('Snap %s error: %s', name, response['result']['message'])
-                        errors.append('Snap' + name + ' error: ' + response['result']['message'])
-                    elif response['status-code'] == 202 or response['status-code']== 200 or response['status-code']  == 201:
-                        changeId = response['change']
-                        changeStatus = self.getChangeStatus(changeId)
-                        while not changeStatus['finished']:
-                            time.sleep(3)
-                            changeStatus = self.getChangeStatus(changeId)
-                        logging.debug('Finished snap ' + name)
-                        if changeStatus['error']:
-                            errors.append(changeStatus['error'])
-            else:
-                pass
+            # Version is given as version##channel, the channel is optional
+            channel = software[1].split('##')[-1] if '##' in software[1] else None
+            action = actions.get(software[4])
+            if action:
+                logging.info('%s snap "%s" with channel "%s"', action, name, channel)
+                requested.append((name, action, channel))
+        results = snapd.applySnapActions(requested)
+        # Snaps of one failed bulk change share their error, it is reported once
+        errors = list(dict.fromkeys(error for error in results.values() if error))
+        # Report what actually changed on the device as 141/142
+        self._publish_installed_snaps()
         return errors
-    
-    def getChangeStatus(self, changeId):
-        snapd = self.agent.snapdClient
-        changeStatus = snapd.getChangeStatus(changeId)
-        error = None
-        finished = changeStatus['result']['status'] == 'Done'
-        if not finished and changeStatus['result']['status'] == 'Error':
-            finished = True
-            error = changeStatus['result']['err']
-        return {
-            'finished': finished,
-            'error': error
-        }
@@ -26,14 +26,26 @@ import paho.mqtt.client as mqtt
 
 import c8ydm.utils.moduleloader as moduleloader
 from c8ydm.client.rest_client import RestClient
+from c8ydm.core.backoff import ExponentialBackoff
 from c8ydm.core.configuration import ConfigurationManager
+from c8ydm.core.dispatcher import OperationDispatcher, OperationExecutor
+from c8ydm.core.message_batcher import MessageBatcher
+from c8ydm.core.outbound_queue import OutboundQueue
+from c8ydm.core.scheduler import SensorScheduler
+from c8ydm.core.software_inventory import SoftwareInventory
 from c8ydm.framework.smartrest import SmartRESTMessage
 from c8ydm.utils.snapd_client import SnapdClient
 
 
 class Agent():
+    STATE_DISCONNECTED = 'DISCONNECTED'
+    STATE_CONNECTING = 'CONNECTING'
+    STATE_CONNECTED = 'CONNECTED'
+    STATE_STOPPED = 'STOPPED'
     __sensors = []
     __listeners = []
+    __routes = {}
+    __unrouted_listeners = []
     __supportedOperations = set()
     __supportedTemplates = set()
     stopmarker = 0
@@ -66,8 +78,40 @@ class Agent():
         self.refresh_token_interval = 60
         self.token = None
         self.is_connected = False
+        self.state = self.STATE_DISCONNECTED
+        self.connect_result = threading.Event()
+        self.connection_lost = threading.Event()
+        self.connect_rc = None
+        self.disconnected_at = None
+        self.last_reconnect_seconds = None
+        self.connect_timeout = int(self.configuration.getValue('mqtt', 'connect.timeout.seconds') or 30)
+        self.publish_timeout = float(self.configuration.getValue('mqtt', 'publish.timeout.seconds') or 30)
+        self.backoff = ExponentialBackoff(
+            self.configuration.getValue('mqtt', 'reconnect.min.seconds') or 1,
+            self.configuration.getValue('mqtt', 'reconnect.max.seconds') or 300)
+        self.__subscriptions = []
         self.rest_client = RestClient(self)
-        self.snapdClient = SnapdClient()
+        self.snapdClient = SnapdClient(
+            float(self.configuration.getValue('software', 'snap.changes.check.seconds') or 30))
+        inventory_max_delta = self.configuration.getValue('software', 'inventory.max.delta') or 100
+        self.software_inventory = SoftwareInventory(self.path / 'software_inventory.json', int(inventory_max_delta))
+        dispatcher_workers = self.configuration.getValue('agent', 'dispatcher.workers') or 4
+        dispatcher_queue_size = self.configuration.getValue('agent', 'dispatcher.queue.size') or 100
+        self.dispatcher = OperationDispatcher(
+            int(dispatcher_workers), int(dispatcher_queue_size), 'ListenerThread')
+        self.dispatcher.start()
+        self.executor = OperationExecutor(self.dispatcher, int(dispatcher_queue_size))
+        outbound_queue_size = self.configuration.getValue('mqtt', 'outbound.queue.size') or 10000
+        self.outbound_drain_rate = float(self.configuration.getValue('mqtt', 'outbound.queue.drain.rate') or 20)
+        self.outbound_queue = OutboundQueue(self.path / 'outbound.db', int(outbound_queue_size))
+        self.outbound_lock = threading.Lock()
+        self.outbound_draining = False
+        batch_linger = float(self.configuration.getValue('mqtt', 'batch.linger.ms') or 100) / 1000
+        batch_max_bytes = self.configuration.getValue('mqtt', 'batch.max.bytes') or 16000
+        self.batcher = MessageBatcher(self.__publish, int(batch_max_bytes), batch_linger)
+        scheduler_workers = self.configuration.getValue('agent', 'scheduler.workers') or 2
+        self.scheduler = SensorScheduler(
+            self.handle_sensor_message, lambda: self.interval, int(scheduler_workers))
         if self.simulated:
             self.model = 'docker'
         else:
@@ -89,79 +133,101 @@ class Agent():
                     self.publishMessage(message)
 
     def run(self):
-        try:
-            self.logger.info('Starting agent')
-            self.__client = mqtt.Client(self.serial)
-            credentials = self.configuration.getCredentials()
-            self.__client = self.connect(
-                credentials, self.serial, self.url, int(self.port), int(self.ping))
-            self.__client.loop_start()
-            while not self.is_connected:
-                time.sleep(1)
-                self.logger.debug('Waiting for MQTT Client to be connected')
-            self.__init_agent()
-            while not self.stopmarker:
-                self.logger.debug('New cycle')
-                self.interval = int(self.configuration.getValue(
-                    'agent', 'main.loop.interval.seconds'))
-                for sensor in self.__sensors:
-                    sensor_thread = threading.Thread(target=self.handle_sensor_message, args=(sensor,))
-                    sensor_thread.daemon = True
-                    sensor_thread.name = f'SensorThread-{sensor.__class__.__name__}'
-                    sensor_thread.start()
-                    #_thread.start_new_thread(self.handle_sensor_message, (sensor,))
-                time.sleep(self.interval)
-        except Exception as e:
-            self.logger.exception(f'Error in C8Y Agent: {e}', e)
+        """
+        Connection state machine: connects, initializes the agent on the first connection,
+        supervises the connection and reconnects with exponential backoff and jitter.
+        """
+        self.logger.info('Starting agent')
+        initialized = False
+        while not self.stopmarker:
+            try:
+                self.__set_state(self.STATE_CONNECTING)
+                self.__client = mqtt.Client(self.serial)
+                credentials = self.configuration.getCredentials()
+                self.connect(credentials, self.serial, self.url, int(self.port), int(self.ping))
+                if not self.connect_result.wait(timeout=self.connect_timeout):
+                    raise ConnectionError(f'No connection acknowledgement within {self.connect_timeout} sec.')
+                if self.connect_rc != 0:
+                    raise ConnectionError(f'Connection refused with result code {self.connect_rc}')
+                self.__set_state(self.STATE_CONNECTED)
+                self.backoff.reset()
+                if self.disconnected_at is not None:
+                    self.last_reconnect_seconds = time.monotonic() - self.disconnected_at
+                    self.disconnected_at = None
+                    self.logger.info(f'Reconnected after {self.last_reconnect_seconds:.1f} sec.')
+                if not initialized:
+                    self.__init_agent()
+                    self.scheduler.start(self.__sensors)
+                    initialized = True
+                else:
+                    self.__subscribe()
+                    self.__start_token_thread()
+                while not self.stopmarker and not self.connection_lost.is_set():
+                    self.logger.debug('New cycle')
+                    self.logger.debug(f'Dispatcher metrics: {self.dispatcher.get_metrics()}')
+                    self.logger.debug(f'Executor metrics: {self.executor.get_metrics()}')
+                    self.logger.debug(f'Sensor metrics: {self.scheduler.get_metrics()}')
+                    self.interval = int(self.configuration.getValue(
+                        'agent', 'main.loop.interval.seconds'))
+                    self.connection_lost.wait(self.interval)
+            except Exception as e:
+                self.logger.exception(f'Error in C8Y Agent: {e}')
+            if self.stopmarker:
+                break
+            if self.disconnected_at is None:
+                self.disconnected_at = time.monotonic()
             self.disconnect(self.__client)
-            self.logger.info('Will retry to connect to C8Y in 5 sec...')
-            time.sleep(5)
-            # Run again after 5 sec. delay.
-            self.run()
+            self.__set_state(self.STATE_DISCONNECTED)
+            delay = self.backoff.next_delay()
+            self.logger.info(f'Will retry to connect to C8Y in {delay:.1f} sec. (attempt {self.backoff.attempts})')
+            time.sleep(delay)
+        self.__set_state(self.STATE_STOPPED)
+
+    def __set_state(self, state):
+        if self.state != state:
+            self.logger.info(f'Connection state {self.state} -> {state}')
+            self.state = state
 
     def connect(self, credentials, serial, url, port, ping):
-        try:
-            self.__client.on_connect = self.__on_connect
-            self.__client.on_message = self.__on_message
-            self.__client.on_disconnect = self.__on_disconnect
-            #self.__client.on_subscribe = self.__on_subscribe
-            self.__client.on_log = self.__on_log
-
-            if self.tls:
-                if self.cert_auth:
-                    self.logger.debug('Using certificate authenticaiton')
-                    self.__client.tls_set(certifi.where(),
-                                          certfile=self.client_cert,
-                                          keyfile=self.client_key,
-                                          tls_version=ssl.PROTOCOL_TLSv1_2,
-                                          cert_reqs=ssl.CERT_NONE
-                                          )
-                else:
-                    self.__client.tls_set(certifi.where())
-                    self.__client.username_pw_set(
-                        credentials[0]+'/' + credentials[1], credentials[2])
+        self.connect_result.clear()
+        self.connection_lost.clear()
+        self.connect_rc = None
+        self.__client.on_connect = self.__on_connect
+        self.__client.on_message = self.__on_message
+        self.__client.on_disconnect = self.__on_disconnect
+        #self.__client.on_subscribe = self.__on_subscribe
+        self.__client.on_log = self.__on_log
+
+        if self.tls:
+            if self.cert_auth:
+                self.logger.debug('Using certificate authenticaiton')
+                self.__client.tls_set(certifi.where(),
+                                      certfile=self.client_cert,
+                                      keyfile=self.client_key,
+                                      tls_version=ssl.PROTOCOL_TLSv1_2,
+                                      cert_reqs=ssl.CERT_NONE
+                                      )
             else:
+                self.__client.tls_set(certifi.where())
                 self.__client.username_pw_set(
                     credentials[0]+'/' + credentials[1], credentials[2])
+        else:
+            self.__client.username_pw_set(
+                credentials[0]+'/' + credentials[1], credentials[2])
 
-            self.__client.connect(url, int(port), int(ping))
-            self.__client.loop_start()
-            return self.__client
-        except Exception as e:
-            self.logger.exception(f'Error on connecting C8Y Agent: {e}', e)
-            self.disconnect(self.__client)
-            self.logger.info('Will retry to connect to C8Y in 5 sec...')
-            time.sleep(5)
-            # Run again after 5 sec. delay.
-            return self.run()
+        self.__client.connect(url, int(port), int(ping))
+        self.__client.loop_start()
+        return self.__client
 
     def disconnect(self, client):
         self.logger.info("Disconnecting MQTT Client")
         self.__client = None
         if client == None:
+            self.is_connected = False
             return
         client.loop_stop()  # stop the loop
         client.disconnect()
+        self.is_connected = False
         if self.cert_auth:
             self.logger.info("Stopping refresh token thread")
             self.stop_event.set()
@@ -170,8 +236,23 @@ class Agent():
     def stop(self):
         msg = SmartRESTMessage('s/us', '400', ['c8y_AgentStopEvent', 'C8Y DM Agent stopped'])
         self.publishMessage(msg, qos=0, wait_for_publish=True)
-        self.disconnect(self.__client)
+        self.batcher.stop()
+        self.scheduler.stop()
+        self.__stop_modules()
         self.stopmarker = 1
+        self.disconnect(self.__client)
+        self.connection_lost.set()
+
+    def __stop_modules(self):
+        modules = []
+        for module in self.__sensors + self.__listeners:
+            if module not in modules:
+                modules.append(module)
+        for module in modules:
+            try:
+                module.stop()
+            except Exception as e:
+                self.logger.error(f'Error on stopping {module.__class__.__name__}: {e}')
 
     def pollPendingOperations(self):
         while not self.stopmarker:
@@ -192,15 +273,7 @@ class Agent():
         #self.__client.subscribe('s/dat',2)
 
         # Refresh Token for REST Requests
-        if self.cert_auth:
-            self.logger.info("Starting refresh token thread ")
-            token_thread = threading.Thread(target=self.refresh_token)
-            token_thread.daemon = True
-            token_thread.name = f'TokenThread-1'
-            token_thread.start()
-        else:
-            # For non cert-auth don't wait for token retrieval.
-            self.token_received.set()
+        self.__start_token_thread()
         
         # set Device Name
         msg = SmartRESTMessage('s/us', '100', [self.device_name, self.device_type])
@@ -254,6 +327,7 @@ class Agent():
             #_thread.start_new_thread(self.handle_initializer_message, (currentInitializer,))
 
         classCache = None
+        self.__build_routes()
 
         # set supported operations
         self.logger.info('Supported operations:')
@@ -278,37 +352,84 @@ class Agent():
         self.publishMessage(modelMsg)
 
         # If supported Operations is set subscribe to s/ds
-        self.__client.subscribe('s/ds')
-        self.__client.subscribe('s/dat',2)
+        self.__subscriptions = [('s/e', 0), ('s/ds', 0), ('s/dat', 2)]
 
         # subscribe additional topics
         for xid in self.__supportedTemplates:
             self.logger.info('Subscribing to XID: %s', xid)
-            self.__client.subscribe('s/dc/' + xid)
+            self.__subscriptions.append(('s/dc/' + xid, 0))
+        self.__subscribe()
 
         # Set all dangling Operations to failed on Agent start
       
         internald_id = self.rest_client.get_internal_id(self.serial)
-        ops = self.rest_client.get_all_dangling_operations(internald_id)
-        self.rest_client.set_operations_to_failed(ops)
+        if internald_id is None:
+            self.logger.warning(f'Internal id of {self.serial} not available, dangling operations are not set to failed')
+        else:
+            ops = self.rest_client.get_all_dangling_operations(internald_id)
+            self.rest_client.set_operations_to_failed(ops)
+
 
+    def __subscribe(self):
+        """
+        Subscribes to all topics of the agent with a single SUBSCRIBE packet.
+        """
+        if self.__subscriptions:
+            self.__client.subscribe(self.__subscriptions)
+
+    def __start_token_thread(self):
+        if self.cert_auth:
+            self.logger.info("Starting refresh token thread ")
+            # Every token thread gets its own stop event, so that a thread of a previous
+            # connection can not be revived
+            self.stop_event.set()
+            self.stop_event = threading.Event()
+            token_thread = threading.Thread(target=self.refresh_token, args=(self.stop_event,))
+            token_thread.daemon = True
+            token_thread.name = f'TokenThread-1'
+            token_thread.start()
+        else:
+            # For non cert-auth don't wait for token retrieval.
+            self.token_received.set()
+
+    def __build_routes(self):
+        """
+        Indexes the listeners by the (topic, messageId) pairs they declare so that
+        incoming messages are only passed to interested listeners.
+        """
+        routes = {}
+        unrouted_listeners = []
+        for listener in self.__listeners:
+            supported_messages = listener.getSupportedMessages()
+            if supported_messages is None:
+                unrouted_listeners.append(listener)
+                continue
+            for topic, message_id in supported_messages:
+                key = (topic, str(message_id))
+                if listener not in routes.setdefault(key, []):
+                    routes[key].append(listener)
+        self.__routes = routes
+        self.__unrouted_listeners = unrouted_listeners
+        self.logger.debug(f'Routing {len(routes)} message types, {len(unrouted_listeners)} listeners receive all messages')
+
+    def __get_listeners(self, message):
+        listeners = self.__routes.get((message.topic, message.messageId), []) + \
+            self.__routes.get((None, message.messageId), [])
+        return listeners + self.__unrouted_listeners
 
     def __on_connect(self, client, userdata, flags, rc):
         try:
             self.logger.info('Agent connected with result code: ' + str(rc))
+            self.connect_rc = rc
             if rc > 0:
-                self.logger.warning(
-                    'Disconnecting Agent and try to re-connect manually..')
-                # TODO What should be done when rc != 0? Reconnect? Abort?
-                self.disconnect(self.__client)
-                time.sleep(5)
-                self.logger.info('Restarting Agent ..')
-                self.run()
-                #self.snapdClient.restartSnap('c8ydm')
+                self.logger.warning('Connection refused, agent will reconnect with backoff')
             else:
                 self.is_connected = True
+                self.__start_outbound_drain()
         except Exception as ex:
             self.logger.error(ex)
+        finally:
+            self.connect_result.set()
 
     def __on_message(self, client, userdata, msg):
         try:
@@ -323,47 +444,129 @@ class Agent():
                 self.logger.debug('New JWT Token received')
                 self.rest_client.update_token(self.token)
                 self.token_received.set()
-            for listener in self.__listeners:
+            for listener in self.__get_listeners(message):
                 self.logger.debug('Trigger listener ' +
                               listener.__class__.__name__)
-                listener_thread = threading.Thread(target=listener.handleOperation, args=(message,))
-                listener_thread.daemon = True
-                listener_thread.name = f'ListenerThread-{listener.__class__.__name__}'
-                listener_thread.start()
-                #_thread.start_new_thread(listener.handleOperation, (message,))
+                try:
+                    # A message redelivered while the first one still waits is run once
+                    key = (listener.__class__.__name__, msg.topic, decoded)
+                    self.executor.submit(listener.getConcurrency(message), listener.handleOperation, message, key=key)
+                except Exception as e:
+                    self.logger.error(f'Error on submitting operation to {listener.__class__.__name__}: {e}')
         except Exception as e:
             self.logger.error(f'Error on handling MQTT Message.', e)
 
     def __on_disconnect(self, client, userdata, rc):
         self.logger.debug("on_disconnect rc: " + str(rc))
-        # if rc==5:
-        #     self.reset()
-        #     return
+        self.is_connected = False
         if rc != 0:
             self.logger.error(f'Disconnected with result code {rc}! Trying to reconnect...')
-            #self.__client.reconnect()
-            time.sleep(5)
-            # Run again after 5 sec. delay.
-            return self.run()
+            if self.disconnected_at is None:
+                self.disconnected_at = time.monotonic()
+            self.connection_lost.set()
 
     def __on_log(self, client, userdata, level, buf):
         self.logger.log(level, buf)
 
     def publishMessage(self, message, qos=0, wait_for_publish=False):
+        """
+        Publishes or spools the message. With wait_for_publish returns False if the
+        broker did not acknowledge it within publish.timeout.seconds, e.g. because
+        the client was replaced by a reconnect in the meantime.
+        """
         self.logger.debug(f'Send: topic={message.topic} msg={message.getMessage()}')
-        if self.__client is not None and self.__client.is_connected:
+        if message.messageId == '500':
+            # Polling for pending operations is neither batched nor worth to be resent.
+            # Status updates still lingering in the batcher go first, so operations
+            # already executing are not redelivered as pending.
+            self.batcher.flush()
+            return self.__publish(message.topic, message.getMessage(), qos, spool=False)
+        elif wait_for_publish:
+            # Keep the order with messages still lingering in the batcher
+            self.batcher.flush()
+            return self.__publish(message.topic, message.getMessage(), qos, wait_for_publish=True)
+        else:
+            self.batcher.add(message.topic, message.getMessage(), qos)
+            return True
+
+    def __publish(self, topic, payload, qos=0, wait_for_publish=False, spool=True):
+        client = self.__client
+        if client is not None and client.is_connected() and self.outbound_queue.size() == 0:
+            info = client.publish(topic, payload, qos)
             if wait_for_publish:
-                self.__client.publish(message.topic, message.getMessage(), qos).wait_for_publish()
-            else:
-                self.__client.publish(message.topic, message.getMessage(), qos)
+                try:
+                    info.wait_for_publish(self.publish_timeout)
+                except (RuntimeError, ValueError) as e:
+                    self.logger.warning(f'Message to {topic} not published: {e}')
+                    return False
+                if not info.is_published():
+                    self.logger.warning(f'Message to {topic} not acknowledged within {self.publish_timeout} sec.')
+                    return False
+            return True
+        elif spool:
+            # Spool while disconnected or while older messages are still pending to keep the order
+            self.outbound_queue.put(topic, payload, qos)
+            self.__start_outbound_drain()
+            return True
+        return False
+
+    def __start_outbound_drain(self):
+        with self.outbound_lock:
+            if self.outbound_draining or not self.is_connected or self.outbound_queue.size() == 0:
+                return
+            self.outbound_draining = True
+        drain_thread = threading.Thread(target=self.__drain_outbound_queue)
+        drain_thread.daemon = True
+        drain_thread.name = 'OutboundQueueThread'
+        drain_thread.start()
+
+    def __drain_outbound_queue(self):
+        """
+        Publishes spooled messages in order, limited to outbound.queue.drain.rate
+        messages per second. Stops as soon as the client is disconnected.
+        """
+        interval = 1.0 / self.outbound_drain_rate if self.outbound_drain_rate > 0 else 0
+        drained = 0
+        try:
+            while True:
+                client = self.__client
+                if client is None or not client.is_connected():
+                    break
+                batch = self.outbound_queue.peek(50)
+                if not batch:
+                    with self.outbound_lock:
+                        # Re-check under the lock, publishMessage may have spooled meanwhile
+                        if self.outbound_queue.size() == 0:
+                            self.outbound_draining = False
+                            break
+                    continue
+                for message_id, topic, payload, qos in batch:
+                    info = client.publish(topic, payload, qos)
+                    if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                        self.logger.warning(f'Publishing spooled message failed with rc {info.rc}')
+                        return
+                    self.outbound_queue.remove([message_id])
+                    drained += 1
+                    if interval:
+                        time.sleep(interval)
+        except Exception as e:
+            self.logger.exception(f'Error on draining outbound queue: {e}')
+        finally:
+            with self.outbound_lock:
+                self.outbound_draining = False
+            if drained:
+                self.logger.info(f'Sent {drained} spooled message(s), {self.outbound_queue.size()} remaining')
 
 
-    def refresh_token(self):
-        self.stop_event.clear()
-        time.sleep(5)
+    def refresh_token(self, stop_event=None):
+        stop_event = stop_event or self.stop_event
+        if stop_event.wait(timeout=5):
+            return
         while True:
             self.logger.debug("Refreshing Token")
-            self.__client.publish('s/uat','',0)
-            if self.stop_event.wait(timeout=self.refresh_token_interval):
+            client = self.__client
+            if client is not None:
+                client.publish('s/uat','',0)
+            if stop_event.wait(timeout=self.refresh_token_interval):
                 self.logger.info("Exit Refreshing Token Thread")
                 break
@@ -17,15 +17,28 @@ limitations under the License.
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from http.cookiejar import DefaultCookiePolicy
 import logging
 import json
 import datetime
+import hashlib
+import os
 import re
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from base64 import b64encode
+from c8ydm.core.backoff import ExponentialBackoff
 
 
 class RestClient():
     """ C8Y REST Client """
+    download_chunk_size = 64 * 1024
+    upload_chunk_size = 64 * 1024
+
     def __init__(self, agent):
         self.logger = logging.getLogger(__name__)
         self.serial = agent.serial
@@ -36,6 +49,26 @@ class RestClient():
         if not self.base_url.startswith('http'):
             self.base_url = f'https://{self.base_url}'
         self.token = agent.token
+        pool_size = int(self.configuration.getValue('rest', 'pool.size') or 10)
+        self.timeout = (float(self.configuration.getValue('rest', 'connect.timeout.seconds') or 10),
+                        float(self.configuration.getValue('rest', 'read.timeout.seconds') or 60))
+        # One session for all threads, connections (and their TLS sessions) to the
+        # tenant are kept alive and reused instead of a new handshake per request
+        self.session = requests.Session()
+        # Requests are authenticated by header only, don't share cookies between threads
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # The internal ID of a device never changes, it is cached across restarts and
+        # only resolved again after the platform answered with 404 for it
+        self.identity_file = agent.path / 'identity.json'
+        self.identity_lock = threading.Lock()
+        self.internal_ids = self._load_internal_ids()
+
+    def _request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
 
     def update_token(self, token):
         self.token = token
@@ -60,7 +93,7 @@ class RestClient():
             headers = self.get_auth_header()
             headers['Content-Type'] = 'application/json'
             self.logger.debug(f'Sending Request to url {url}')
-            response = requests.request(
+            response = self._request(
                 "PUT", url, headers=headers, data=payload)
             self.logger.debug('Response from request: ' + str(response.text))
             self.logger.debug(
@@ -69,12 +102,71 @@ class RestClient():
                 #self.logger.info('Managed object updated in C8Y')
                 return True
             else:
+                if response.status_code == 404:
+                    self._invalidate_internal_id_by_value(internal_id)
                 self.logger.warning('Managed object not updated in C8Y')
                 return False
         except Exception as e:
             self.logger.error('The following error occured: %s' % (str(e)))
 
+    def _load_internal_ids(self):
+        try:
+            with open(self.identity_file, 'r') as f:
+                identity = json.load(f)
+            if identity.get('url') == self.base_url:
+                return dict(identity.get('internalIds', {}))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.logger.warning(f'Could not read identity cache {self.identity_file}: {e}')
+        return {}
+
+    def _store_internal_ids(self):
+        try:
+            tmp_file = f'{self.identity_file}.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump({'url': self.base_url, 'internalIds': self.internal_ids}, f)
+            os.replace(tmp_file, self.identity_file)
+        except Exception as e:
+            self.logger.warning(f'Could not write identity cache {self.identity_file}: {e}')
+
+    def invalidate_internal_id(self, external_id=None):
+        """
+        Removes the cached internal ID of external_id, or of the device if not provided.
+        """
+        external_id = external_id or self.serial
+        with self.identity_lock:
+            if self.internal_ids.pop(external_id, None) is not None:
+                self.logger.info(f'Invalidated cached internal ID of {external_id}')
+                self._store_internal_ids()
+
+    def _invalidate_internal_id_by_value(self, internal_id):
+        with self.identity_lock:
+            external_ids = [k for k, v in self.internal_ids.items() if str(v) == str(internal_id)]
+        for external_id in external_ids:
+            self.invalidate_internal_id(external_id)
+
     def get_internal_id(self, external_id):
+        with self.identity_lock:
+            internal_id = self.internal_ids.get(external_id)
+        if internal_id is not None:
+            return internal_id
+        internal_id = self._get_internal_id(external_id)
+        if internal_id is not None:
+            with self.identity_lock:
+                self.internal_ids[external_id] = internal_id
+                self._store_internal_ids()
+        return internal_id
+
+    def get_device_key(self):
+        """
+        Returns tenant url and internal ID of the device, which change when the
+        device is registered again, or None if the internal ID is not known.
+        """
+        internal_id = self.get_internal_id(self.serial)
+        return f'{self.base_url}/{internal_id}' if internal_id is not None else None
+
+    def _get_internal_id(self, external_id):
         try:
             #self.logger.info('Checking against indentity service what is internalID in C8Y')
             url = f'{self.base_url}/identity/externalIds/c8y_Serial/{external_id}'
@@ -82,7 +174,7 @@ class RestClient():
             headers = self.get_auth_header()
             headers['Content-Type'] = 'application/json'
             headers['Accept'] = 'application/json'
-            response = requests.request("GET", url, headers=headers)
+            response = self._request("GET", url, headers=headers)
             self.logger.debug('Response from request: ' + str(response.text))
             self.logger.debug(
                 'Response from request with code : ' + str(response.status_code))
@@ -111,7 +203,7 @@ class RestClient():
             headers['Content-Type'] = 'multipart/form-data'
             headers['Accept'] = 'application/json'
             self.logger.debug(f'Sending Request to url {url}')
-            response = requests.request(
+            response = self._request(
                 "POST", url, headers=headers, data=payload, files=file)
             print("Responsestatuscode:" + str(response.status_code))
             print("RESPONSEMSG: "+str(response.text))
@@ -145,7 +237,7 @@ class RestClient():
                 "source": { "id" : mo_id}
             }
             self.logger.debug(f'Sending Request to url {url}')
-            response = requests.request(
+            response = self._request(
                 "POST", url, headers=headers, data=json.dumps(payload))
             self.logger.debug(
                 'Response from request: ' + str(response.text))
@@ -178,7 +270,7 @@ class RestClient():
                 "source": { "id" : mo_id}
             }
             self.logger.debug(f'Sending Request to url {url}')
-            response = requests.request(
+            response = self._request(
                 "POST", url, headers=headers, data=json.dumps(payload))
             self.logger.debug(
                 'Response from request: ' + str(response.text))
@@ -197,62 +289,87 @@ class RestClient():
             self.logger.error('The following error occured: %s' % (str(ex)))
             return None
 
-    def upload_event_logfile(self, mo_id, file):
-        #self.logger.info('Update of managed Object')
-        try:
-            event_id = self.create_logfile_event(mo_id)
-            if not event_id:
-                return None
-            url = f'{self.base_url}/event/events/{event_id}/binaries'
-            headers = self.get_auth_header()
-            headers['Content-Type'] = 'multipart/form-data'
-            headers['Accept'] = 'application/json'
-            self.logger.debug(f'Sending Request to url {url}')
-            response = requests.request(
-                "POST", url, headers=headers, files=file)
-            self.logger.debug('Response from request: ' + str(response.text))
-            self.logger.debug(
-                'Response from request with code : ' + str(response.status_code))
-            if response.status_code == 200 or response.status_code == 201:
-                json_data = json.loads(response.text)
-                binaryurl = json_data["self"]
-                # print(binaryurl)
-                # return binaryurl
-                return binaryurl
-            else:
-                self.logger.warning('Binary upload failed in C8Y')
-                return None
-        except Exception as e:
-            self.logger.error('The following error occured: %s' % (str(e)))
-    
-    def upload_event_configfile(self, mo_id, file, configtype, path):
-        #self.logger.info('Update of managed Object')
+    def upload_event_logfile(self, mo_id, name, source, compress=None):
+        event_id = self.create_logfile_event(mo_id)
+        if not event_id:
+            return None
+        return self.upload_event_binary(event_id, name, source, compress=compress)
+
+    def upload_event_configfile(self, mo_id, name, configtype, path):
+        event_id = self.create_configfile_event(mo_id, configtype, str(path))
+        if not event_id:
+            return None
+        return self.upload_event_binary(event_id, name, path, compress=False)
+
+    def upload_event_binary(self, event_id, name, source, content_type='text/plain', compress=None):
+        """
+        Attaches a binary to the event. source is a file path or an iterable of str or
+        bytes chunks, it is sent as chunked multipart body without being read into
+        memory. With compress (default rest.upload.gzip) it is gzipped on the fly.
+        """
         try:
-            event_id = self.create_configfile_event(mo_id,configtype,path)
-            if not event_id:
-                return None
+            if compress is None:
+                compress = str(self.configuration.getValue('rest', 'upload.gzip')).lower() == 'true'
+            if compress:
+                name = name + '.gz'
+                content_type = 'application/gzip'
             url = f'{self.base_url}/event/events/{event_id}/binaries'
+            boundary = uuid.uuid4().hex
             headers = self.get_auth_header()
-            headers['Content-Type'] = 'multipart/form-data'
+            headers['Content-Type'] = f'multipart/form-data; boundary={boundary}'
             headers['Accept'] = 'application/json'
             self.logger.debug(f'Sending Request to url {url}')
-            response = requests.request(
-                "POST", url, headers=headers, files=file)
+            response = self._request(
+                "POST", url, headers=headers,
+                data=self._multipart_stream(boundary, name, source, content_type, compress))
             self.logger.debug('Response from request: ' + str(response.text))
             self.logger.debug(
                 'Response from request with code : ' + str(response.status_code))
             if response.status_code == 200 or response.status_code == 201:
                 json_data = json.loads(response.text)
                 binaryurl = json_data["self"]
-                # print(binaryurl)
-                # return binaryurl
                 return binaryurl
             else:
                 self.logger.warning('Binary upload failed in C8Y')
                 return None
         except Exception as e:
             self.logger.error('The following error occured: %s' % (str(e)))
-    
+
+    def _multipart_stream(self, boundary, name, source, content_type, compress):
+        obj = json.dumps({'name': name, 'type': content_type})
+        yield (f'--{boundary}\r\n'
+               'Content-Disposition: form-data; name="object"\r\n\r\n'
+               f'{obj}\r\n'
+               f'--{boundary}\r\n'
+               f'Content-Disposition: form-data; name="file"; filename="{name}"\r\n'
+               f'Content-Type: {content_type}\r\n\r\n').encode('utf-8')
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        buffered = []
+        size = 0
+        for chunk in self._read_chunks(source):
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if not chunk:
+                continue
+            buffered.append(chunk)
+            size += len(chunk)
+            if size >= self.upload_chunk_size:
+                yield b''.join(buffered)
+                buffered = []
+                size = 0
+        if compressor is not None:
+            buffered.append(compressor.flush())
+        buffered.append(f'\r\n--{boundary}--\r\n'.encode('utf-8'))
+        yield b''.join(buffered)
+
+    def _read_chunks(self, source):
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, 'rb') as f:
+                yield from iter(lambda: f.read(self.upload_chunk_size), b'')
+        else:
+            for chunk in source:
+                yield chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+
     def get_filename_from_cd(self, cd):
         """
         Get filename from content-disposition
@@ -263,83 +380,212 @@ class RestClient():
         if len(fname) == 0:
             return None
         return fname[0]
-    
 
-    def download_c8y_binary(self, url):
-        #self.logger.info('Update of managed Object')
+    def _binary_filename(self, filename, url):
+        """
+        Returns the name the binary is stored with in binaries/. Only the last path
+        component of the given name is used, so that it can't point outside of it.
+        """
+        for name in (filename, url.rstrip('/').rsplit('/', 1)[-1]):
+            safe = os.path.basename((name or '').replace('\\', '/'))
+            if safe not in ('', '.', '..'):
+                if safe != name:
+                    self.logger.warning(f'Storing binary {name} as {safe}')
+                return safe
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _validator(response):
+        """
+        Returns the strong ETag or the Last-Modified date of the response, which
+        identify the version of the binary a partial download belongs to.
+        """
+        etag = response.headers.get('etag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return response.headers.get('last-modified')
+
+    def download_c8y_binary(self, url, expected_sha256=None):
+        """
+        Streams the binary to a temporary file in binaries/ and moves it to its final
+        name once complete. A dropped connection is resumed with a Range request. The
+        SHA-256 of the content is computed while downloading and logged. It is only
+        verified against expected_sha256 if given, none of the operations provides
+        a checksum so far.
+        The ETag or Last-Modified date is stored next to the partial file and sent as
+        If-Range, a binary without either is downloaded from the start again.
+        """
         try:
             headers = self.get_auth_header()
-            headers['Content-Type'] = 'multipart/form-data'
-            headers['Accept'] = 'application/json'
-            self.logger.info(f'Sending Request to url {url}')
-            response = requests.request(
-                "GET", url, headers=headers, allow_redirects=True)
-            self.logger.debug('Response from request: ' + str(response.text))
-            self.logger.debug('Response from request with code : ' + str(response.status_code))
-            if response.status_code == 200 or response.status_code == 201:
-                filename = self.get_filename_from_cd(response.headers.get('content-disposition'))
-                file = self.file_path / filename
-                file_str = str(file)
-                open(file, 'wb').write(response.content)
-                return file_str
-            else:
-                self.logger.warning('Binary download failed in C8Y')
+            headers['Accept'] = 'application/octet-stream'
+            part = self.file_path / (hashlib.sha1(url.encode('utf-8')).hexdigest() + '.part')
+            validator_file = part.with_suffix('.validator')
+            retries = int(self.configuration.getValue('rest', 'download.retries') or 5)
+            backoff = ExponentialBackoff(1, 30)
+            digest = hashlib.sha256()
+            offset = 0
+            validator = validator_file.read_text() if validator_file.exists() else None
+            if part.exists() and not validator:
+                part.unlink()
+            if part.exists():
+                # Left over from an interrupted download of the same url
+                with open(part, 'rb') as f:
+                    for chunk in iter(lambda: f.read(self.download_chunk_size), b''):
+                        digest.update(chunk)
+                        offset += len(chunk)
+            filename = None
+            total = None
+            while True:
+                request_headers = dict(headers)
+                if offset > 0:
+                    request_headers['Range'] = f'bytes={offset}-'
+                    # Only the same version of the binary is continued, else it is sent in full
+                    request_headers['If-Range'] = validator
+                self.logger.info(f'Sending Request to url {url}' + (f' resuming at byte {offset}' if offset else ''))
+                response = None
+                try:
+                    response = self._request(
+                        "GET", url, headers=request_headers, allow_redirects=True, stream=True)
+                    self.logger.debug('Response from request with code : ' + str(response.status_code))
+                    if response.status_code == 416 and offset > 0:
+                        # The part is not a prefix of the binary (anymore), start over
+                        part.unlink()
+                        digest = hashlib.sha256()
+                        offset = 0
+                        validator = None
+                        continue
+                    if response.status_code not in (200, 201, 206):
+                        self.logger.warning(f'Binary download failed in C8Y with status code {response.status_code}')
+                        return None
+                    filename = filename or self.get_filename_from_cd(response.headers.get('content-disposition'))
+                    if response.status_code == 206:
+                        content_range = response.headers.get('content-range', '')
+                        total = int(content_range.rsplit('/', 1)[1]) if content_range.rsplit('/', 1)[-1].isdigit() else None
+                        mode = 'ab'
+                    else:
+                        # Range not honoured, the full content is sent again
+                        digest = hashlib.sha256()
+                        offset = 0
+                        length = response.headers.get('content-length')
+                        total = int(length) if length is not None and length.isdigit() else None
+                        mode = 'wb'
+                        validator = self._validator(response)
+                        if validator:
+                            validator_file.write_text(validator)
+                        elif validator_file.exists():
+                            validator_file.unlink()
+                    with open(part, mode) as f:
+                        for chunk in response.iter_content(chunk_size=self.download_chunk_size):
+                            if chunk:
+                                f.write(chunk)
+                                digest.update(chunk)
+                                offset += len(chunk)
+                    if total is not None and offset < total:
+                        raise requests.exceptions.ChunkedEncodingError(
+                            f'Connection closed after {offset} of {total} bytes')
+                    break
+                except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                        requests.exceptions.Timeout) as e:
+                    if not validator and offset > 0:
+                        # Can't be resumed without knowing the version of the binary
+                        part.unlink()
+                        digest = hashlib.sha256()
+                        offset = 0
+                    if backoff.attempts >= retries:
+                        self.logger.error(f'Binary download from {url} failed after {backoff.attempts} retries: {e}')
+                        return None
+                    delay = backoff.next_delay()
+                    self.logger.warning(f'Binary download interrupted at byte {offset}, resuming in {delay:.1f}s: {e}')
+                    time.sleep(delay)
+                finally:
+                    if response is not None:
+                        response.close()
+            checksum = digest.hexdigest()
+            if expected_sha256 is not None and checksum != expected_sha256.lower():
+                self.logger.error(f'Checksum of binary from {url} is {checksum}, expected {expected_sha256}')
+                part.unlink()
+                if validator_file.exists():
+                    validator_file.unlink()
                 return None
+            file = self.file_path / self._binary_filename(filename, url)
+            os.replace(part, file)
+            if validator_file.exists():
+                validator_file.unlink()
+            self.logger.info(f'Downloaded {offset} bytes to {file} with SHA-256 {checksum}')
+            return str(file)
         except Exception as e:
             self.logger.error('The following error occured: %s' % (str(e)))
             return None
 
-    def get_all_dangling_operations(self, internal_id):
+    def get_all_dangling_operations(self, internal_id, page_size=100):
+        """
+        Returns all operations of the device with status EXECUTING. The pages are
+        requested until a page is not full, None is returned if a request failed.
+        """
         try:
-            url = f'{self.base_url}/devicecontrol/operations?status=EXECUTING&deviceId={internal_id}'
+            operations = []
             headers = self.get_auth_header()
             headers['Content-Type'] = 'application/json'
             headers['Accept'] = 'application/json'
-            response = requests.request("GET", url, headers=headers)
-            self.logger.debug('Response from request: ' + str(response.text))
+            page = 1
+            while True:
+                url = f'{self.base_url}/devicecontrol/operations?status=EXECUTING&deviceId={internal_id}&pageSize={page_size}&currentPage={page}'
+                response = self._request("GET", url, headers=headers)
+                self.logger.debug(
+                    'Response from request with code : ' + str(response.status_code))
+                if response.status_code != 200:
+                    self.logger.warning(
+                        'Response from request: ' + str(response.text))
+                    self.logger.warning('Got response with status_code: ' +
+                                        str(response.status_code))
+                    return None
+                page_operations = json.loads(response.text).get('operations', [])
+                operations.extend(page_operations)
+                if len(page_operations) < page_size:
+                    break
+                page += 1
+            self.logger.debug(
+                f'Returning {len(operations)} Operations with status EXECUTING')
+            return operations
+        except Exception as e:
+            self.logger.error('The following error occured: %s' % (str(e)))
+
+    def set_operation_to_failed(self, operation_id):
+        try:
+            url = f'{self.base_url}/devicecontrol/operations/{operation_id}'
+            headers = self.get_auth_header()
+            headers['Content-Type'] = 'application/json'
+            headers['Accept'] = 'application/json'
+            payload = {
+                "status": "FAILED",
+                "failureReason": "Operation unexpectedly interrupted. Check logs for details"
+            }
+            response = self._request(
+                "PUT", url, headers=headers, data=json.dumps(payload))
             self.logger.debug(
                 'Response from request with code : ' + str(response.status_code))
             if response.status_code == 200:
-                json_data = json.loads(response.text)
-                #operations = []
-                operations = json_data['operations']
-                #self.logger.info("The internalID for " + str(external_id) + " is " + str(internalID))
-                self.logger.debug(
-                    f'Returning Operations with status EXECUTING {operations}')
-                return operations
-            else:
-                self.logger.warning(
-                    'Response from request: ' + str(response.text))
-                self.logger.warning('Got response with status_code: ' +
-                                    str(response.status_code))
-                return None
+                return True
+            self.logger.warning(f'Setting operation {operation_id} to FAILED returned status_code: {response.status_code}')
+            return False
         except Exception as e:
             self.logger.error('The following error occured: %s' % (str(e)))
+            return False
 
     def set_operations_to_failed(self, operations):
-        if len(operations) > 0:
-            try:
-                for op in operations:
-                    url = f'{self.base_url}/devicecontrol/operations/{op["id"]}'
-                    headers = self.get_auth_header()
-                    headers['Content-Type'] = 'application/json'
-                    headers['Accept'] = 'application/json'
-                    payload = {
-                        "status": "FAILED",
-                        "failureReason": "Operation unexpectedly interrupted. Check logs for details"
-                    }
-                    response = requests.request(
-                        "PUT", url, headers=headers, data=json.dumps(payload))
-                    self.logger.debug(
-                        'Response from request: ' + str(response.text))
-                    self.logger.debug(
-                        'Response from request with code : ' + str(response.status_code))
-                    if response.status_code == 200:
-                        return True
-                    else:
-                        return False
-            except Exception as e:
-                self.logger.error('The following error occured: %s' % (str(e)))
+        """
+        Sets all given operations to FAILED, at most rest.recovery.workers requests
+        run at the same time. Returns the number of updated operations.
+        """
+        if not operations:
+            return 0
+        workers = int(self.configuration.getValue('rest', 'recovery.workers') or 4)
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='RecoveryThread') as executor:
+            results = list(executor.map(self.set_operation_to_failed, [op['id'] for op in operations]))
+        recovered = sum(1 for result in results if result)
+        self.logger.info(f'Set {recovered} of {len(operations)} dangling operation(s) to FAILED in {time.monotonic() - start:.2f}s')
+        return recovered
 
     def create_SmartRest_template(self,template,template_id):
         try:
@@ -349,14 +595,14 @@ class RestClient():
             headers = self.get_auth_header()
             headers['Content-Type'] ='application/json'
             headers['Accept'] = 'application/json'
-            response = requests.request("POST", url, headers=headers, data = json.dumps(payload))
+            response = self._request("POST", url, headers=headers, data = json.dumps(payload))
             if response.status_code == 200 or response.status_code==201:
                 json_data = json.loads(response.text)
                 self.logger.info(f'Template created with id {json_data["id"]}')
                 payload = json.loads(f'{{"externalId": "{template_id}","type": "c8y_SmartRest2DeviceIdentifier"}}')
                 url = f'{self.base_url}/identity/globalIds/{json_data["id"]}/externalIds'
                 self.logger.debug(f'Sending Request for idenenity of smart rest template to url {url}')
-                response = requests.request("POST", url, headers=headers, data = json.dumps(payload))
+                response = self._request("POST", url, headers=headers, data = json.dumps(payload))
                 if response.status_code == 200 or response.status_code==201:
                     self.logger.debug('Response from request of identity API for smart rest template: ' + str(response.text))
                     return True
@@ -380,7 +626,7 @@ class RestClient():
             headers = self.get_auth_header()
             headers['Content-Type'] ='application/json'
             headers['Accept'] = 'application/json'
-            response = requests.request("GET", url, headers=headers)
+            response = self._request("GET", url, headers=headers)
             self.logger.info('Checking against indentity service')
             if response.status_code == 200:
                 self.logger.info('Managed object exists in C8Y')
@@ -405,7 +651,7 @@ class RestClient():
             headers['Content-Type'] = 'application/json'
             headers['Accept'] = 'application/json'
             self.logger.debug(f'Sending Request to url {url} with payload {software_list_json}')
-            response = requests.request(
+            response = self._request(
                 "POST", url, headers=headers, data=json.dumps(software_list_json))
             self.logger.debug(
                 'Response from request: ' + str(response.text))
@@ -413,8 +659,11 @@ class RestClient():
                 'Response from request with code : ' + str(response.status_code))
             if not (response.status_code == 200 or response.status_code == 201):
                 self.logger.warning(f'Creating adv. software list failed! Response code {response.status_code} content: {response.content}')
+                if response.status_code == 404:
+                    self._invalidate_internal_id_by_value(device_id)
                 
                 return None
+            return True
         except Exception as ex:
             self.logger.error('The following error occured: %s' % (str(ex)))
             return None
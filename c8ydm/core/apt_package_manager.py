@@ -18,42 +18,102 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import logging
+import os
 import platform
+import threading
+from contextlib import contextmanager
 import distro
-from c8ydm.framework.smartrest import SmartRESTMessage
+from c8ydm.core.dpkg_status import DPKG_STATUS, installed_packages
+from c8ydm.framework.smartrest import chunked_messages
 
 if 'Linux' == platform.system() and distro.id() in ['debian','ubuntu','raspbian']:
     import apt
 else:
     apt = None
 
+class AptCache:
+    """
+    Long-lived apt cache shared by all users in the agent. Opening the cache takes
+    seconds, it is only opened again when the dpkg status or the package lists
+    changed since it was opened last. The cache is not thread safe, it is used by
+    one thread at a time through use().
+    """
+    logger = logging.getLogger(__name__)
+    watched_paths = ['/var/lib/dpkg/status', '/var/lib/apt/lists', '/var/cache/apt/pkgcache.bin']
+
+    def __init__(self, factory=None, watched_paths=None):
+        self.factory = factory
+        if watched_paths is not None:
+            self.watched_paths = watched_paths
+        self.opened = 0
+        self._cache = None
+        self._signature = None
+        self._lock = threading.RLock()
+
+    def _current_signature(self):
+        signature = []
+        for path in self.watched_paths:
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size, stat.st_ino))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    @contextmanager
+    def use(self, with_update=False):
+        """
+        Yields the opened cache, or None without apt. Changes marked but not
+        committed by the user are cleared afterwards.
+        """
+        with self._lock:
+            factory = self.factory or (apt.cache.Cache if apt else None)
+            if factory is None:
+                yield None
+                return
+            if self._cache is None:
+                self._cache = factory()
+                self._signature = None
+            if with_update:
+                self.logger.info('Starting apt update....')
+                self._cache.update()
+                self.logger.info('apt update finished!')
+                self._signature = None
+            signature = self._current_signature()
+            if signature != self._signature:
+                self._cache.open()
+                self.opened += 1
+                self._signature = signature
+            try:
+                yield self._cache
+            finally:
+                if self._cache.get_changes():
+                    self._cache.clear()
+
+    def invalidate(self):
+        with self._lock:
+            self._signature = None
+
+
 class AptPackageManager:
     logger = logging.getLogger(__name__)
+    apt_cache = AptCache()
+    dpkg_status = DPKG_STATUS
+    dpkg_status_mmap = False
     
     """
-    DEPRECATED - will probably hit the 16 KB payload limit size of MQTT when used.
+    DEPRECATED - returns the software list as 140 message followed by 141 messages
+    for the packages not fitting into the 16 KB payload limit of MQTT.
     """
     def getInstalledSoftware(self, with_update):
         allInstalled = []
-        if apt:
-            cache = apt.cache.Cache()
-            if with_update:
-                self.logger.info('Starting apt update....')
-                cache.update()
-                self.logger.info('apt update finished!')
-            cache.open()
-
-            for pkg in cache:
+        with self.apt_cache.use(with_update) as cache:
+            for pkg in (cache or []):
                 if (pkg.is_installed and not pkg.shortname.startswith('lib') and not pkg.shortname.startswith('python')):
-                    allInstalled.append(pkg.shortname)
-                    allInstalled.append(pkg.installed.version)
-                    allInstalled.append('apt')
                     #FIXME Bug in 10.14 Cumulocity that URL must not be null and is mandatory
-                    allInstalled.append('test')
-
-            cache.close()
+                    allInstalled.append([pkg.shortname, pkg.installed.version, 'apt', 'test'])
 
-        return [SmartRESTMessage('s/us', '140', allInstalled)]
+        return chunked_messages('s/us', allInstalled)
 
     """
     Returns the software list as JSON to be sent to the new Adv. software management microservice
@@ -63,14 +123,20 @@ class AptPackageManager:
         #all_installed = {
         #    "c8y_SoftwareList": software_list
         #}
-        if apt:
-            cache = apt.cache.Cache()
-            if with_update:
-                self.logger.info('Starting apt update....')
-                cache.update()
-                self.logger.info('apt update finished!')
-            cache.open()
-            for pkg in cache:
+        if not with_update and os.path.isfile(self.dpkg_status):
+            # Installed packages are read from the dpkg status directly, opening
+            # the apt cache is only needed to update the package lists
+            for name, version, arch in installed_packages(self.dpkg_status, self.dpkg_status_mmap):
+                #FIXME Bug in 10.14 Cumulocity that URL must not be null and is mandatory
+                software_list.append({
+                    "name": name,
+                    "version": version,
+                    "softwareType": "apt",
+                    "url": "test"
+                })
+            return software_list
+        with self.apt_cache.use(with_update) as cache:
+            for pkg in (cache or []):
                 if (pkg.is_installed):
                     #FIXME Bug in 10.14 Cumulocity that URL must not be null and is mandatory
                     software = {
@@ -80,7 +146,6 @@ class AptPackageManager:
 			            "url": "test"
                     }
                     software_list.append(software)
-            cache.close()
         return software_list
 
     
@@ -88,13 +153,9 @@ class AptPackageManager:
         errors = []
         software_installed = []
         try:
-            if apt:
-                cache = apt.cache.Cache()
-                if with_update:
-                    self.logger.info('Starting apt update....')
-                    cache.update()
-                    self.logger.info('apt update finished!')
-                cache.open()
+            with self.apt_cache.use(with_update) as cache:
+                if cache is None:
+                    return [errors, software_installed]
                 for software in software_to_install:
                 
                     if with_type:
@@ -193,40 +254,34 @@ class AptPackageManager:
 
     """ Old Deprecated Version of Software Updates """
     def installSoftware(self, toBeInstalled, with_update):
-        cache = apt.cache.Cache()
-        if with_update:
-            self.logger.info('Starting apt update....')
-            cache.update()
-            self.logger.info('apt update finished!')
-        cache.open()
-
-        for software in toBeInstalled:
-            pkg = cache[software[0]]
-            # Software currently installed in the same version
-            if pkg.is_installed and pkg.installed.version == software[1]:
-                # no action needed
-                self.logger.debug('existing ' + pkg.shortname +
-                                    '=' + pkg.installed.version)
-            else:
-                self.logger.info(
-                    'install ' + pkg.shortname + '=' + software[1])
-                candidate = pkg.versions.get(software[1])
-                pkg.candidate = candidate
-                pkg.mark_install()
-
-        # Check what needs to be uninstalled
-        toBeInstalledSoftware = [i[0] for i in toBeInstalled]
-        for pkg in cache:
-            if not pkg.shortname.startswith('lib') and pkg.is_installed and pkg.shortname not in toBeInstalledSoftware:
-                self.logger.info('delete ' + pkg.shortname +
-                                    '=' + pkg.installed.version)
-                pkg.mark_delete()
+        with self.apt_cache.use(with_update) as cache:
+            for software in toBeInstalled:
+                pkg = cache[software[0]]
+                # Software currently installed in the same version
+                if pkg.is_installed and pkg.installed.version == software[1]:
+                    # no action needed
+                    self.logger.debug('existing ' + pkg.shortname +
+                                        '=' + pkg.installed.version)
+                else:
+                    self.logger.info(
+                        'install ' + pkg.shortname + '=' + software[1])
+                    candidate = pkg.versions.get(software[1])
+                    pkg.candidate = candidate
+                    pkg.mark_install()
 
-        try:
-            self.logger.info('Starting apt install/removal of Software..')
-            cache.commit()
-            self.logger.info("Install/Removal of Software finished!")
-        except Exception as e:
-            self.logger.error(e)
+            # Check what needs to be uninstalled
+            toBeInstalledSoftware = [i[0] for i in toBeInstalled]
+            for pkg in cache:
+                if not pkg.shortname.startswith('lib') and pkg.is_installed and pkg.shortname not in toBeInstalledSoftware:
+                    self.logger.info('delete ' + pkg.shortname +
+                                        '=' + pkg.installed.version)
+                    pkg.mark_delete()
+
+            try:
+                self.logger.info('Starting apt install/removal of Software..')
+                cache.commit()
+                self.logger.info("Install/Removal of Software finished!")
+            except Exception as e:
+                self.logger.error(e)
 
         return []
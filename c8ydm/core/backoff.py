@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import random
+
+
+class ExponentialBackoff:
+    """
+    Exponential backoff with jitter. Every call to next_delay() doubles the upper
+    bound up to maximum and returns a random delay between minimum and that bound,
+    so that many devices losing the connection at once do not reconnect in lockstep.
+    """
+
+    def __init__(self, minimum=1, maximum=300, factor=2):
+        self.minimum = float(minimum)
+        self.maximum = max(float(maximum), self.minimum)
+        self.factor = factor
+        self.attempts = 0
+
+    def next_delay(self):
+        upper = min(self.maximum, self.minimum * (self.factor ** min(self.attempts, 32)))
+        self.attempts += 1
+        return random.uniform(self.minimum, upper)
+
+    def reset(self):
+        self.attempts = 0
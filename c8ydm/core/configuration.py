@@ -71,6 +71,9 @@ class ConfigurationManager(Listener, Initializer):
     def getSupportedTemplates(self):
         return []
 
+    def getSupportedMessages(self):
+        return [('s/ds', '513')]
+
 
     def getMessages(self):
         configs = self.configuration.getConfigString()
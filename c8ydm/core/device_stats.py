@@ -17,24 +17,35 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
-import logging, time
+import logging, threading
 import psutil
 
 
 
 class DeviceStats:
+    """
+    Collects device statistics without blocking. Every call takes a single snapshot
+    of the psutil source, CPU percentages are computed against the snapshot of
+    the previous call. When no CPU time passed since then, the percentages of the
+    previous call are returned again.
+    """
     logger = logging.getLogger(__name__)
     
     def __init__(self):
-        pass
+        self._lock = threading.Lock()
+        self._last_cpu_times = psutil.cpu_times()
+        # Average since boot until there are two snapshots to compare
+        self._last_cpu_percent = self._cpu_times_percent(
+            type(self._last_cpu_times)(*[0.0] * len(self._last_cpu_times)), self._last_cpu_times)
 
     def getMemoryStats(self):
+        memory = {}
         try:
-            memory = {}
-            memory['free'] = psutil.virtual_memory().free
-            memory['used'] = psutil.virtual_memory().used
-            memory['total'] = psutil.virtual_memory().total
-            memory['percent'] = psutil.virtual_memory().percent
+            virtual_memory = psutil.virtual_memory()
+            memory['free'] = virtual_memory.free
+            memory['used'] = virtual_memory.used
+            memory['total'] = virtual_memory.total
+            memory['percent'] = virtual_memory.percent
             self.logger.debug("Collected the following memory stats: %s" % (memory))
         except Exception as e:
             self.logger.error('The following error occured: %s' % (str(e)))
@@ -42,14 +53,17 @@ class DeviceStats:
             return memory
 
     def getCPUStats(self):
+        cpu = {}
         try:
-            cpu = {}
-            cpu['guest'] = psutil.cpu_times_percent(interval=1, percpu=False)[0]
-            cpu['idle'] = psutil.cpu_times_percent(interval=1, percpu=False)[2]
-            cpu['iowait'] = psutil.cpu_times_percent(interval=1, percpu=False)[3]
-            cpu['irq'] = psutil.cpu_times_percent(interval=1, percpu=False)[4]
-            cpu['system'] = psutil.cpu_times_percent(interval=1, percpu=False)[8]
-            cpu['user'] = psutil.cpu_times_percent(interval=1, percpu=False)[9]
+            current = psutil.cpu_times()
+            with self._lock:
+                previous = self._last_cpu_times
+                if self._cpu_total(current) > self._cpu_total(previous):
+                    self._last_cpu_times = current
+                    self._last_cpu_percent = self._cpu_times_percent(previous, current)
+                percent = self._last_cpu_percent
+            for field in ['guest', 'idle', 'iowait', 'irq', 'system', 'user']:
+                cpu[field] = percent.get(field, 0.0)
             self.logger.debug("Collected the following cpu stats: %s" % (cpu))
         except Exception as e:
             self.logger.error('The following error occured: %s' % (str(e)))
@@ -57,14 +71,33 @@ class DeviceStats:
             return cpu
 
     def getDiskStats(self):
+        disk = {}
         try:
-            disk = {}
-            disk['total'] = psutil.disk_usage('/').total
-            disk['used'] = psutil.disk_usage('/').used
-            disk['free'] = psutil.disk_usage('/').free
-            disk['percent'] = psutil.disk_usage('/').percent
+            disk_usage = psutil.disk_usage('/')
+            disk['total'] = disk_usage.total
+            disk['used'] = disk_usage.used
+            disk['free'] = disk_usage.free
+            disk['percent'] = disk_usage.percent
             self.logger.debug("Collected the following disk stats: %s" % (disk))
         except Exception as e:
             self.logger.error('The following error occured: %s' % (str(e)))
         finally:
-            return disk
\ No newline at end of file
+            return disk
+
+    @staticmethod
+    def _cpu_total(times):
+        total = sum(times)
+        if psutil.LINUX:
+            # On Linux guest times are already accounted in user and nice
+            total -= getattr(times, 'guest', 0) + getattr(times, 'guest_nice', 0)
+        return total
+
+    @classmethod
+    def _cpu_times_percent(cls, previous, current):
+        total = cls._cpu_total(current) - cls._cpu_total(previous)
+        percent = {}
+        for field in current._fields:
+            delta = getattr(current, field) - getattr(previous, field)
+            value = 100.0 * delta / total if total > 0 else 0.0
+            percent[field] = round(min(max(value, 0.0), 100.0), 1)
+        return percent
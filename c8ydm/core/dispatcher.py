@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import collections
+import logging
+import queue
+import threading
+
+
+class OperationDispatcher:
+    """
+    Fixed-size worker pool with a bounded queue used to run listener callbacks.
+    Work submitted while the queue is full is rejected and counted instead of
+    spawning additional threads.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, workers=4, queue_size=100, name='DispatcherThread'):
+        self.workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+        self.name = name
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._max_queue_depth = 0
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                worker.name = f'{self.name}-{i + 1}'
+                worker.start()
+                self._threads.append(worker)
+        self.logger.info(f'Started {self.workers} dispatcher workers with queue size {self.queue_size}')
+
+    def stop(self, timeout=None):
+        with self._lock:
+            threads = self._threads
+            self._threads = []
+        for _ in threads:
+            # Sentinels are put blocking so that pending work is finished first
+            self._queue.put(None)
+        for worker in threads:
+            worker.join(timeout)
+
+    def submit(self, func, *args):
+        """
+        Queues func(*args) for execution. Returns False if the work was rejected
+        because the queue is full.
+        """
+        try:
+            self._queue.put_nowait((func, args))
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            self.logger.warning(f'Dispatcher queue full ({self.queue_size}), rejecting {getattr(func, "__qualname__", func)}')
+            return False
+        with self._lock:
+            self._submitted += 1
+            depth = self._queue.qsize()
+            if depth > self._max_queue_depth:
+                self._max_queue_depth = depth
+        return True
+
+    def get_metrics(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queueSize': self.queue_size,
+                'queueDepth': self._queue.qsize(),
+                'maxQueueDepth': self._max_queue_depth,
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'failed': self._failed,
+                'rejected': self._rejected
+            }
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                func, args = item
+                try:
+                    func(*args)
+                    with self._lock:
+                        self._completed += 1
+                except Exception as e:
+                    with self._lock:
+                        self._failed += 1
+                    self.logger.exception(f'Error in dispatched work {getattr(func, "__qualname__", func)}: {e}')
+            finally:
+                self._queue.task_done()
+
+
+class OperationExecutor:
+    """
+    Orders operations by the concurrency class their listener declares before
+    they are handed to the dispatcher workers:
+
+    exclusive   runs alone, after everything received before it finished and
+                before anything received after it starts
+    resource    runs one at a time per resource in the order received, e.g. all
+                package operations share the 'packages' resource
+    parallel    runs as soon as a worker is free
+
+    Waiting operations are kept in a bounded FIFO list, further operations are
+    rejected and counted while it is full. An operation submitted again with the
+    key of one still waiting or running, e.g. redelivered by the broker, is dropped.
+    """
+    PARALLEL = 'parallel'
+    RESOURCE = 'resource'
+    EXCLUSIVE = 'exclusive'
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, dispatcher, max_pending=100):
+        self.dispatcher = dispatcher
+        self.max_pending = max(1, int(max_pending))
+        self._pending = collections.deque()
+        self._pending_keys = set()
+        self._lock = threading.Lock()
+        self._running = 0
+        self._exclusive = False
+        self._resources = set()
+        self._submitted = 0
+        self._rejected = 0
+        self._duplicates = 0
+        self._max_pending_depth = 0
+
+    def submit(self, concurrency, func, *args, key=None):
+        """
+        Queues func(*args) with concurrency given as (class, resource), an unknown
+        class runs in parallel. Returns False if the operation was rejected because
+        too many are waiting.
+        """
+        try:
+            concurrency_class, resource = concurrency or (self.PARALLEL, None)
+        except (TypeError, ValueError):
+            concurrency_class, resource = concurrency, None
+        if concurrency_class not in (self.PARALLEL, self.RESOURCE, self.EXCLUSIVE):
+            self.logger.warning(f'Unknown concurrency {concurrency} of {getattr(func, "__qualname__", func)}, running it in parallel')
+            concurrency_class, resource = self.PARALLEL, None
+        with self._lock:
+            if key is not None and key in self._pending_keys:
+                self._duplicates += 1
+                self.logger.info(f'Operation {key} is already waiting or running, dropping the duplicate')
+                return True
+            if len(self._pending) >= self.max_pending:
+                self._rejected += 1
+                self.logger.warning(f'Too many pending operations ({self.max_pending}), rejecting {getattr(func, "__qualname__", func)}')
+                return False
+            self._pending.append((concurrency_class, resource, func, args, key))
+            if key is not None:
+                self._pending_keys.add(key)
+            self._submitted += 1
+            self._max_pending_depth = max(self._max_pending_depth, len(self._pending))
+            self._schedule()
+        return True
+
+    def get_metrics(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'maxPending': self._max_pending_depth,
+                'running': self._running,
+                'busyResources': sorted(self._resources),
+                'exclusive': self._exclusive,
+                'submitted': self._submitted,
+                'rejected': self._rejected,
+                'duplicates': self._duplicates
+            }
+
+    def _schedule(self):
+        # Called with the lock held. At most one operation per worker is handed
+        # over, so the dispatcher queue never fills up with blocked work.
+        waiting = collections.deque()
+        blocked = set(self._resources)
+        while self._pending and not self._exclusive and self._running < self.dispatcher.workers:
+            item = self._pending.popleft()
+            concurrency_class, resource = item[0], item[1]
+            if concurrency_class == self.RESOURCE and resource in blocked:
+                waiting.append(item)
+                continue
+            if concurrency_class == self.EXCLUSIVE and self._running > 0:
+                # Nothing received later may overtake the exclusive operation
+                waiting.append(item)
+                break
+            if concurrency_class == self.RESOURCE:
+                # Later operations on the resource keep their order behind this one
+                blocked.add(resource)
+            if not self._start(item):
+                waiting.append(item)
+                break
+            if concurrency_class == self.EXCLUSIVE:
+                self._exclusive = True
+            elif concurrency_class == self.RESOURCE:
+                self._resources.add(resource)
+        waiting.extend(self._pending)
+        self._pending = waiting
+
+    def _start(self, item):
+        if not self.dispatcher.submit(self._run, item):
+            return False
+        self._running += 1
+        return True
+
+    def _run(self, item):
+        concurrency_class, resource, func, args, key = item
+        try:
+            func(*args)
+        finally:
+            with self._lock:
+                # The key is kept until the handler returned, as its status update
+                # may still be batched when the next poll redelivers the operation
+                self._pending_keys.discard(key)
+                self._running -= 1
+                if concurrency_class == self.EXCLUSIVE:
+                    self._exclusive = False
+                elif concurrency_class == self.RESOURCE:
+                    self._resources.discard(resource)
+                self._schedule()
@@ -18,55 +18,190 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import logging
-import subprocess
-import json
-from c8ydm.framework.smartrest import SmartRESTMessage
+import threading
+from c8ydm.core.backoff import ExponentialBackoff
+from c8ydm.utils.docker_client import DockerClient
 
 class DockerWatcher:
+    """
+    Collects status and resource usage of all docker containers from the Docker
+    Engine API. CPU usage is computed against the sample of the previous call.
+    """
     logger = logging.getLogger(__name__)
     docker_active = True
 
+    def __init__(self, client=None):
+        self.client = client if client is not None else DockerClient()
+        self._last_cpu = {}
+
     def get_stats(self):
-            try:
-                subprocess.Popen(["docker", "stats", "--no-stream","-a", "--format", "'{{.Container}};{{.Name}};{{.CPUPerc}};{{.MemUsage}};{{.MemPerc}}'"],stdout=subprocess.PIPE)
-                self.docker_active = True
-            except Exception as os_ex:
-                if self.docker_active:
-                    self.logger.warn(f'Docker is not installed, skipping module')
-                    self.docker_active = False
-                #self.logger.info(f'Docker Status {self.docker_active}')
+        containers = self.client.getContainers()
+        if containers is None:
             if self.docker_active:
-                try:
-                    rawStats = subprocess.Popen(["docker", "stats", "--no-stream","-a", "--format", "'{{.Container}};{{.Name}};{{.CPUPerc}};{{.MemUsage}};{{.MemPerc}}'"],stdout=subprocess.PIPE)
-                    list = rawStats.stdout.read().decode('utf-8').split('\n')
-                    a = []
-                    for i in list:
-                        dict = {}
-                        for counter,value in enumerate(i.split(';')):
-                            if counter == 0:
-                                dict["containerID"] = value.replace("'","")
-                            if counter == 1:
-                                dict["name"] = value
-                                nameString = "name=" + str(value)
-                                try:
-                                    rawStatus = subprocess.Popen(["docker", "ps", "-a", "--format", "'{{.Status}}'", "--filter", nameString ],stdout=subprocess.PIPE)
-                                    dict["status"] = rawStatus.stdout.read().decode('utf-8').replace("'","")
-                                except:
-                                    self.logger.warning('Status from docker for container %s not valid.'% (str(value)))
-                                    dict["status"] = "Unknown"
-                            if counter == 2:
-                                dict["cpu"] = value.replace('%','')
-                            if counter == 3:
-                                dict["memory"] = value.replace('%','').replace("'","")
-                            if counter == 4:
-                                dict["memory_perc"] = value.replace('%','').replace("'","")
-                        a.append(dict)
-                    a = a[:-1]
-                    payload = {}
-                    payload['c8y_Docker'] = a
-                    self.logger.debug('The following Docker stats where found: %s'% (str(payload)))
-                    return payload
-                except Exception as e:
-                    self.logger.error('The following error occured: %s'% (str(e)))
-            else:
-                return None
\ No newline at end of file
+                self.logger.warning(f'Docker is not available, skipping module')
+                self.docker_active = False
+            return None
+        self.docker_active = True
+        try:
+            a = []
+            last_cpu = {}
+            for container in containers:
+                container_id = container['Id']
+                names = container.get('Names') or ['']
+                dict = {
+                    'containerID': container_id[:12],
+                    'name': names[0].lstrip('/'),
+                    'status': container.get('Status', 'Unknown'),
+                    'cpu': '0.00',
+                    'memory': '0B / 0B',
+                    'memory_perc': '0.00'
+                }
+                if container.get('State') == 'running':
+                    stats = self.client.getContainerStats(container_id)
+                    if stats:
+                        cpu_sample = self._cpu_sample(stats)
+                        last_cpu[container_id] = cpu_sample
+                        dict['cpu'] = '%.2f' % self._cpu_percent(self._last_cpu.get(container_id), cpu_sample)
+                        used, limit = self._memory(stats)
+                        dict['memory'] = f'{self._bytes_size(used)} / {self._bytes_size(limit)}'
+                        dict['memory_perc'] = '%.2f' % (100.0 * used / limit if limit else 0.0)
+                a.append(dict)
+            self._last_cpu = last_cpu
+            payload = {}
+            payload['c8y_Docker'] = a
+            self.logger.debug('The following Docker stats where found: %s'% (str(payload)))
+            return payload
+        except Exception as e:
+            self.logger.error('The following error occured: %s'% (str(e)))
+            return None
+
+    @staticmethod
+    def _cpu_sample(stats):
+        cpu_stats = stats.get('cpu_stats', {})
+        usage = cpu_stats.get('cpu_usage', {})
+        online_cpus = cpu_stats.get('online_cpus') or len(usage.get('percpu_usage') or []) or 1
+        return (usage.get('total_usage', 0), cpu_stats.get('system_cpu_usage', 0), online_cpus)
+
+    @staticmethod
+    def _cpu_percent(previous, current):
+        """ Same calculation as docker stats, but against the sample of the previous cycle """
+        if previous is None:
+            return 0.0
+        cpu_delta = current[0] - previous[0]
+        system_delta = current[1] - previous[1]
+        if cpu_delta <= 0 or system_delta <= 0:
+            return 0.0
+        return cpu_delta / system_delta * current[2] * 100.0
+
+    @staticmethod
+    def _memory(stats):
+        memory_stats = stats.get('memory_stats', {})
+        usage = memory_stats.get('usage', 0)
+        details = memory_stats.get('stats', {})
+        # cgroup v1 reports the page cache as total_inactive_file/cache, v2 as inactive_file
+        cache = details.get('total_inactive_file', details.get('inactive_file', details.get('cache', 0)))
+        if cache < usage:
+            usage -= cache
+        return usage, memory_stats.get('limit', 0)
+
+    @staticmethod
+    def _bytes_size(size):
+        """ Formats sizes with binary units like the docker CLI does """
+        size = float(size)
+        for unit in ['B', 'KiB', 'MiB', 'GiB', 'TiB']:
+            if size < 1024.0 or unit == 'TiB':
+                return '%.4g%s' % (size, unit)
+            size /= 1024.0
+
+
+class ContainerStateTracker:
+    """
+    Keeps the last known status of every container, fed by polling via update()
+    and by a long-lived subscription to the docker events stream. on_transition
+    (container_id, name, status) is called only when the status of a container changes.
+    """
+    logger = logging.getLogger(__name__)
+    event_filters = {'type': ['container'], 'event': ['start', 'die', 'health_status']}
+
+    def __init__(self, client, on_transition):
+        self.client = client
+        self.on_transition = on_transition
+        self._states = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    @staticmethod
+    def status_from_text(status_text):
+        """ Maps the status text of the container list, e.g. 'Up 2 hours (unhealthy)' """
+        if not status_text:
+            return None
+        if '(unhealthy)' in status_text:
+            return 'unhealthy'
+        if 'Up' in status_text:
+            return 'up'
+        if 'Exited' in status_text:
+            return 'down'
+        return status_text
+
+    @staticmethod
+    def status_from_event(event):
+        action = event.get('Action') or event.get('status') or ''
+        if action == 'start':
+            return 'up'
+        if action == 'die':
+            return 'down'
+        if action.startswith('health_status'):
+            return 'unhealthy' if action.endswith('unhealthy') else 'up'
+        return None
+
+    def update(self, container_id, status):
+        """ Returns True if the status of the container changed """
+        with self._lock:
+            if self._states.get(container_id) == status:
+                return False
+            self._states[container_id] = status
+            return True
+
+    def get_states(self):
+        with self._lock:
+            return dict(self._states)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._watch)
+        self._thread.daemon = True
+        self._thread.name = 'DockerEventsThread'
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _handle_event(self, event):
+        status = self.status_from_event(event)
+        if status is None:
+            return
+        actor = event.get('Actor', {})
+        container_id = (event.get('id') or actor.get('ID', ''))[:12]
+        name = actor.get('Attributes', {}).get('name', '')
+        if container_id and self.update(container_id, status):
+            self.logger.debug(f'Container {name} ({container_id}) changed status to {status}')
+            self.on_transition(container_id, name, status)
+
+    def _watch(self):
+        backoff = ExponentialBackoff(1, 60)
+        while not self._stopped.is_set():
+            try:
+                for event in self.client.getEvents(self.event_filters):
+                    backoff.reset()
+                    self._handle_event(event)
+                    if self._stopped.is_set():
+                        return
+            except Exception as e:
+                self.logger.debug(f'Docker events subscription ended: {e}')
+            delay = backoff.next_delay()
+            if backoff.attempts == 1:
+                self.logger.info(f'Docker events not available, subscribing again in {delay:.1f} sec.')
+            self._stopped.wait(delay)
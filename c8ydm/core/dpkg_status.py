@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import mmap
+
+DPKG_STATUS = '/var/lib/dpkg/status'
+
+# Package states without an installed version, the same as is_installed of python-apt
+_NOT_INSTALLED = (b'not-installed', b'config-files')
+_FIELDS = {b'Package': 'name', b'Status': 'status', b'Version': 'version', b'Architecture': 'arch'}
+
+
+def installed_packages(path=DPKG_STATUS, use_mmap=False):
+    """
+    Generator of (name, version, arch) of the installed packages read straight from
+    the dpkg status file. Only the four needed fields of every paragraph are looked
+    at. With use_mmap the file is mapped instead of read through a buffer.
+    """
+    with open(path, 'rb') as f:
+        if use_mmap:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty file
+                return
+            with mapped:
+                yield from _parse(iter(mapped.readline, b''))
+        else:
+            yield from _parse(f)
+
+
+def _parse(lines):
+    package = {}
+    for line in lines:
+        first = line[:1]
+        if first == b' ' or first == b'\t':
+            # Continuation of a multi line field
+            continue
+        if first == b'\n' or first == b'':
+            if package:
+                installed = _installed(package)
+                if installed is not None:
+                    yield installed
+                package = {}
+            continue
+        field, _, value = line.partition(b':')
+        key = _FIELDS.get(field)
+        if key is not None:
+            package[key] = value.strip()
+    if package:
+        installed = _installed(package)
+        if installed is not None:
+            yield installed
+
+
+def _installed(package):
+    status = package.get('status', b'').split()
+    if (len(status) != 3 or status[2] in _NOT_INSTALLED
+            or 'name' not in package or 'version' not in package):
+        return None
+    return (package['name'].decode('utf-8'), package['version'].decode('utf-8'),
+            package.get('arch', b'').decode('utf-8'))
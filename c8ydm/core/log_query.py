@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import bisect
+import gzip
+import logging
+import os
+import pathlib
+import threading
+
+
+def timestamp_key(value):
+    """
+    Returns the sortable 'YYYY-MM-DD HH:MM:SS' prefix of an ISO date or a text or
+    JSON log line as bytes, or None if it does not start with a timestamp. Log
+    lines are written with asctime, so comparing these prefixes is the same as
+    comparing the dates.
+    """
+    if isinstance(value, str):
+        value = value.strip().replace('T', ' ', 1)[:19]
+        # Dates without seconds or time start at the beginning of the minute or day
+        value = (value + ' 00:00:00'[len(value) - 10:] if 10 <= len(value) < 19 else value)
+        value = value.encode('ascii', 'replace')
+    elif value.startswith(b'{"time": "'):
+        # Line of the JSON log format
+        value = value[10:]
+    if (len(value) >= 19 and value[4:5] == b'-' and value[7:8] == b'-' and value[10:11] == b' '
+            and value[13:14] == b':' and value[:4].isdigit()):
+        return value[:19]
+    return None
+
+
+class LogIndex:
+    """
+    Sparse index of timestamp to byte offset of a log file. An entry is added at
+    the first timestamped line after every interval bytes. The index is extended
+    with the lines appended since the last update and rebuilt once the file was
+    rotated.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, path, interval=64 * 1024):
+        self.path = path
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._reset(None)
+
+    def _reset(self, inode):
+        self._inode = inode
+        self._keys = []
+        self._offsets = []
+        self._indexed = 0
+        self._last_entry = -self.interval
+
+    def update(self):
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                self._reset(None)
+                return
+            if stat.st_ino != self._inode or stat.st_size < self._indexed:
+                self._reset(stat.st_ino)
+            if stat.st_size == self._indexed:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self._indexed)
+                offset = self._indexed
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # Still being written, indexed with the next update
+                        break
+                    if offset - self._last_entry >= self.interval:
+                        key = timestamp_key(line)
+                        if key is not None and (not self._keys or key >= self._keys[-1]):
+                            self._keys.append(key)
+                            self._offsets.append(offset)
+                            self._last_entry = offset
+                    offset += len(line)
+                self._indexed = offset
+
+    def seek(self, date_from):
+        """
+        Returns an offset at or before the first line logged at date_from.
+        """
+        self.update()
+        with self._lock:
+            position = bisect.bisect_left(self._keys, timestamp_key(date_from))
+            return self._offsets[position - 1] if position > 0 else 0
+
+    def __len__(self):
+        return len(self._keys)
+
+
+def query(path, date_from, date_to, search='', maximum_lines=1000, index=None):
+    """
+    Generator of the lines of the log logged between date_from and date_to which
+    contain search (case insensitive). Lines without timestamp, e.g. tracebacks,
+    belong to the last timestamped line. The file is read from the offset of the
+    index and the scan stops at date_to or after maximum_lines.
+    """
+    start, end = _date_range(date_from, date_to)
+    offset = index.seek(date_from) if index is not None else 0
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        yield from _scan(f, start, end, search.lower().encode('utf-8'), int(maximum_lines))
+
+
+def _date_range(date_from, date_to):
+    start = timestamp_key(date_from)
+    end = timestamp_key(date_to)
+    if start is None or end is None:
+        raise ValueError(f'Invalid date range {date_from} - {date_to}')
+    return start, end
+
+
+def _scan(lines, start, end, search, remaining):
+    if remaining <= 0:
+        return
+    current = None
+    for line in lines:
+        key = timestamp_key(line)
+        if key is not None:
+            current = key
+        if current is None or current < start:
+            continue
+        if current > end:
+            return
+        if search and search not in line.lower():
+            continue
+        yield line.decode('utf-8', 'replace')
+        remaining -= 1
+        if remaining == 0:
+            return
+
+
+class LogArchive:
+    """
+    The live log together with its rotations path.1 ... path.N, plain or gzip
+    compressed, queried as one time ordered stream. The first and last timestamp
+    of every rotated segment are kept, segments outside of the queried range are
+    skipped without being read again.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, path, max_segments=5, interval=64 * 1024):
+        self.path = pathlib.Path(path)
+        self.max_segments = max_segments
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._bounds = {}
+        self._indexes = {}
+
+    def segments(self):
+        """
+        Returns the existing rotated segments, oldest first, followed by the live log.
+        """
+        segments = []
+        for number in range(self.max_segments, 0, -1):
+            for name in (f'{self.path.name}.{number}', f'{self.path.name}.{number}.gz'):
+                segment = self.path.with_name(name)
+                if segment.exists():
+                    segments.append(segment)
+        if self.path.exists():
+            segments.append(self.path)
+        return segments
+
+    def bounds(self, segment):
+        """
+        Returns the first and last timestamp key of a rotated segment, (None, None)
+        if it has no timestamped line.
+        """
+        stat = segment.stat()
+        identity = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._bounds.get(segment)
+            if cached is not None and cached[0] == identity:
+                return cached[1]
+        first = last = None
+        if segment.suffix == '.gz':
+            # No random access into gzip, it is read once and the result kept
+            with gzip.open(segment, 'rb') as f:
+                for line in f:
+                    key = timestamp_key(line)
+                    if key is not None:
+                        first = first or key
+                        last = key
+        else:
+            with open(segment, 'rb') as f:
+                for line in f:
+                    first = timestamp_key(line)
+                    if first is not None:
+                        break
+                f.seek(max(0, stat.st_size - self.interval))
+                for line in f:
+                    last = timestamp_key(line) or last
+            last = last or first
+        with self._lock:
+            self._bounds[segment] = (identity, (first, last))
+        return first, last
+
+    def query(self, date_from, date_to, search='', maximum_lines=1000):
+        start, end = _date_range(date_from, date_to)
+        search = search.lower().encode('utf-8')
+        remaining = int(maximum_lines)
+        for segment in self.segments():
+            if remaining <= 0:
+                return
+            try:
+                if segment != self.path:
+                    first, last = self.bounds(segment)
+                    if first is None or last < start or first > end:
+                        continue
+                if segment.suffix == '.gz':
+                    lines = gzip.open(segment, 'rb')
+                else:
+                    lines = open(segment, 'rb')
+                    lines.seek(self._index(segment).seek(date_from))
+            except FileNotFoundError:
+                # Rotated away in the meantime
+                continue
+            try:
+                for line in _scan(lines, start, end, search, remaining):
+                    remaining -= 1
+                    yield line
+            finally:
+                lines.close()
+
+    def _index(self, segment):
+        with self._lock:
+            index = self._indexes.get(segment)
+            if index is None:
+                index = self._indexes[segment] = LogIndex(segment, self.interval)
+            return index
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import logging
+import threading
+import time
+
+
+class MessageBatcher:
+    """
+    Coalesces SmartREST lines published to the same topic with the same QoS into
+    one newline separated MQTT payload. A batch is handed to publish(topic, payload, qos)
+    when adding another line would exceed max_bytes or linger seconds after its first line.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, publish, max_bytes=16000, linger=0.1):
+        self.publish = publish
+        self.max_bytes = int(max_bytes)
+        self.linger = float(linger)
+        self._batches = {}
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        if self.linger > 0:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.name = 'BatcherThread'
+            self._thread.start()
+
+    def add(self, topic, payload, qos=0):
+        if self.linger <= 0:
+            self.publish(topic, payload, qos)
+            return
+        key = (topic, qos)
+        size = len(payload.encode('utf-8'))
+        with self._condition:
+            batch = self._batches.get(key)
+            if batch is not None and batch['size'] + 1 + size > self.max_bytes:
+                self._publish_batch(key, self._batches.pop(key))
+                batch = None
+            if batch is None:
+                batch = {'lines': [], 'size': -1, 'deadline': time.monotonic() + self.linger}
+                self._batches[key] = batch
+                self._condition.notify()
+            batch['lines'].append(payload)
+            batch['size'] += 1 + size
+
+    def flush(self):
+        with self._condition:
+            batches = self._batches
+            self._batches = {}
+            for key, batch in batches.items():
+                self._publish_batch(key, batch)
+
+    def stop(self):
+        self.flush()
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def _publish_batch(self, key, batch):
+        topic, qos = key
+        try:
+            self.publish(topic, '\n'.join(batch['lines']), qos)
+        except Exception as e:
+            self.logger.exception(f'Error on publishing batch of {len(batch["lines"])} message(s) to {topic}: {e}')
+
+    def _run(self):
+        with self._condition:
+            while not self._stopped:
+                if not self._batches:
+                    self._condition.wait()
+                    continue
+                now = time.monotonic()
+                expired = [key for key, batch in self._batches.items() if batch['deadline'] <= now]
+                for key in expired:
+                    self._publish_batch(key, self._batches.pop(key))
+                if self._batches:
+                    next_deadline = min(batch['deadline'] for batch in self._batches.values())
+                    self._condition.wait(max(0, next_deadline - time.monotonic()))
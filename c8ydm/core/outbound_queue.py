@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import logging
+import sqlite3
+import threading
+import time
+
+
+class OutboundQueue:
+    """
+    Persistent FIFO of MQTT messages which could not be published while the
+    agent was disconnected. Backed by SQLite, the oldest messages are evicted
+    once max_messages is exceeded.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, path, max_messages=10000):
+        self.path = str(path)
+        self.max_messages = max(1, int(max_messages))
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS messages ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'topic TEXT NOT NULL, '
+            'payload TEXT NOT NULL, '
+            'qos INTEGER NOT NULL, '
+            'created REAL NOT NULL)')
+        self._connection.commit()
+        self._size = self._connection.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+        if self._size > 0:
+            self.logger.info(f'Found {self._size} spooled messages in {self.path}')
+
+    def put(self, topic, payload, qos=0):
+        with self._lock:
+            self._connection.execute(
+                'INSERT INTO messages (topic, payload, qos, created) VALUES (?, ?, ?, ?)',
+                (topic, payload, int(qos), time.time()))
+            self._size += 1
+            overflow = self._size - self.max_messages
+            if overflow > 0:
+                self._connection.execute(
+                    'DELETE FROM messages WHERE id IN (SELECT id FROM messages ORDER BY id LIMIT ?)',
+                    (overflow,))
+                self._size -= overflow
+                self.evicted += overflow
+                self.logger.warning(f'Outbound queue full, evicted {overflow} oldest message(s)')
+            self._connection.commit()
+
+    def peek(self, limit=100):
+        """
+        Returns up to limit of the oldest messages as (id, topic, payload, qos) tuples
+        without removing them.
+        """
+        with self._lock:
+            return self._connection.execute(
+                'SELECT id, topic, payload, qos FROM messages ORDER BY id LIMIT ?',
+                (limit,)).fetchall()
+
+    def remove(self, ids):
+        if not ids:
+            return
+        with self._lock:
+            cursor = self._connection.executemany(
+                'DELETE FROM messages WHERE id = ?', [(i,) for i in ids])
+            self._size -= cursor.rowcount
+            self._connection.commit()
+
+    def size(self):
+        with self._lock:
+            return self._size
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+from c8ydm.core.dispatcher import OperationDispatcher
+
+
+class _SensorJob:
+
+    def __init__(self, sensor):
+        self.sensor = sensor
+        self.name = sensor.__class__.__name__
+        self.base = 0
+        self.running = False
+        self.runs = 0
+        self.skipped = 0
+        self.last_lag = 0
+        self.max_lag = 0
+        self.last_duration = 0
+
+
+class SensorScheduler:
+    """
+    Polls sensors from one timer thread and a small fixed worker pool. Every sensor
+    is polled with its own interval and jitter. A poll is skipped when the previous
+    poll of the same sensor is still running.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, handler, default_interval, workers=2):
+        self.handler = handler
+        self.default_interval = default_interval
+        self.workers = workers
+        self._condition = threading.Condition()
+        self._heap = []
+        self._jobs = []
+        self._sequence = itertools.count()
+        self._stopped = True
+        self._thread = None
+        self._dispatcher = None
+
+    def start(self, sensors):
+        self.stop()
+        now = time.monotonic()
+        with self._condition:
+            self._stopped = False
+            self._jobs = [_SensorJob(sensor) for sensor in sensors]
+            self._heap = []
+            for job in self._jobs:
+                job.base = now
+                self._push(job, now + self._jitter(job))
+            self._dispatcher = OperationDispatcher(
+                self.workers, len(self._jobs) + self.workers, 'SensorThread')
+            self._dispatcher.start()
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.name = 'SchedulerThread'
+            self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._condition.notify()
+            thread = self._thread
+            dispatcher = self._dispatcher
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        if dispatcher is not None:
+            dispatcher.stop(0)
+
+    def get_metrics(self):
+        with self._condition:
+            return {job.name: {
+                'interval': self._interval(job),
+                'runs': job.runs,
+                'skipped': job.skipped,
+                'running': job.running,
+                'lastLag': round(job.last_lag, 3),
+                'maxLag': round(job.max_lag, 3),
+                'lastDuration': round(job.last_duration, 3)
+            } for job in self._jobs}
+
+    def _interval(self, job):
+        try:
+            interval = job.sensor.getInterval()
+        except Exception:
+            interval = None
+        return float(interval or self.default_interval())
+
+    def _jitter(self, job):
+        try:
+            jitter = float(job.sensor.getJitter() or 0)
+        except Exception:
+            jitter = 0
+        return random.uniform(0, jitter) if jitter > 0 else 0
+
+    def _push(self, job, due):
+        heapq.heappush(self._heap, (due, next(self._sequence), job))
+
+    def _run(self):
+        with self._condition:
+            while not self._stopped:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                due, _, job = self._heap[0]
+                now = time.monotonic()
+                if due > now:
+                    self._condition.wait(due - now)
+                    continue
+                heapq.heappop(self._heap)
+                if job.running:
+                    job.skipped += 1
+                    self.logger.warning(f'Sensor {job.name} is still running, skipping this poll')
+                else:
+                    job.running = True
+                    job.last_lag = now - due
+                    job.max_lag = max(job.max_lag, job.last_lag)
+                    if not self._dispatcher.submit(self._run_job, job):
+                        job.running = False
+                        job.skipped += 1
+                interval = self._interval(job)
+                job.base += interval
+                if job.base < now:
+                    # The scheduler fell behind, realign instead of catching up
+                    job.base = now + interval
+                self._push(job, job.base + self._jitter(job))
+
+    def _run_job(self, job):
+        start = time.monotonic()
+        try:
+            self.handler(job.sensor)
+        finally:
+            with self._condition:
+                job.running = False
+                job.runs += 1
+                job.last_duration = time.monotonic() - start
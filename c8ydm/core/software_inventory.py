@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from c8ydm.framework.smartrest import chunked_messages
+
+
+class SoftwareInventory:
+    """
+    Remembers the last software list reported to Cumulocity, persisted in a JSON
+    file together with its hash and the device it was reported to. Later lists are
+    reported as delta with 141 (added) and 142 (removed) messages. The full list is
+    only sent when nothing was reported to the device before, the delta is larger
+    than max_delta or a full report is requested.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, path, max_delta=100):
+        self.path = str(path)
+        self.max_delta = int(max_delta)
+        self._lock = threading.Lock()
+        self._hash, self._software, self._device = self._load()
+
+    @staticmethod
+    def _entries(software_list):
+        return {(software['name'], software['version'], software['softwareType'])
+                for software in software_list}
+
+    @staticmethod
+    def _hash_of(entries):
+        return hashlib.sha256(json.dumps(sorted(entries)).encode('utf-8')).hexdigest()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+            entries = {tuple(entry) for entry in stored['software']}
+            if self._hash_of(entries) != stored['hash']:
+                self.logger.warning(f'Reported software inventory {self.path} is corrupt, sending the full list')
+                return None, set(), None
+            return stored['hash'], entries, stored.get('device')
+        except FileNotFoundError:
+            return None, set(), None
+        except Exception as e:
+            self.logger.warning(f'Could not read reported software inventory {self.path}: {e}')
+            return None, set(), None
+
+    def _store(self, entries, digest, device):
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'hash': digest, 'device': device, 'software': sorted(entries)}, f)
+        os.replace(temporary, self.path)
+        self._hash, self._software, self._device = digest, entries, device
+
+    def request_full(self):
+        """
+        Forgets the reported list, the next report sends the full list.
+        """
+        with self._lock:
+            self._hash, self._software = None, set()
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def changes(self, software_list, device=None):
+        """
+        Returns the (added, removed) entries since the last report as sorted lists of
+        (name, version, softwareType) or None if the full list has to be sent. A
+        device other than the one reported to before, e.g. after the device was
+        registered again, gets the full list.
+        """
+        entries = self._entries(software_list)
+        with self._lock:
+            if self._hash is None:
+                return None
+            if device is not None and device != self._device:
+                self.logger.info(f'Software list was reported to {self._device}, not to {device}')
+                return None
+            if self._hash_of(entries) == self._hash:
+                return [], []
+            added = sorted(entries - self._software)
+            removed = sorted(self._software - entries)
+        if len(added) + len(removed) > self.max_delta:
+            return None
+        return added, removed
+
+    def report(self, software_list, publish, send_full, full=False, device=None):
+        """
+        Reports software_list to device either with publish(message) as delta or
+        with send_full(software_list). Both return True on success, publish only
+        once the message was delivered or spooled. The list is remembered once it
+        was reported, else the next report sends the changes again.
+        """
+        changes = None if full else self.changes(software_list, device)
+        entries = self._entries(software_list)
+        if changes is None:
+            self.logger.info(f'Reporting full software list of {len(entries)} package(s)')
+            if not send_full(software_list):
+                return False
+        else:
+            added, removed = changes
+            if not added and not removed:
+                self.logger.debug('Software list unchanged, nothing to report')
+                return True
+            self.logger.info(f'Reporting software delta of {len(added)} added and {len(removed)} removed package(s)')
+            messages = []
+            if removed:
+                messages += chunked_messages('s/us', [[name, version] for name, version, _ in removed], '142', '142')
+            if added:
+                messages += chunked_messages('s/us', [[name, version, software_type, ' ']
+                                                      for name, version, software_type in added], '141', '141')
+            for message in messages:
+                if not publish(message):
+                    self.logger.warning('Software delta not acknowledged, it is reported again with the next report')
+                    return False
+        with self._lock:
+            self._store(entries, self._hash_of(entries), device if device is not None else self._device)
+        return True
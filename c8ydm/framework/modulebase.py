@@ -32,6 +32,25 @@ class Sensor:
   @abstractmethod
   def getSensorMessages(self): pass
 
+  '''
+  Returns the interval in seconds the sensor is polled with. Returns None by default,
+  so that the sensor is polled every main.loop.interval.seconds.
+  '''
+  def getInterval(self):
+    return None
+
+  '''
+  Returns the maximum random delay in seconds added to every poll of the sensor.
+  '''
+  def getJitter(self):
+    return 0
+
+  '''
+  Called when the agent stops. Sensors running background threads end them here.
+  '''
+  def stop(self):
+    pass
+
 class Listener:
   __metaclass__ = ABCMeta
 
@@ -57,6 +76,28 @@ class Listener:
   @abstractmethod
   def getSupportedTemplates(self): pass
 
+  '''
+  Returns a list of (topic, messageId) tuples the listener handles. Only matching
+  messages are passed to handleOperation, a topic of None matches any topic.
+  Returns None by default, so that every received message is passed to the listener.
+  '''
+  def getSupportedMessages(self):
+    return None
+
+  '''
+  Returns the (class, resource) the operation in message is run with. The class is
+  'parallel', 'resource' to run one operation at a time per resource or 'exclusive'
+  to run without any other operation. Returns ('parallel', None) by default.
+  '''
+  def getConcurrency(self, message):
+    return ('parallel', None)
+
+  '''
+  Called when the agent stops. Listeners running background threads end them here.
+  '''
+  def stop(self):
+    pass
+
 class Initializer:
   __metaclass__ = ABCMeta
 
@@ -17,6 +17,21 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+def escape(value):
+  """
+  Applies the necessary SmartREST escaping to any value
+  """
+  value = str(value).replace('"', '""')
+
+  should_escape = '"' in value or ',' in value or '\n' in value or \
+    '\r' in value or '\t' in value or value.startswith(' ') or \
+      value.endswith(' ')
+
+  if should_escape:
+    value = '"{}"'.format(value)
+  return value
+
+
 class SmartRESTMessage:
 
   def __init__(self, topic, messageId, values):
@@ -25,18 +40,30 @@ class SmartRESTMessage:
     self.values = values
 
   def getMessage(self):
-    values = []
-    # Applies the necessary SmartREST escaping to any string passed to the function
-    for value in map(str, self.values):
-      value = value.replace('"', '""')
-
-      should_escape = '"' in value or ',' in value or '\n' in value or \
-        '\r' in value or '\t' in value or value.startswith(' ') or \
-          value.endswith(' ')
+    values = [escape(value) for value in self.values]
+    msg = str(self.messageId) + ',' + ','.join(values)
+    return msg.rstrip(', ')
 
-      if should_escape:
-        value = '"{}"'.format(value)
 
-      values.append(value)
-    msg = str(self.messageId) + ',' + ','.join(map(str,values))
-    return msg.rstrip(', ')
+def chunked_messages(topic, groups, firstMessageId='140', nextMessageId='141', maxBytes=16000):
+  """
+  Splits a list of value groups, e.g. [name, version, type, url] per package, into
+  messages of at most maxBytes of escaped UTF-8 payload. A group is never split.
+  The first message uses firstMessageId (140 replaces the software list), all
+  following ones nextMessageId (141 appends to it).
+  """
+  messages = []
+  values = []
+  size = len(firstMessageId.encode('utf-8'))
+  for group in groups:
+    escaped = [escape(value) for value in group]
+    groupSize = sum(len(value.encode('utf-8')) + 1 for value in escaped)
+    if values and size + groupSize > maxBytes:
+      messages.append(SmartRESTMessage(topic, nextMessageId if messages else firstMessageId, values))
+      values = []
+      size = len(nextMessageId.encode('utf-8'))
+    values.extend(group)
+    size += groupSize
+  if values or not messages:
+    messages.append(SmartRESTMessage(topic, nextMessageId if messages else firstMessageId, values))
+  return messages
@@ -24,7 +24,10 @@ import signal
 import subprocess
 import sys
 import time
+import atexit
 import pathlib
+import gzip
+import shutil
 from os.path import expanduser
 from logging.handlers import RotatingFileHandler
 import signal
@@ -34,12 +37,26 @@ import c8ydm.utils.systemutils as systemutils
 from c8ydm.client import Agent
 from c8ydm.client import Bootstrap
 from c8ydm.utils import Configuration
+from c8ydm.utils.logutils import JsonFormatter, start_async_logging, stop_async_logging
 
 agent = None
 bootstrap_agent = None
+log_listener = None
 terminated = False
 simulated = False
 
+def gzip_rotator(source, dest):
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+def stop_logging():
+    global log_listener
+    if log_listener:
+        listener = log_listener
+        log_listener = None
+        stop_async_logging(logging.getLogger(), listener)
+
 def handle_sigterm(*args):
     global terminated
     if not terminated:
@@ -58,6 +75,7 @@ def keyboard_interupt_hook(exctype, value, traceback):
                 global bootstrap_agent
                 if bootstrap_agent:
                     bootstrap_agent.stop()
+                stop_logging()
                 stop()
                 sys.exit(0)
         #else:
@@ -102,10 +120,23 @@ def start():
         # Max 5 log files each 10 MB.
         rotate_handler = RotatingFileHandler(filename=path / 'agent.log', maxBytes=10000000,
                                             backupCount=5)
+        if str(config.getValue('agent', 'log.compress')).lower() == 'true':
+            # Rotated logs are stored as agent.log.1.gz ... agent.log.5.gz
+            rotate_handler.namer = lambda name: name + '.gz'
+            rotate_handler.rotator = gzip_rotator
+        if str(config.getValue('agent', 'log.format')).lower() == 'json':
+            log_file_formatter = JsonFormatter()
         rotate_handler.setFormatter(log_file_formatter)
         rotate_handler.setLevel(loglevel)
         # Log to Rotating File
         logger.addHandler(rotate_handler)
+        if str(config.getValue('agent', 'log.async')).lower() == 'true':
+            # Console and file are written by one background thread, logging
+            # threads only enqueue the record
+            global log_listener
+            log_listener = start_async_logging(logger, int(config.getValue('agent', 'log.queue.size') or 10000))
+            # Queued records are written on any exit, not only on KeyboardInterrupt
+            atexit.register(stop_logging)
 
         containerId = None
         serial = None
@@ -156,6 +187,8 @@ def start():
         agent.run()
     except Exception as ex:
         logger.exception(f'Error on main start {ex}', ex)
+    finally:
+        stop_logging()
         
 
 
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import requests_unixsocket
+import logging
+import json
+
+
+class DockerClient():
+    """
+    Minimal client for the Docker Engine API on the local unix socket.
+    A session with the same get interface can be passed e.g. for tests.
+    """
+    dockerSocket = 'http+unix://%2Fvar%2Frun%2Fdocker.sock'
+
+    def __init__(self, session=None):
+        self.session = session if session is not None else requests_unixsocket.Session()
+
+    def ping(self):
+        try:
+            response = self.session.get(self.dockerSocket + '/_ping', timeout=5)
+            return response.status_code == 200
+        except Exception as e:
+            logging.debug(f'Docker API not reachable: {e}')
+            return False
+
+    def getContainers(self, all=True):
+        try:
+            response = self.session.get(self.dockerSocket + '/containers/json',
+                                        params={'all': 'true' if all else 'false'}, timeout=10)
+            if response.status_code != 200:
+                logging.warning(f'Listing docker containers failed with status code {response.status_code}')
+                return None
+            return response.json()
+        except Exception as e:
+            logging.debug(f'Listing docker containers failed: {e}')
+            return None
+
+    def getContainerStats(self, containerId):
+        """
+        Returns a single stats sample of the container. With one-shot the engine
+        does not wait for a second sample, so precpu_stats is not filled.
+        """
+        try:
+            response = self.session.get(self.dockerSocket + '/containers/' + containerId + '/stats',
+                                        params={'stream': 'false', 'one-shot': 'true'}, timeout=10)
+            if response.status_code != 200:
+                logging.warning(f'Stats of docker container {containerId} failed with status code {response.status_code}')
+                return None
+            return response.json()
+        except Exception as e:
+            logging.exception(e)
+            return None
+
+    def getEvents(self, filters=None):
+        """
+        Generator yielding events of the engine as they happen. The request does not
+        time out, errors are raised to the caller which has to subscribe again.
+        """
+        params = {}
+        if filters:
+            params['filters'] = json.dumps(filters)
+        response = self.session.get(self.dockerSocket + '/events', params=params, stream=True, timeout=None)
+        if response.status_code != 200:
+            raise ConnectionError(f'Subscribing to docker events failed with status code {response.status_code}')
+        try:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+        finally:
+            response.close()
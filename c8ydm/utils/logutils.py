@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2021 Software AG, Darmstadt, Germany and/or its licensors
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+        http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import copy
+import json
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line. The time comes first in the same
+    format as the text log, so logfile requests can search JSON logs as well.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'thread': record.threadName,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+_exception_formatter = logging.Formatter()
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Puts records into a bounded queue without blocking the logging thread. Records
+    are dropped while the queue is full, the number of dropped records is counted
+    per level and reported with the next record that fits into the queue again.
+    """
+
+    def __init__(self, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.dropped = {}
+        self._unreported = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # The message and traceback are formatted now, the arguments may have
+        # changed by the time the writer thread handles the record. Unlike the
+        # stdlib prepare the handler formatter is not applied, that is left to
+        # the handlers of the listener.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        with self._lock:
+            if self._unreported:
+                report = logging.LogRecord(__name__, logging.WARNING, __file__, 0,
+                                           'Log queue full, dropped %d log record(s)', (self._unreported,), None)
+                try:
+                    self.queue.put_nowait(report)
+                    self._unreported = 0
+                except queue.Full:
+                    pass
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped[record.levelname] = self.dropped.get(record.levelname, 0) + 1
+                self._unreported += 1
+
+
+class BlockingStopListener(QueueListener):
+    """
+    QueueListener which waits for space in a full queue on stop instead of failing.
+    """
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+def start_async_logging(logger, queue_size=10000):
+    """
+    Moves the handlers of the logger behind a DroppingQueueHandler, they are called
+    by a single background thread from then on. Returns the started listener which
+    has to be stopped to flush the remaining records.
+    """
+    handlers = list(logger.handlers)
+    queue_handler = DroppingQueueHandler(queue_size)
+    listener = BlockingStopListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+    listener.start()
+    return listener
+
+
+def stop_async_logging(logger, listener):
+    """
+    Attaches the handlers of the listener to the logger again and stops the
+    listener once the queued records were written.
+    """
+    for handler in listener.handlers:
+        logger.addHandler(handler)
+    for handler in list(logger.handlers):
+        if isinstance(handler, DroppingQueueHandler) and handler.queue is listener.queue:
+            logger.removeHandler(handler)
+    listener.stop()
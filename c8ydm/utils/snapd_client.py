@@ -2,14 +2,149 @@
 # -*- coding: utf-8 -*-
 import requests_unixsocket
 import logging
-import json, time
+import json, time, threading
+from collections import namedtuple
+from types import MappingProxyType
+
+
+Snap = namedtuple('Snap', ['name', 'version', 'channel', 'revision'])
+
+
+class SnapSnapshot():
+    """
+    Immutable view of the installed snaps at one point in time.
+    """
+
+    def __init__(self, snaps):
+        self.snaps = tuple(sorted(snaps))
+        self.byName = MappingProxyType({snap.name: snap for snap in self.snaps})
+
+    def __iter__(self):
+        return iter(self.snaps)
+
+    def __len__(self):
+        return len(self.snaps)
+
+    def get(self, name):
+        return self.byName.get(name)
+
+    def updateActions(self, software):
+        """
+        Returns the [name, version##channel, url, 'snap', action] entries bringing the
+        snaps of a software list of [name, version, url] to the device. Missing snaps
+        are installed, installed ones with another version or channel are refreshed.
+        The version is given as version##channel or as reported, 'version - channel'.
+        snapd can't install a given version, a refresh moves the snap to the latest
+        revision of the channel and fails if there is none. Installed snaps missing
+        from the list are kept.
+        """
+        actions = []
+        for name, version, url in software:
+            wanted, _, channel = version.partition('##')
+            if not channel and ' - ' in wanted:
+                wanted, channel = wanted.rsplit(' - ', 1)
+            installed = self.byName.get(name)
+            if installed is None:
+                action = 'install'
+            elif wanted.strip() != installed.version or (channel and channel != installed.channel):
+                action = 'update'
+            else:
+                continue
+            actions.append([name, wanted + '##' + channel if channel else wanted, url, 'snap', action])
+        return actions
+
+    def diff(self, previous):
+        """
+        Returns the (added, removed) snaps compared to a previous snapshot, a snap
+        with a new version or channel is removed in its old and added in its new form.
+        """
+        previousSnaps = set(previous.snaps) if previous is not None else set()
+        current = set(self.snaps)
+        return sorted(current - previousSnaps), sorted(previousSnaps - current)
+
+
+class SnapInventory():
+    """
+    Caches the installed snaps of snapd. The cache is invalidated when one of our
+    changes finished. Changes started outside of the agent, e.g. snap refresh, are
+    detected by the state of /v2/changes, which is checked at most every
+    checkInterval seconds.
+    """
+
+    def __init__(self, client, checkInterval=30):
+        self.client = client
+        self.checkInterval = checkInterval
+        self.fetched = 0
+        self.reported = None
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._changeState = None
+        self._checked = 0
+        self._generation = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+            self._generation += 1
+
+    def _currentChangeState(self):
+        changes = self.client.getChanges('all')
+        if changes is None or changes.get('type') == 'error':
+            return None
+        return tuple(sorted((change['id'], change.get('ready', False)) for change in changes['result']))
+
+    def snapshot(self):
+        # snapd is requested without holding the lock, so a slow answer does not
+        # block invalidate() and with it the wait for our changes
+        with self._lock:
+            now = time.monotonic()
+            cached, cachedChangeState, generation = self._snapshot, self._changeState, self._generation
+            if cached is not None and now - self._checked < self.checkInterval:
+                return cached
+        changeState = self._currentChangeState()
+        with self._lock:
+            self._checked = now
+        if cached is not None and changeState is not None and changeState == cachedChangeState:
+            return cached
+        installedSnaps = self.client.getInstalledSnaps()
+        if installedSnaps is None or installedSnaps.get('type') == 'error':
+            # Keep the last known snaps while snapd is not available
+            return cached if cached is not None else SnapSnapshot([])
+        snapshot = SnapSnapshot(
+            Snap(snap['name'], snap['version'], snap['channel'], snap.get('revision'))
+            for snap in installedSnaps['result'])
+        with self._lock:
+            self.fetched += 1
+            # Invalidated while fetching, the snaps may be older than the finished change
+            if self._generation == generation:
+                self._snapshot = snapshot
+                self._changeState = changeState
+        return snapshot
+
+    def unreported(self):
+        """
+        Returns the current snapshot and its (added, removed) snaps compared to the
+        last snapshot passed to markReported, or None for added and removed if
+        nothing was reported yet.
+        """
+        current = self.snapshot()
+        with self._lock:
+            reported = self.reported
+        if reported is None:
+            return current, None, None
+        added, removed = current.diff(reported)
+        return current, added, removed
+
+    def markReported(self, snapshot):
+        with self._lock:
+            self.reported = snapshot
 
 
 class SnapdClient():
     snapdSocket = 'http+unix://%2Frun%2Fsnapd.socket'
 
-    def __init__(self):
-        self.isBusy = False
+    def __init__(self, inventoryCheckInterval=30):
+        self.inventory = SnapInventory(self, inventoryCheckInterval)
         snapConnected = False
         while not snapConnected:
             try:
@@ -116,9 +251,150 @@ class SnapdClient():
         except Exception as e:
             logging.exception(e)
 
+    def snapsAction(self, action, snapNames):
+        """
+        One snapd transaction for the action on all snaps. snapd does not accept
+        options like channel for multi-snap actions.
+        """
+        body = {
+            'action': action,
+            'snaps': snapNames
+        }
+        headers = {
+            'Content-Type': 'application/json'
+        }
+        try:
+            response = self.session.post(self.snapdSocket + '/v2/snaps', data=json.dumps(body), headers=headers)
+            return response.json()
+        except Exception as e:
+            logging.exception(e)
+
+    def snapAction(self, action, snapName, snapChannel=None):
+        if action == 'install':
+            return self.installSnap(snapName, snapChannel)
+        if action == 'refresh':
+            return self.updateSnap(snapName, snapChannel)
+        return self.deleteSnap(snapName)
+
+    def applySnapActions(self, requested, timeout=None):
+        """
+        Applies a list of (name, action, channel) with the snapd actions install,
+        refresh or remove. Snaps without channel are grouped into one bulk request
+        per action, snaps with channel are requested one by one. A rejected bulk
+        request is retried per snap, so one unknown snap does not fail the others.
+        Returns a dict of snap name to the error or None. The snaps of a failed bulk
+        change share one error message naming all of them.
+        """
+        bulk = {}
+        single = []
+        for name, action, channel in requested:
+            if channel:
+                single.append((action, [name], channel))
+            else:
+                bulk.setdefault(action, []).append(name)
+        submissions = [(action, names, None) for action, names in bulk.items()] + single
+        results = {}
+        changes = {}
+        while submissions:
+            action, names, channel = submissions.pop(0)
+            if len(names) > 1:
+                response = self.snapsAction(action, names)
+            else:
+                response = self.snapAction(action, names[0], channel)
+            if response is None:
+                results.update({name: f'Snap {name} error: snapd not reachable' for name in names})
+            elif response['status-code'] >= 400:
+                if len(names) > 1:
+                    logging.warning('Bulk %s of snaps %s rejected, requesting them one by one: %s',
+                                    action, names, response['result'].get('message'))
+                    submissions.extend((action, [name], None) for name in names)
+                else:
+                    logging.error('Snap %s error: %s', names[0], response['result'].get('message'))
+                    results[names[0]] = 'Snap ' + names[0] + ' error: ' + str(response['result'].get('message'))
+            else:
+                changes[response['change']] = names
+        finished = self.waitForChanges(list(changes), timeout)
+        for changeId, names in changes.items():
+            error = finished.get(changeId, {}).get('error')
+            if error and len(names) > 1:
+                error = 'Snaps ' + ', '.join(names) + ' error: ' + str(error)
+            elif error:
+                error = 'Snap ' + names[0] + ' error: ' + str(error)
+            for name in names:
+                results[name] = error
+        return results
+
     def getChangeStatus(self, changeId):
         try:
             response = self.session.get(self.snapdSocket + '/v2/changes/' + changeId)
             return response.json()
         except Exception as e:
             logging.exception(e)
+
+    def getChanges(self, select='in-progress'):
+        try:
+            response = self.session.get(self.snapdSocket + '/v2/changes', params={'select': select})
+            return response.json()
+        except Exception as e:
+            logging.exception(e)
+
+    @staticmethod
+    def _changeResult(change):
+        ready = change.get('ready', change.get('status') in ('Done', 'Error', 'Undone', 'Hold'))
+        error = change.get('err') if change.get('status') != 'Done' else None
+        return {'finished': ready, 'status': change.get('status'), 'error': error}
+
+    def waitForChanges(self, changeIds, timeout=None, minInterval=0.1, maxInterval=2.0, maxFailedPolls=30):
+        """
+        Waits until snapd finished all given changes and returns a dict of change id
+        to {'finished', 'status', 'error'}. All changes still in progress are polled
+        with one request, starting after minInterval and backing off to maxInterval
+        while nothing finished. Changes not finished within timeout or when snapd did
+        not answer maxFailedPolls polls in a row are returned with finished False.
+        """
+        pending = set(changeIds)
+        results = {}
+        interval = minInterval
+        failedPolls = 0
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while pending:
+            inProgress = self.getChanges('in-progress')
+            if inProgress is None or inProgress.get('type') == 'error':
+                failedPolls += 1
+                if failedPolls >= maxFailedPolls:
+                    for changeId in pending:
+                        results[changeId] = {'finished': False, 'status': 'Unknown',
+                                             'error': f'Change {changeId} unknown, snapd not reachable'}
+                    break
+                running = pending
+            else:
+                failedPolls = 0
+                running = {change['id'] for change in inProgress['result'] if change['id'] in pending}
+            for changeId in pending - running:
+                # Left the in-progress list, fetch its final status once
+                status = self.getChangeStatus(changeId)
+                if status and status.get('type') != 'error':
+                    result = self._changeResult(status['result'])
+                else:
+                    result = {'finished': True, 'status': 'Unknown',
+                              'error': status['result'].get('message') if status else 'Change status not available'}
+                if result['finished']:
+                    results[changeId] = result
+                else:
+                    running.add(changeId)
+            finishedAny = len(running) < len(pending)
+            if finishedAny:
+                self.inventory.invalidate()
+            pending = running
+            if not pending:
+                break
+            if finishedAny:
+                interval = minInterval
+            if deadline is not None and time.monotonic() + interval > deadline:
+                for changeId in pending:
+                    results[changeId] = {'finished': False, 'status': 'Timeout',
+                                         'error': f'Change {changeId} did not finish within {timeout}s'}
+                break
+            time.sleep(interval)
+            interval = min(maxInterval, interval * 2)
+        return results
@@ -0,0 +1,46 @@
+import os
+from c8ydm.core.apt_package_manager import AptCache
+
+class FakeCache:
+  def __init__(self):
+    self.opened = 0
+    self.updated = 0
+    self.changes = []
+  def open(self):
+    self.opened += 1
+  def update(self):
+    self.updated += 1
+  def get_changes(self):
+    return self.changes
+  def clear(self):
+    self.changes = []
+
+def test_cache_is_reopened_only_after_dpkg_status_changed(tmp_path):
+  status = tmp_path / 'status'
+  status.write_text('Package: a\n')
+  fake = FakeCache()
+  apt_cache = AptCache(factory=lambda: fake, watched_paths=[str(status), str(tmp_path / 'lists')])
+  for _ in range(3):
+    with apt_cache.use() as cache:
+      assert cache is fake
+  assert fake.opened == 1
+  status.write_text('Package: a\n\nPackage: b\n')
+  os.utime(status, ns=(0, 10 ** 9))
+  with apt_cache.use():
+    pass
+  assert fake.opened == 2
+  (tmp_path / 'lists').mkdir()
+  with apt_cache.use():
+    pass
+  assert fake.opened == 3
+
+def test_update_reopens_and_marks_are_cleared(tmp_path):
+  fake = FakeCache()
+  apt_cache = AptCache(factory=lambda: fake, watched_paths=[str(tmp_path / 'status')])
+  with apt_cache.use() as cache:
+    cache.changes.append('pkg')
+  assert fake.changes == []
+  with apt_cache.use(with_update=True):
+    pass
+  assert fake.updated == 1
+  assert fake.opened == 2
@@ -0,0 +1,18 @@
+from c8ydm.core.backoff import ExponentialBackoff
+
+def test_backoff_grows_exponentially_up_to_maximum():
+  backoff = ExponentialBackoff(1, 30)
+  bounds = [1, 2, 4, 8, 16, 30, 30]
+  for bound in bounds:
+    delay = backoff.next_delay()
+    assert 1 <= delay <= bound
+  for _ in range(100):
+    assert backoff.next_delay() <= 30
+
+def test_backoff_reset():
+  backoff = ExponentialBackoff(2, 100)
+  for _ in range(5):
+    backoff.next_delay()
+  backoff.reset()
+  assert backoff.attempts == 0
+  assert backoff.next_delay() == 2
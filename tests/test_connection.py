@@ -0,0 +1,92 @@
+import logging
+import threading
+from types import SimpleNamespace
+import c8ydm.client.mqtt_agent as mqtt_agent
+from c8ydm.client.mqtt_agent import Agent
+from c8ydm.core.backoff import ExponentialBackoff
+
+class FakeClient:
+  def __init__(self, agent, script):
+    self.agent = agent
+    self.script = script
+    self.subscriptions = []
+  def username_pw_set(self, username, password):
+    pass
+  def connect(self, url, port, ping):
+    self.rc, self.after = self.script.pop(0)
+  def loop_start(self):
+    self.on_connect(self, None, {}, self.rc)
+  def loop_stop(self):
+    pass
+  def disconnect(self):
+    pass
+  def subscribe(self, topics):
+    self.subscriptions.append(topics)
+    if self.after == 'lost':
+      self.on_disconnect(self, None, 1)
+    else:
+      self.agent.stopmarker = 1
+
+class FakeConfiguration:
+  def getCredentials(self):
+    return ('tenant', 'user', 'password')
+  def getValue(self, category, key):
+    return '60'
+
+class FakeComponent:
+  def __init__(self):
+    self.starts = 0
+  def start(self, sensors):
+    self.starts += 1
+  def get_metrics(self):
+    return {}
+
+def connecting_agent(script, monkeypatch):
+  agent = Agent.__new__(Agent)
+  agent.logger = logging.getLogger('test')
+  agent.configuration = FakeConfiguration()
+  agent.stopmarker = 0
+  agent.state = Agent.STATE_DISCONNECTED
+  agent.serial = 'serial'
+  agent.url, agent.port, agent.ping = 'localhost', 1883, 60
+  agent.tls = agent.cert_auth = False
+  agent.is_connected = False
+  agent.connect_result = threading.Event()
+  agent.connection_lost = threading.Event()
+  agent.connect_timeout = 5
+  agent.connect_rc = None
+  agent.backoff = ExponentialBackoff(1, 30)
+  agent.disconnected_at = None
+  agent.last_reconnect_seconds = None
+  agent.token_received = threading.Event()
+  agent.outbound_lock = threading.Lock()
+  agent.outbound_draining = False
+  agent.outbound_queue = SimpleNamespace(size=lambda: 0)
+  agent.dispatcher = agent.executor = FakeComponent()
+  agent.scheduler = FakeComponent()
+  agent._Agent__sensors = []
+  agent._Agent__subscriptions = [('s/ds', 0)]
+  agent.inits = 0
+  def init_agent():
+    agent.inits += 1
+    agent._Agent__subscribe()
+  agent._Agent__init_agent = init_agent
+  agent.clients = []
+  def client(serial):
+    agent.clients.append(FakeClient(agent, script))
+    return agent.clients[-1]
+  monkeypatch.setattr(mqtt_agent, 'mqtt', SimpleNamespace(Client=client))
+  monkeypatch.setattr(mqtt_agent.time, 'sleep', lambda seconds: None)
+  return agent
+
+def test_run_subscribes_once_per_connection_and_initializes_once(monkeypatch):
+  script = [(5, None), (0, 'lost'), (5, None), (0, 'lost'), (0, 'stop')]
+  agent = connecting_agent(script, monkeypatch)
+  agent.run()
+  assert script == []
+  assert [len(client.subscriptions) for client in agent.clients] == [0, 1, 0, 1, 1]
+  assert agent.inits == 1
+  assert agent.scheduler.starts == 1
+  assert agent.token_received.is_set()
+  assert agent.last_reconnect_seconds is not None
+  assert agent.state == Agent.STATE_STOPPED
@@ -0,0 +1,29 @@
+from collections import namedtuple
+import psutil
+from c8ydm.core.device_stats import DeviceStats
+
+def test_cpu_percent_is_computed_against_previous_snapshot():
+  times = namedtuple('scputimes', ['user', 'system', 'idle', 'iowait'])
+  previous = times(10.0, 5.0, 80.0, 5.0)
+  current = times(30.0, 15.0, 150.0, 5.0)
+  percent = DeviceStats._cpu_times_percent(previous, current)
+  assert percent == {'user': 20.0, 'system': 10.0, 'idle': 70.0, 'iowait': 0.0}
+
+def test_cpu_stats_do_not_block():
+  stats = DeviceStats()
+  cpu = stats.getCPUStats()
+  assert set(cpu) == {'guest', 'idle', 'iowait', 'irq', 'system', 'user'}
+  assert all(0.0 <= value <= 100.0 for value in cpu.values())
+  assert set(stats.getMemoryStats()) == {'free', 'used', 'total', 'percent'}
+  assert set(stats.getDiskStats()) == {'free', 'used', 'total', 'percent'}
+
+def test_cpu_stats_without_elapsed_time_repeat_the_previous_sample(monkeypatch):
+  times = namedtuple('scputimes', ['user', 'system', 'idle', 'iowait', 'irq', 'guest'])
+  samples = [times(10.0, 5.0, 80.0, 5.0, 0.0, 0.0), times(30.0, 15.0, 150.0, 5.0, 0.0, 0.0)]
+  monkeypatch.setattr(psutil, 'cpu_times', lambda: samples[0])
+  stats = DeviceStats()
+  assert stats.getCPUStats()['idle'] == 80.0
+  monkeypatch.setattr(psutil, 'cpu_times', lambda: samples[1])
+  first = stats.getCPUStats()
+  assert first['idle'] == 70.0
+  assert stats.getCPUStats() == first
@@ -0,0 +1,181 @@
+import threading
+import time
+from c8ydm.core.dispatcher import OperationDispatcher, OperationExecutor
+
+def test_dispatcher_runs_work_on_fixed_pool():
+  dispatcher = OperationDispatcher(workers=2, queue_size=10)
+  dispatcher.start()
+  names = set()
+  done = threading.Event()
+  counter = []
+  def work(i):
+    names.add(threading.current_thread().name)
+    counter.append(i)
+    if len(counter) == 10:
+      done.set()
+  for i in range(10):
+    assert dispatcher.submit(work, i)
+  assert done.wait(5)
+  dispatcher.stop(5)
+  assert len(names) <= 2
+  metrics = dispatcher.get_metrics()
+  assert metrics['completed'] == 10
+  assert metrics['rejected'] == 0
+
+def test_dispatcher_rejects_when_queue_full():
+  dispatcher = OperationDispatcher(workers=1, queue_size=1)
+  dispatcher.start()
+  release = threading.Event()
+  started = threading.Event()
+  def block():
+    started.set()
+    release.wait(5)
+  assert dispatcher.submit(block)
+  assert started.wait(5)
+  assert dispatcher.submit(block)
+  assert not dispatcher.submit(block)
+  release.set()
+  dispatcher.stop(5)
+  metrics = dispatcher.get_metrics()
+  assert metrics['rejected'] == 1
+  assert metrics['maxQueueDepth'] == 1
+
+def test_dispatcher_counts_failures():
+  dispatcher = OperationDispatcher(workers=1, queue_size=5)
+  dispatcher.start()
+  def fail():
+    raise ValueError('boom')
+  dispatcher.submit(fail)
+  dispatcher.stop(5)
+  assert dispatcher.get_metrics()['failed'] == 1
+
+def wait_idle(executor, timeout=5):
+  deadline = time.monotonic() + timeout
+  while time.monotonic() < deadline:
+    metrics = executor.get_metrics()
+    if metrics['pending'] == 0 and metrics['running'] == 0:
+      return True
+    time.sleep(0.01)
+  return False
+
+def test_executor_runs_resource_operations_in_order_without_blocking_parallel():
+  dispatcher = OperationDispatcher(workers=4, queue_size=10)
+  dispatcher.start()
+  executor = OperationExecutor(dispatcher, 10)
+  release = threading.Event()
+  fast_done = threading.Event()
+  order = []
+  def install(i):
+    order.append(('start', i))
+    release.wait(5)
+    order.append(('end', i))
+  for i in range(3):
+    assert executor.submit(('resource', 'packages'), install, i)
+  assert executor.submit(('parallel', None), fast_done.set)
+  assert fast_done.wait(5)
+  assert order == [('start', 0)]
+  assert executor.get_metrics()['pending'] == 2
+  release.set()
+  assert wait_idle(executor)
+  dispatcher.stop(5)
+  assert order == [('start', 0), ('end', 0), ('start', 1), ('end', 1), ('start', 2), ('end', 2)]
+
+def test_executor_runs_exclusive_operation_alone():
+  dispatcher = OperationDispatcher(workers=4, queue_size=10)
+  dispatcher.start()
+  executor = OperationExecutor(dispatcher, 10)
+  release = threading.Event()
+  started = threading.Event()
+  done = threading.Event()
+  order = []
+  def install():
+    started.set()
+    release.wait(5)
+    order.append('install')
+  def restart():
+    order.append('restart')
+  def command():
+    order.append('command')
+    done.set()
+  executor.submit(('resource', 'packages'), install)
+  assert started.wait(5)
+  executor.submit(('exclusive', None), restart)
+  executor.submit(('parallel', None), command)
+  assert not done.wait(0.2)
+  assert executor.get_metrics()['pending'] == 2
+  release.set()
+  assert done.wait(5)
+  dispatcher.stop(5)
+  assert order == ['install', 'restart', 'command']
+
+def test_executor_rejects_when_too_many_pending():
+  dispatcher = OperationDispatcher(workers=1, queue_size=5)
+  dispatcher.start()
+  executor = OperationExecutor(dispatcher, 1)
+  release = threading.Event()
+  started = threading.Event()
+  def block():
+    started.set()
+    release.wait(5)
+  assert executor.submit(('parallel', None), block)
+  assert started.wait(5)
+  assert executor.submit(('parallel', None), block)
+  assert not executor.submit(('parallel', None), block)
+  release.set()
+  assert wait_idle(executor)
+  dispatcher.stop(5)
+  metrics = executor.get_metrics()
+  assert metrics['rejected'] == 1
+  assert metrics['running'] == 0
+
+def test_executor_releases_resource_after_failure():
+  dispatcher = OperationDispatcher(workers=2, queue_size=5)
+  dispatcher.start()
+  executor = OperationExecutor(dispatcher, 5)
+  done = threading.Event()
+  def fail():
+    raise ValueError('boom')
+  executor.submit(('resource', 'packages'), fail)
+  executor.submit(('resource', 'packages'), done.set)
+  assert done.wait(5)
+  dispatcher.stop(5)
+  assert dispatcher.get_metrics()['failed'] == 1
+  assert executor.get_metrics()['busyResources'] == []
+
+def test_executor_drops_redelivered_pending_operation():
+  dispatcher = OperationDispatcher(workers=2, queue_size=10)
+  dispatcher.start()
+  executor = OperationExecutor(dispatcher, 10)
+  release = threading.Event()
+  started = threading.Event()
+  runs = []
+  def install(name):
+    started.set()
+    release.wait(5)
+    runs.append(name)
+  assert executor.submit(('resource', 'packages'), install, 'first', key='528,serial,first')
+  assert started.wait(5)
+  # Running until the handler returned, its 501 may not have been sent yet
+  assert executor.submit(('resource', 'packages'), install, 'first', key='528,serial,first')
+  assert executor.submit(('resource', 'packages'), install, 'second', key='528,serial,second')
+  assert executor.submit(('resource', 'packages'), install, 'second', key='528,serial,second')
+  release.set()
+  assert wait_idle(executor)
+  # Waiting no more, the same operation is accepted again
+  assert executor.submit(('resource', 'packages'), install, 'second', key='528,serial,second')
+  assert wait_idle(executor)
+  dispatcher.stop(5)
+  assert runs == ['first', 'second', 'second']
+  assert executor.get_metrics()['duplicates'] == 2
+
+def test_executor_runs_unknown_concurrency_in_parallel():
+  dispatcher = OperationDispatcher(workers=2, queue_size=10)
+  dispatcher.start()
+  executor = OperationExecutor(dispatcher, 10)
+  done = threading.Event()
+  assert executor.submit(('sequential', 'x'), lambda: None)
+  assert executor.submit('sometimes', done.set)
+  assert done.wait(5)
+  assert wait_idle(executor)
+  dispatcher.stop(5)
+  assert executor.get_metrics()['submitted'] == 2
@@ -0,0 +1,113 @@
+from c8ydm.core.docker_watcher import DockerWatcher
+from c8ydm.utils.docker_client import DockerClient
+
+class FakeResponse:
+  def __init__(self, status_code, body):
+    self.status_code = status_code
+    self.body = body
+  def json(self):
+    return self.body
+
+class FakeDockerSocket:
+  """Stands in for the requests_unixsocket session on /var/run/docker.sock"""
+  def __init__(self, containers, stats):
+    self.containers = containers
+    self.stats = stats
+    self.requests = []
+  def get(self, url, params=None, timeout=None):
+    path = url.replace(DockerClient.dockerSocket, '')
+    self.requests.append(path)
+    if path == '/containers/json':
+      return FakeResponse(200, self.containers)
+    container_id = path.split('/')[2]
+    samples = self.stats[container_id]
+    return FakeResponse(200, samples.pop(0))
+
+def stats_sample(total_usage, system_usage):
+  return {
+    'cpu_stats': {'cpu_usage': {'total_usage': total_usage}, 'system_cpu_usage': system_usage, 'online_cpus': 2},
+    'memory_stats': {'usage': 150 * 1024 * 1024, 'limit': 1024 * 1024 * 1024, 'stats': {'inactive_file': 50 * 1024 * 1024}}
+  }
+
+def test_docker_watcher_reads_containers_and_stats_from_api():
+  containers = [
+    {'Id': 'a' * 64, 'Names': ['/web'], 'State': 'running', 'Status': 'Up 2 hours'},
+    {'Id': 'b' * 64, 'Names': ['/job'], 'State': 'exited', 'Status': 'Exited (0) 5 minutes ago'}
+  ]
+  socket = FakeDockerSocket(containers, {'a' * 64: [stats_sample(1000, 100000), stats_sample(6000, 200000)]})
+  watcher = DockerWatcher(DockerClient(socket))
+
+  first = watcher.get_stats()['c8y_Docker']
+  assert first[0] == {'containerID': 'a' * 12, 'name': 'web', 'status': 'Up 2 hours', 'cpu': '0.00',
+                      'memory': '100MiB / 1GiB', 'memory_perc': '9.77'}
+  assert first[1]['status'] == 'Exited (0) 5 minutes ago'
+  assert first[1]['cpu'] == '0.00'
+
+  second = watcher.get_stats()['c8y_Docker']
+  assert second[0]['cpu'] == '10.00'
+  # One list call per cycle and stats only for running containers
+  assert socket.requests.count('/containers/json') == 2
+  assert len(socket.requests) == 4
+
+def test_docker_watcher_without_docker():
+  class Unavailable:
+    def get(self, url, params=None, timeout=None):
+      raise ConnectionError('no socket')
+  watcher = DockerWatcher(DockerClient(Unavailable()))
+  assert watcher.get_stats() is None
+  assert not watcher.docker_active
+
+def test_container_state_tracker_reports_transitions_from_events():
+  import threading
+  from c8ydm.core.docker_watcher import ContainerStateTracker
+  events = [
+    {'Type': 'container', 'Action': 'start', 'id': 'a' * 64, 'Actor': {'ID': 'a' * 64, 'Attributes': {'name': 'web'}}},
+    {'Type': 'container', 'Action': 'health_status: healthy', 'id': 'a' * 64, 'Actor': {'ID': 'a' * 64, 'Attributes': {'name': 'web'}}},
+    {'Type': 'container', 'Action': 'die', 'id': 'a' * 64, 'Actor': {'ID': 'a' * 64, 'Attributes': {'name': 'web'}}},
+  ]
+  class EventsClient:
+    def getEvents(self, filters=None):
+      yield from events
+      raise ConnectionError('stream closed')
+  transitions = []
+  done = threading.Event()
+  def on_transition(container_id, name, status):
+    transitions.append((container_id, name, status))
+    if len(transitions) == 2:
+      done.set()
+  tracker = ContainerStateTracker(EventsClient(), on_transition)
+  tracker.start()
+  assert done.wait(5)
+  tracker.stop()
+  assert transitions == [('a' * 12, 'web', 'up'), ('a' * 12, 'web', 'down')]
+  # Polling only reports what the events did not
+  assert not tracker.update('a' * 12, 'down')
+  assert ContainerStateTracker.status_from_text('Up 3 hours (unhealthy)') == 'unhealthy'
+
+def test_docker_sensor_watches_docker_started_later():
+  import threading
+  from types import SimpleNamespace
+  from c8ydm.agentmodules.docker_watcher import DockerSensor
+  class LateDocker(FakeDockerSocket):
+    available = False
+    def get(self, url, params=None, timeout=None):
+      if not self.available:
+        raise ConnectionError('no socket')
+      return super().get(url, params, timeout)
+  class EventsClient:
+    subscribed = threading.Event()
+    def getEvents(self, filters=None):
+      self.subscribed.set()
+      return iter(())
+  token_received = threading.Event()
+  sensor = DockerSensor('serial', SimpleNamespace(token_received=token_received, refresh_token_interval=0))
+  socket = LateDocker([], {})
+  sensor.docker_watcher = DockerWatcher(DockerClient(socket))
+  sensor.container_states.client = EventsClient()
+  assert sensor.getMessages() == []
+  assert sensor.container_states._thread is None
+  socket.available = True
+  assert sensor.getSensorMessages() == []
+  assert EventsClient.subscribed.wait(5)
+  sensor.stop()
+  assert sensor.container_states._stopped.is_set()
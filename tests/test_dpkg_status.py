@@ -0,0 +1,46 @@
+import pytest
+from c8ydm.core.dpkg_status import installed_packages
+
+STATUS = b'''Package: bash
+Essential: yes
+Status: install ok installed
+Priority: required
+Architecture: amd64
+Version: 5.1-2
+Description: GNU Bourne Again SHell
+ Bash is an sh-compatible command language interpreter.
+ .
+ Status: not a field
+
+Package: removed
+Status: deinstall ok config-files
+Architecture: all
+Version: 1.0
+
+Package: libc6
+Status: install ok installed
+Architecture: i386
+Multi-Arch: same
+Version: 2:2.31-13
+
+Package: nothing
+Status: purge ok not-installed
+Architecture: all
+
+Package: half
+Status: install reinstreq half-installed
+Architecture: arm64
+Version: 0.1'''
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_installed_packages(tmp_path, use_mmap):
+  status = tmp_path / 'status'
+  status.write_bytes(STATUS)
+  assert list(installed_packages(status, use_mmap)) == [
+    ('bash', '5.1-2', 'amd64'), ('libc6', '2:2.31-13', 'i386'), ('half', '0.1', 'arm64')]
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_empty_status(tmp_path, use_mmap):
+  status = tmp_path / 'status'
+  status.write_bytes(b'')
+  assert list(installed_packages(status, use_mmap)) == []
@@ -0,0 +1,87 @@
+import io
+from c8ydm.core.log_query import LogArchive, LogIndex, query, timestamp_key
+
+def write_log(path, minutes, start=0):
+  with open(path, 'a') as f:
+    for minute in range(start, start + minutes):
+      for second in range(0, 60, 10):
+        f.write(f'2021-05-03 {minute // 60:02d}:{minute % 60:02d}:{second:02d},000 MainThread INFO c8ydm.test line {minute}/{second}\n')
+        if second == 30:
+          f.write('Traceback (most recent call last):\n')
+
+def test_timestamp_key():
+  assert timestamp_key('2021-05-03T12:00:05.000+02:00') == b'2021-05-03 12:00:05'
+  assert timestamp_key('2021-05-03T12:00') == b'2021-05-03 12:00:00'
+  assert timestamp_key(b'2021-05-03 12:00:05,123 MainThread INFO') == b'2021-05-03 12:00:05'
+  assert timestamp_key(b'Traceback (most recent call last):') is None
+
+def test_query_reads_the_range_from_the_index(tmp_path):
+  log = tmp_path / 'agent.log'
+  write_log(log, 600)
+  index = LogIndex(log, interval=4096)
+  lines = list(query(log, '2021-05-03T05:00:00', '2021-05-03T05:01:00', '', 100, index))
+  assert lines[0].startswith('2021-05-03 05:00:00')
+  assert lines[-1].startswith('2021-05-03 05:01:00')
+  assert len(lines) == 6 + 1 + 1
+  assert 'Traceback' in lines[4]
+  assert len(index) > 10
+  assert index.seek('2021-05-03T05:00:00') > 0
+
+def test_query_stops_at_maximum_lines_and_filters(tmp_path):
+  log = tmp_path / 'agent.log'
+  write_log(log, 60)
+  assert len(list(query(log, '2021-05-03T00:00', '2021-05-03T01:00', '', 5))) == 5
+  lines = list(query(log, '2021-05-03T00:00', '2021-05-03T01:00', 'LINE 7/', 100))
+  assert [line.split()[-1] for line in lines] == [f'7/{second}' for second in range(0, 60, 10)]
+  assert list(query(log, '2021-05-04T00:00', '2021-05-05T00:00', '', 100)) == []
+
+def test_index_grows_with_the_log_and_is_rebuilt_after_rotation(tmp_path):
+  log = tmp_path / 'agent.log'
+  write_log(log, 60)
+  index = LogIndex(log, interval=1024)
+  index.update()
+  entries = len(index)
+  write_log(log, 60, start=60)
+  lines = list(query(log, '2021-05-03T01:30', '2021-05-03T01:30:59', '', 100, index))
+  assert len(index) > entries
+  assert len(lines) == 6 + 1
+  log.rename(tmp_path / 'agent.log.1')
+  write_log(log, 1, start=200)
+  assert list(query(log, '2021-05-03T01:30', '2021-05-03T01:31', '', 100, index)) == []
+  assert len(index) == 1
+
+def test_archive_queries_rotated_and_compressed_segments(tmp_path):
+  import gzip, shutil
+  log = tmp_path / 'agent.log'
+  for hour in range(3):
+    write_log(log, 60, start=hour * 60)
+    if hour < 2:
+      log.rename(tmp_path / 'agent.log.tmp')
+      for number in (2, 1):
+        for suffix in ('', '.gz'):
+          rotated = tmp_path / f'agent.log.{number}{suffix}'
+          if rotated.exists():
+            rotated.rename(tmp_path / f'agent.log.{number + 1}{suffix}')
+      with open(tmp_path / 'agent.log.tmp', 'rb') as f_in, gzip.open(tmp_path / 'agent.log.1.gz', 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+      (tmp_path / 'agent.log.tmp').unlink()
+  archive = LogArchive(log, interval=1024)
+  assert [segment.name for segment in archive.segments()] == ['agent.log.2.gz', 'agent.log.1.gz', 'agent.log']
+  assert archive.bounds(tmp_path / 'agent.log.2.gz') == (b'2021-05-03 00:00:00', b'2021-05-03 00:59:50')
+  lines = list(archive.query('2021-05-03T00:59:30', '2021-05-03T02:00:10', 'line', 1000))
+  assert lines[0].startswith('2021-05-03 00:59:30')
+  assert lines[-1].startswith('2021-05-03 02:00:10')
+  assert len(lines) == 3 + 360 + 2
+  assert len(list(archive.query('2021-05-03T00:00', '2021-05-03T03:00', '', 100))) == 100
+
+def test_archive_skips_segments_outside_of_the_range(tmp_path, monkeypatch):
+  log = tmp_path / 'agent.log'
+  write_log(log, 60)
+  log.rename(tmp_path / 'agent.log.1')
+  write_log(log, 60, start=60)
+  archive = LogArchive(log)
+  archive.bounds(tmp_path / 'agent.log.1')
+  opened = []
+  monkeypatch.setattr('builtins.open', lambda path, *args, **kwargs: opened.append(path) or io.open(path, *args, **kwargs))
+  assert len(list(archive.query('2021-05-03T01:10', '2021-05-03T01:10:59', '', 100))) == 7
+  assert tmp_path / 'agent.log.1' not in opened
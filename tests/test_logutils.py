@@ -0,0 +1,85 @@
+import json
+import logging
+import threading
+from c8ydm.core.log_query import timestamp_key
+from c8ydm.utils.logutils import DroppingQueueHandler, JsonFormatter, start_async_logging, stop_async_logging
+
+class BlockingHandler(logging.Handler):
+  def __init__(self):
+    super().__init__()
+    self.unblocked = threading.Event()
+    self.records = []
+  def emit(self, record):
+    self.unblocked.wait()
+    self.records.append(self.format(record))
+
+def test_records_are_written_by_the_listener():
+  logger = logging.getLogger('test_logutils.async')
+  logger.propagate = False
+  handler = BlockingHandler()
+  logger.addHandler(handler)
+  listener = start_async_logging(logger, 10)
+  logger.warning('message %d', 1)
+  assert handler.records == []
+  handler.unblocked.set()
+  listener.stop()
+  assert handler.records == ['message 1']
+  assert isinstance(logger.handlers[0], DroppingQueueHandler)
+
+def test_full_queue_drops_and_reports():
+  logger = logging.getLogger('test_logutils.dropping')
+  logger.propagate = False
+  handler = BlockingHandler()
+  logger.addHandler(handler)
+  listener = start_async_logging(logger, 5)
+  for i in range(20):
+    logger.warning('message %d', i)
+  queue_handler = logger.handlers[0]
+  assert sum(queue_handler.dropped.values()) > 0
+  handler.unblocked.set()
+  listener.stop()
+  logger.warning('after')
+  listener.start()
+  listener.stop()
+  assert any('dropped' in record for record in handler.records)
+  assert handler.records[-1] == 'after'
+
+def test_json_lines_keep_the_timestamp_searchable():
+  record = logging.LogRecord('c8ydm.test', logging.ERROR, __file__, 1, 'failed %s', ('twice',), None)
+  line = JsonFormatter().format(record)
+  assert json.loads(line)['message'] == 'failed twice'
+  assert timestamp_key(line.encode()) == JsonFormatter().formatTime(record)[:19].encode()
+
+def test_message_and_traceback_are_formatted_when_logged():
+  logger = logging.getLogger('test_logutils.eager')
+  logger.propagate = False
+  handler = BlockingHandler()
+  handler.setFormatter(JsonFormatter())
+  logger.addHandler(handler)
+  listener = start_async_logging(logger, 10)
+  operations = {'c8y_Restart'}
+  logger.warning('operations %s', operations)
+  operations.add('c8y_Command')
+  try:
+    raise ValueError('boom')
+  except ValueError:
+    logger.exception('failed')
+  handler.unblocked.set()
+  stop_async_logging(logger, listener)
+  first, second = [json.loads(record) for record in handler.records]
+  assert first['message'] == "operations {'c8y_Restart'}"
+  assert second['message'] == 'failed'
+  assert 'ValueError: boom' in second['exception']
+
+def test_stop_attaches_the_handlers_again():
+  logger = logging.getLogger('test_logutils.stop')
+  logger.propagate = False
+  handler = BlockingHandler()
+  handler.unblocked.set()
+  logger.addHandler(handler)
+  listener = start_async_logging(logger, 10)
+  logger.warning('queued')
+  stop_async_logging(logger, listener)
+  logger.warning('direct')
+  assert logger.handlers == [handler]
+  assert handler.records == ['queued', 'direct']
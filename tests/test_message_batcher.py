@@ -0,0 +1,35 @@
+import threading
+from c8ydm.core.message_batcher import MessageBatcher
+
+def test_batcher_coalesces_messages_per_topic_and_qos():
+  published = []
+  done = threading.Event()
+  def publish(topic, payload, qos):
+    published.append((topic, payload, qos))
+    if len(published) == 2:
+      done.set()
+  batcher = MessageBatcher(publish, 16000, 0.05)
+  for i in range(10):
+    batcher.add('s/us', f'200,cpu,user,{i}', 0)
+  batcher.add('s/us/child', '104,up', 0)
+  assert done.wait(5)
+  batcher.stop()
+  payloads = dict(((topic, qos), payload) for topic, payload, qos in published)
+  assert payloads[('s/us', 0)].split('\n') == [f'200,cpu,user,{i}' for i in range(10)]
+  assert payloads[('s/us/child', 0)] == '104,up'
+
+def test_batcher_flushes_at_size_limit():
+  published = []
+  batcher = MessageBatcher(lambda topic, payload, qos: published.append(payload), 20, 10)
+  for i in range(4):
+    batcher.add('s/us', '200,a,b,' + str(i), 0)
+  assert published == ['200,a,b,0\n200,a,b,1']
+  batcher.stop()
+  assert published[-1] == '200,a,b,2\n200,a,b,3'
+  assert all(len(payload) <= 20 for payload in published)
+
+def test_batcher_without_linger_publishes_immediately():
+  published = []
+  batcher = MessageBatcher(lambda topic, payload, qos: published.append(payload), 16000, 0)
+  batcher.add('s/us', '400,c8y_Event,text', 0)
+  assert published == ['400,c8y_Event,text']
@@ -0,0 +1,23 @@
+from c8ydm.core.outbound_queue import OutboundQueue
+
+def test_outbound_queue_is_fifo_and_persistent(tmp_path):
+  queue = OutboundQueue(tmp_path / 'outbound.db', 10)
+  for i in range(3):
+    queue.put('s/us', f'200,cpu,user,{i}', 0)
+  queue.close()
+
+  queue = OutboundQueue(tmp_path / 'outbound.db', 10)
+  assert queue.size() == 3
+  batch = queue.peek(2)
+  assert [payload for _, _, payload, _ in batch] == ['200,cpu,user,0', '200,cpu,user,1']
+  queue.remove([message_id for message_id, _, _, _ in batch])
+  assert queue.size() == 1
+  assert queue.peek(10)[0][2] == '200,cpu,user,2'
+
+def test_outbound_queue_evicts_oldest(tmp_path):
+  queue = OutboundQueue(tmp_path / 'outbound.db', 2)
+  for i in range(5):
+    queue.put('s/us', str(i), 1)
+  assert queue.size() == 2
+  assert queue.evicted == 3
+  assert [payload for _, _, payload, _ in queue.peek(10)] == ['3', '4']
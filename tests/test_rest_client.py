@@ -0,0 +1,171 @@
+import hashlib
+import json
+import requests
+import zlib
+from types import SimpleNamespace
+from c8ydm.client.rest_client import RestClient
+
+class FakeResponse:
+  def __init__(self, status_code, body=None, headers=None, content=b''):
+    self.status_code = status_code
+    self.text = json.dumps(body) if body is not None else ''
+    self.headers = headers or {}
+    self.content = content
+  def iter_content(self, chunk_size=1):
+    for i in range(0, len(self.content), chunk_size):
+      yield self.content[i:i + chunk_size]
+  def close(self):
+    pass
+
+class FakeSession:
+  def __init__(self, responses):
+    self.responses = responses
+    self.requests = []
+  def request(self, method, url, **kwargs):
+    self.requests.append((method, url, kwargs))
+    return self.responses(method, url, kwargs)
+
+class Configuration:
+  def getValue(self, category, key):
+    return None
+  def getCredentials(self):
+    return ['t123', 'device_serial', 'secret']
+
+def rest_client(tmp_path, responses):
+  agent = SimpleNamespace(serial='serial', configuration=Configuration(), path=tmp_path,
+                          url='tenant.example.com', token=None)
+  client = RestClient(agent)
+  client.session = FakeSession(responses)
+  return client
+
+def identity_responses(method, url, kwargs):
+  if '/identity/externalIds/' in url:
+    return FakeResponse(200, {'managedObject': {'id': '4711'}})
+  return FakeResponse(404, {'error': 'inventory/Not Found'})
+
+def test_internal_id_is_cached_and_persisted(tmp_path):
+  client = rest_client(tmp_path, identity_responses)
+  assert client.get_internal_id('serial') == '4711'
+  assert client.get_internal_id('serial') == '4711'
+  assert len(client.session.requests) == 1
+
+  restarted = rest_client(tmp_path, identity_responses)
+  assert restarted.get_internal_id('serial') == '4711'
+  assert restarted.session.requests == []
+
+def test_internal_id_is_invalidated_on_404(tmp_path):
+  client = rest_client(tmp_path, identity_responses)
+  internal_id = client.get_internal_id('serial')
+  assert not client.update_managed_object(internal_id, '{}')
+  assert client.get_internal_id('serial') == '4711'
+  identity_requests = [url for _, url, _ in client.session.requests if '/identity/' in url]
+  assert len(identity_requests) == 2
+
+def test_all_dangling_operations_are_set_to_failed(tmp_path):
+  executing = [{'id': str(i)} for i in range(250)]
+  def responses(method, url, kwargs):
+    if method == 'GET':
+      page = int(url.split('currentPage=')[1])
+      return FakeResponse(200, {'operations': executing[(page - 1) * 100:page * 100]})
+    return FakeResponse(200, {})
+  client = rest_client(tmp_path, responses)
+  operations = client.get_all_dangling_operations('4711')
+  assert len(operations) == 250
+  assert client.set_operations_to_failed(operations) == 250
+  updated = sorted(url.rsplit('/', 1)[1] for method, url, _ in client.session.requests if method == 'PUT')
+  assert updated == sorted(op['id'] for op in executing)
+
+def test_failed_page_returns_no_dangling_operations(tmp_path):
+  client = rest_client(tmp_path, lambda method, url, kwargs: FakeResponse(500, {}))
+  assert client.get_all_dangling_operations('4711') is None
+  assert client.set_operations_to_failed(None) == 0
+
+class DroppedResponse(FakeResponse):
+  def iter_content(self, chunk_size=1):
+    yield self.content[:chunk_size]
+    raise requests.exceptions.ChunkedEncodingError('Connection broken')
+
+def test_download_is_resumed_and_verified(tmp_path, monkeypatch):
+  monkeypatch.setattr('c8ydm.client.rest_client.time.sleep', lambda delay: None)
+  binary = bytes(range(256)) * 1024
+  def responses(method, url, kwargs):
+    disposition = {'content-disposition': 'attachment; filename="package.deb"', 'etag': '"v1"'}
+    if 'Range' not in kwargs['headers']:
+      return DroppedResponse(200, headers=dict(disposition, **{'content-length': str(len(binary))}), content=binary)
+    offset = int(kwargs['headers']['Range'][6:-1])
+    return FakeResponse(206, headers=dict(disposition, **{'content-range': f'bytes {offset}-{len(binary) - 1}/{len(binary)}'}),
+                        content=binary[offset:])
+  client = rest_client(tmp_path, responses)
+  client.download_chunk_size = 1000
+  file = client.download_c8y_binary('https://tenant.example.com/inventory/binaries/1',
+                                     expected_sha256=hashlib.sha256(binary).hexdigest())
+  assert file == str(tmp_path / 'binaries' / 'package.deb')
+  assert open(file, 'rb').read() == binary
+  assert client.session.requests[1][2]['headers']['Range'] == 'bytes=1000-'
+  assert client.session.requests[1][2]['headers']['If-Range'] == '"v1"'
+  assert all(kwargs['stream'] for _, _, kwargs in client.session.requests)
+  assert list((tmp_path / 'binaries').iterdir()) == [tmp_path / 'binaries' / 'package.deb']
+
+def test_download_with_wrong_checksum_is_discarded(tmp_path):
+  client = rest_client(tmp_path, lambda method, url, kwargs: FakeResponse(
+    200, headers={'content-disposition': 'attachment; filename="config.txt"'}, content=b'content'))
+  assert client.download_c8y_binary('https://tenant.example.com/inventory/binaries/2', '0' * 64) is None
+  assert list((tmp_path / 'binaries').iterdir()) == []
+
+def test_changed_binary_is_not_appended_to_a_partial_download(tmp_path):
+  url = 'https://tenant.example.com/inventory/binaries/3'
+  part = tmp_path / 'binaries' / (hashlib.sha1(url.encode('utf-8')).hexdigest() + '.part')
+  client = rest_client(tmp_path, lambda method, url, kwargs: FakeResponse(
+    200, headers={'content-disposition': 'attachment; filename="new.deb"', 'etag': '"v2"'}, content=b'new'))
+  part.write_bytes(b'old')
+  part.with_suffix('.validator').write_text('"v1"')
+  file = client.download_c8y_binary(url)
+  assert client.session.requests[0][2]['headers']['If-Range'] == '"v1"'
+  assert open(file, 'rb').read() == b'new'
+  assert list((tmp_path / 'binaries').iterdir()) == [tmp_path / 'binaries' / 'new.deb']
+
+def test_partial_download_without_validator_starts_over(tmp_path):
+  url = 'https://tenant.example.com/inventory/binaries/4'
+  part = tmp_path / 'binaries' / (hashlib.sha1(url.encode('utf-8')).hexdigest() + '.part')
+  client = rest_client(tmp_path, lambda method, url, kwargs: FakeResponse(200, content=b'content'))
+  part.write_bytes(b'old')
+  assert open(client.download_c8y_binary(url), 'rb').read() == b'content'
+  assert 'Range' not in client.session.requests[0][2]['headers']
+
+def test_download_name_stays_in_the_binaries_directory(tmp_path):
+  client = rest_client(tmp_path, lambda method, url, kwargs: FakeResponse(
+    200, headers={'content-disposition': 'attachment; filename="../../etc/x"'}, content=b'content'))
+  assert client.download_c8y_binary('https://tenant.example.com/inventory/binaries/5') == str(tmp_path / 'binaries' / 'x')
+  client = rest_client(tmp_path, lambda method, url, kwargs: FakeResponse(
+    200, headers={'content-disposition': 'attachment; filename=".."'}, content=b'content'))
+  assert client.download_c8y_binary('https://tenant.example.com/inventory/binaries/6') == str(tmp_path / 'binaries' / '6')
+
+def upload_responses(method, url, kwargs):
+  if url.endswith('/event/events'):
+    return FakeResponse(201, {'id': '99'})
+  return FakeResponse(201, {'self': 'https://tenant.example.com/event/events/99/binaries'})
+
+def test_upload_is_streamed_in_chunks(tmp_path):
+  log = tmp_path / 'agent.log'
+  log.write_bytes(b'2021-01-01 00:00:00 INFO line\n' * 10000)
+  client = rest_client(tmp_path, upload_responses)
+  client.upload_chunk_size = 4096
+  assert client.upload_event_configfile('4711', 'agent_serial', 'agent', log) == 'https://tenant.example.com/event/events/99/binaries'
+  _, url, kwargs = client.session.requests[-1]
+  assert url.endswith('/event/events/99/binaries')
+  chunks = list(kwargs['data'])
+  assert max(len(chunk) for chunk in chunks) < 2 * 4096
+  body = b''.join(chunks)
+  boundary = kwargs['headers']['Content-Type'].split('boundary=')[1].encode()
+  assert body.endswith(b'\r\n--' + boundary + b'--\r\n')
+  assert log.read_bytes() in body
+
+def test_upload_is_gzipped_on_the_fly(tmp_path):
+  lines = (f'line {i}\n' for i in range(10000))
+  client = rest_client(tmp_path, upload_responses)
+  assert client.upload_event_logfile('4711', 'agentlog_serial', lines, compress=True)
+  _, _, kwargs = client.session.requests[-1]
+  body = b''.join(kwargs['data'])
+  assert b'filename="agentlog_serial.gz"' in body
+  payload = body.split(b'Content-Type: application/gzip\r\n\r\n', 1)[1].rsplit(b'\r\n--', 1)[0]
+  assert zlib.decompress(payload, wbits=31) == ''.join(f'line {i}\n' for i in range(10000)).encode()
@@ -0,0 +1,44 @@
+import logging
+from c8ydm.client.mqtt_agent import Agent
+from c8ydm.framework.modulebase import Listener
+from c8ydm.framework.smartrest import SmartRESTMessage
+
+class RecordingListener(Listener):
+  def __init__(self, messages):
+    self.messages = messages
+  def handleOperation(self, message):
+    pass
+  def getSupportedOperations(self):
+    return []
+  def getSupportedTemplates(self):
+    return []
+  def getSupportedMessages(self):
+    return self.messages
+
+def routed_agent(listeners):
+  agent = Agent.__new__(Agent)
+  agent.logger = logging.getLogger('test')
+  agent._Agent__listeners = listeners
+  agent._Agent__build_routes()
+  return agent
+
+def listeners_for(agent, topic, message_id):
+  return agent._Agent__get_listeners(SmartRESTMessage(topic, message_id, []))
+
+def test_messages_are_routed_by_topic_and_message_id():
+  restart = RecordingListener([('s/ds', '510')])
+  software = RecordingListener([('s/ds', '528'), ('s/ds', 529)])
+  agent = routed_agent([restart, software])
+  assert listeners_for(agent, 's/ds', '510') == [restart]
+  assert listeners_for(agent, 's/ds', '529') == [software]
+  assert listeners_for(agent, 's/dc/xid', '510') == []
+  assert listeners_for(agent, 's/ds', '511') == []
+
+def test_any_topic_and_unrouted_listeners():
+  custom = RecordingListener([(None, 'dm501')])
+  everything = RecordingListener(None)
+  duplicate = RecordingListener([('s/ds', '510'), ('s/ds', '510')])
+  agent = routed_agent([custom, everything, duplicate])
+  assert listeners_for(agent, 's/dc/xid', 'dm501') == [custom, everything]
+  assert listeners_for(agent, 's/ds', '510') == [duplicate, everything]
+  assert listeners_for(agent, 's/ds', '999') == [everything]
@@ -0,0 +1,41 @@
+import threading
+import time
+from c8ydm.core.scheduler import SensorScheduler
+from c8ydm.framework.modulebase import Sensor
+
+class FastSensor(Sensor):
+  def getSensorMessages(self):
+    return []
+  def getInterval(self):
+    return 0.05
+
+class SlowSensor(Sensor):
+  release = threading.Event()
+  def getSensorMessages(self):
+    self.release.wait(5)
+    return []
+  def getInterval(self):
+    return 0.02
+
+def test_scheduler_polls_with_sensor_interval_and_skips_overruns():
+  fast = FastSensor('serial', None)
+  slow = SlowSensor('serial', None)
+  scheduler = SensorScheduler(lambda sensor: sensor.getSensorMessages(), lambda: 10, 2)
+  scheduler.start([fast, slow])
+  time.sleep(0.3)
+  metrics = scheduler.get_metrics()
+  SlowSensor.release.set()
+  scheduler.stop()
+  assert metrics['FastSensor']['runs'] >= 3
+  assert metrics['SlowSensor']['runs'] == 0
+  assert metrics['SlowSensor']['running']
+  assert metrics['SlowSensor']['skipped'] >= 3
+
+def test_scheduler_uses_default_interval():
+  calls = []
+  sensor = Sensor('serial', None)
+  scheduler = SensorScheduler(lambda s: calls.append(time.monotonic()), lambda: 0.05, 1)
+  scheduler.start([sensor])
+  time.sleep(0.28)
+  scheduler.stop()
+  assert 4 <= len(calls) <= 7
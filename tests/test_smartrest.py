@@ -0,0 +1,18 @@
+from c8ydm.framework.smartrest import SmartRESTMessage, chunked_messages
+
+def test_escaping():
+  message = SmartRESTMessage('s/us', '104', ['a, b', ' x', '"q"', 'end'])
+  assert message.getMessage() == '104,"a, b"," x","""q""",end'
+
+def test_chunks_fit_into_the_payload_limit():
+  groups = [[f'package-{i}', f'1.{i}-"beta", ü', 'apt', ' '] for i in range(5000)]
+  messages = chunked_messages('s/us', groups, maxBytes=16000)
+  assert len(messages) > 1
+  assert messages[0].messageId == '140'
+  assert {message.messageId for message in messages[1:]} == {'141'}
+  assert all(len(message.getMessage().encode('utf-8')) <= 16000 for message in messages)
+  assert [value for message in messages for value in message.values] == [value for group in groups for value in group]
+
+def test_empty_list_replaces_the_software_list():
+  messages = chunked_messages('s/us', [])
+  assert [(message.messageId, message.getMessage()) for message in messages] == [('140', '140')]
@@ -0,0 +1,186 @@
+import json
+import threading
+import time
+from c8ydm.utils.snapd_client import SnapdClient
+
+class FakeResponse:
+  def __init__(self, body):
+    self.body = body
+  def json(self):
+    return self.body
+
+class FakeSnapd:
+  """ Changes finish at the given time offset with the given status """
+  def __init__(self, changes):
+    self.start = time.monotonic()
+    self.changes = changes
+    self.requests = []
+  def status(self, change_id):
+    finish, status = self.changes[change_id]
+    if time.monotonic() - self.start < finish:
+      return {'id': change_id, 'status': 'Doing', 'ready': False}
+    change = {'id': change_id, 'status': status, 'ready': True}
+    if status == 'Error':
+      change['err'] = f'change {change_id} failed'
+    return change
+  def get(self, url, params=None):
+    self.requests.append(url)
+    if url.endswith('/v2/changes'):
+      running = [self.status(change_id) for change_id in self.changes]
+      return FakeResponse({'type': 'sync', 'result': [change for change in running if not change['ready']]})
+    return FakeResponse({'type': 'sync', 'result': self.status(url.rsplit('/', 1)[1])})
+
+def snapd_client(changes):
+  client = SnapdClient()
+  client.session = FakeSnapd(changes)
+  return client
+
+def test_changes_are_awaited_together():
+  client = snapd_client({'1': (0.05, 'Done'), '2': (0.3, 'Error'), '3': (0, 'Done')})
+  start = time.monotonic()
+  results = client.waitForChanges(['1', '2', '3'], minInterval=0.02, maxInterval=0.1)
+  assert time.monotonic() - start < 0.6
+  assert results['1'] == {'finished': True, 'status': 'Done', 'error': None}
+  assert results['2'] == {'finished': True, 'status': 'Error', 'error': 'change 2 failed'}
+  assert results['3']['finished']
+  # One request per round and one for every finished change
+  assert sum(url.endswith('/v2/changes/1') for url in client.session.requests) == 1
+
+def test_unfinished_changes_time_out():
+  client = snapd_client({'1': (10, 'Done')})
+  results = client.waitForChanges(['1'], timeout=0.1, minInterval=0.02, maxInterval=0.05)
+  assert results['1']['finished'] is False
+  assert results['1']['status'] == 'Timeout'
+
+def test_waiting_ends_when_snapd_stays_unreachable():
+  client = snapd_client({'1': (10, 'Done')})
+  client.session.get = lambda url, params=None: FakeResponse({'type': 'error', 'result': {'message': 'unavailable'}})
+  results = client.waitForChanges(['1'], minInterval=0.001, maxInterval=0.001, maxFailedPolls=3)
+  assert results['1']['finished'] is False
+  assert 'not reachable' in results['1']['error']
+
+class FakeBulkSnapd(FakeSnapd):
+  def __init__(self, unknown=()):
+    super().__init__({})
+    self.unknown = unknown
+    self.posts = []
+  def post(self, url, data=None, headers=None):
+    body = json.loads(data)
+    names = body.get('snaps') or [url.rsplit('/', 1)[1]]
+    self.posts.append((url, body))
+    if any(name in self.unknown for name in names):
+      return FakeResponse({'type': 'error', 'status-code': 404, 'result': {'message': f'snap not found: {names}'}})
+    change_id = str(len(self.changes) + 1)
+    self.changes[change_id] = (0, 'Done')
+    return FakeResponse({'type': 'async', 'status-code': 202, 'change': change_id})
+
+def test_snaps_are_grouped_into_bulk_actions():
+  client = SnapdClient()
+  client.session = FakeBulkSnapd()
+  requested = [(f'snap{i}', 'install', None) for i in range(10)] + [('old', 'remove', None), ('edge', 'install', 'latest/edge')]
+  results = client.applySnapActions(requested)
+  assert results == {name: None for name, _, _ in requested}
+  assert client.session.posts == [
+    ('http+unix://%2Frun%2Fsnapd.socket/v2/snaps', {'action': 'install', 'snaps': [f'snap{i}' for i in range(10)]}),
+    ('http+unix://%2Frun%2Fsnapd.socket/v2/snaps/old', {'action': 'remove'}),
+    ('http+unix://%2Frun%2Fsnapd.socket/v2/snaps/edge', {'action': 'install', 'channel': 'latest/edge'})]
+
+def test_rejected_bulk_action_is_retried_per_snap():
+  client = SnapdClient()
+  client.session = FakeBulkSnapd(unknown=['missing'])
+  results = client.applySnapActions([('a', 'refresh', None), ('missing', 'refresh', None), ('b', 'refresh', None)])
+  assert results['a'] is None and results['b'] is None
+  assert 'snap not found' in results['missing']
+  assert len(client.session.posts) == 4
+
+def test_failed_bulk_change_names_its_snaps_once():
+  client = SnapdClient()
+  client.session = FakeBulkSnapd()
+  client.session.changes['1'] = (0, 'Error')
+  client.session.post = lambda url, data=None, headers=None: FakeResponse({'type': 'async', 'status-code': 202, 'change': '1'})
+  results = client.applySnapActions([('a', 'remove', None), ('b', 'remove', None)])
+  assert results == {'a': 'Snaps a, b error: change 1 failed', 'b': 'Snaps a, b error: change 1 failed'}
+
+class FakeInventorySnapd:
+  def __init__(self):
+    self.snaps = [{'name': 'core', 'version': '16', 'channel': 'stable', 'revision': '1'}]
+    self.changes = []
+    self.snap_requests = 0
+  def get(self, url, params=None):
+    if url.endswith('/v2/snaps'):
+      self.snap_requests += 1
+      return FakeResponse({'type': 'sync', 'result': list(self.snaps)})
+    return FakeResponse({'type': 'sync', 'result': list(self.changes)})
+
+def test_inventory_is_cached_until_a_change_finished():
+  client = SnapdClient(inventoryCheckInterval=0)
+  client.session = FakeInventorySnapd()
+  first = client.inventory.snapshot()
+  assert client.inventory.snapshot() is first
+  assert client.session.snap_requests == 1
+  assert first.get('core').version == '16'
+
+  # External snap refresh seen through /v2/changes
+  client.session.changes.append({'id': '7', 'ready': True})
+  client.session.snaps = [{'name': 'core', 'version': '18', 'channel': 'stable', 'revision': '2'},
+                          {'name': 'hello', 'version': '2.10', 'channel': 'edge', 'revision': '3'}]
+  second = client.inventory.snapshot()
+  assert client.session.snap_requests == 2
+  added, removed = second.diff(first)
+  assert [snap.name for snap in added] == ['core', 'hello']
+  assert [(snap.name, snap.version) for snap in removed] == [('core', '16')]
+
+def test_unreported_changes():
+  client = SnapdClient(inventoryCheckInterval=60)
+  client.session = FakeInventorySnapd()
+  snapshot, added, removed = client.inventory.unreported()
+  assert added is None and removed is None
+  client.inventory.markReported(snapshot)
+  client.session.snaps = []
+  assert client.inventory.unreported()[1:] == ([], [])
+  client.inventory.invalidate()
+  assert [snap.name for snap in client.inventory.unreported()[2]] == ['core']
+
+def test_invalidate_does_not_wait_for_a_slow_snapd():
+  client = SnapdClient(inventoryCheckInterval=60)
+  session = FakeInventorySnapd()
+  client.session = session
+  fetching = threading.Event()
+  unblocked = threading.Event()
+  get = session.get
+  def slow_get(url, params=None):
+    if url.endswith('/v2/snaps'):
+      fetching.set()
+      unblocked.wait(5)
+    return get(url, params)
+  session.get = slow_get
+  snapshots = []
+  fetch = threading.Thread(target=lambda: snapshots.append(client.inventory.snapshot()))
+  fetch.start()
+  assert fetching.wait(5)
+  start = time.monotonic()
+  client.inventory.invalidate()
+  assert time.monotonic() - start < 1
+  unblocked.set()
+  fetch.join(5)
+  assert snapshots[0].get('core').version == '16'
+  # Fetched before the invalidation, not cached
+  client.inventory.snapshot()
+  assert session.snap_requests == 2
+
+def test_software_list_installs_and_refreshes_without_removing():
+  from c8ydm.utils.snapd_client import Snap, SnapSnapshot
+  snapshot = SnapSnapshot([
+    Snap('core22', '20230801', 'latest/stable', '1'),
+    Snap('hello', '2.10', 'latest/stable', '2'),
+    Snap('edge', '1.0', 'latest/stable', '3'),
+    Snap('old', '1.0', 'latest/stable', '4')])
+  actions = snapshot.updateActions([
+    ['hello', '2.10 - latest/stable', ' '],
+    ['edge', '1.0##latest/edge', ' '],
+    ['old', '1.1', ' '],
+    ['new', '1.0##latest/beta', ' ']])
+  assert actions == [
+    ['edge', '1.0##latest/edge', ' ', 'snap', 'update'],
+    ['old', '1.1', ' ', 'snap', 'update'],
+    ['new', '1.0##latest/beta', ' ', 'snap', 'install']]
@@ -0,0 +1,83 @@
+from c8ydm.core.software_inventory import SoftwareInventory
+
+def software(*packages):
+  return [{'name': name, 'version': version, 'softwareType': 'apt', 'url': 'test'} for name, version in packages]
+
+class Recorder:
+  def __init__(self, full_result=True):
+    self.messages = []
+    self.full = []
+    self.full_result = full_result
+  def publish(self, message):
+    self.messages.append((message.messageId, message.values))
+    return True
+  def send_full(self, software_list):
+    self.full.append(software_list)
+    return self.full_result
+
+def test_first_report_is_full_and_later_reports_are_deltas(tmp_path):
+  inventory = SoftwareInventory(tmp_path / 'software_inventory.json')
+  recorder = Recorder()
+  assert inventory.report(software(('bash', '5.1'), ('nano', '5.4')), recorder.publish, recorder.send_full)
+  assert len(recorder.full) == 1
+  assert recorder.messages == []
+
+  restarted = SoftwareInventory(tmp_path / 'software_inventory.json')
+  assert restarted.report(software(('bash', '5.2'), ('nano', '5.4'), ('vim', '8.2')), recorder.publish, recorder.send_full)
+  assert len(recorder.full) == 1
+  assert recorder.messages == [('142', ['bash', '5.1']), ('141', ['bash', '5.2', 'apt', ' ', 'vim', '8.2', 'apt', ' '])]
+
+  recorder.messages = []
+  assert restarted.report(software(('bash', '5.2'), ('nano', '5.4'), ('vim', '8.2')), recorder.publish, recorder.send_full)
+  assert recorder.messages == []
+
+def test_large_delta_and_failed_full_report(tmp_path):
+  inventory = SoftwareInventory(tmp_path / 'software_inventory.json', max_delta=2)
+  recorder = Recorder(full_result=False)
+  assert not inventory.report(software(('bash', '5.1')), recorder.publish, recorder.send_full)
+  assert inventory.changes(software(('bash', '5.1'))) is None
+  recorder.full_result = True
+  inventory.report(software(('bash', '5.1')), recorder.publish, recorder.send_full)
+  assert inventory.changes(software(('bash', '5.1'), ('a', '1'), ('b', '1'))) == ([('a', '1', 'apt'), ('b', '1', 'apt')], [])
+  assert inventory.changes(software(('a', '1'), ('b', '1'), ('c', '1'))) is None
+  inventory.report(software(('bash', '5.1')), recorder.publish, recorder.send_full, full=True)
+  assert len(recorder.full) == 3
+
+def test_corrupt_state_sends_the_full_list(tmp_path):
+  path = tmp_path / 'software_inventory.json'
+  SoftwareInventory(path).report(software(('bash', '5.1')), Recorder().publish, Recorder().send_full)
+  path.write_text(path.read_text().replace('5.1', '5.0'))
+  assert SoftwareInventory(path).changes(software(('bash', '5.1'))) is None
+
+def test_full_list_after_registration_and_on_request(tmp_path):
+  path = tmp_path / 'software_inventory.json'
+  recorder = Recorder()
+  SoftwareInventory(path).report(software(('bash', '5.1')), recorder.publish, recorder.send_full, device='t/1')
+  inventory = SoftwareInventory(path)
+  assert inventory.changes(software(('bash', '5.2')), 't/1') == ([('bash', '5.2', 'apt')], [('bash', '5.1', 'apt')])
+  assert inventory.changes(software(('bash', '5.2')), 't/2') is None
+  inventory.report(software(('bash', '5.2')), recorder.publish, recorder.send_full, device='t/2')
+  assert len(recorder.full) == 2
+  inventory.request_full()
+  assert SoftwareInventory(path).changes(software(('bash', '5.2')), 't/2') is None
+
+def test_delta_is_not_remembered_when_publishing_failed(tmp_path):
+  path = tmp_path / 'software_inventory.json'
+  recorder = Recorder()
+  inventory = SoftwareInventory(path)
+  inventory.report(software(('bash', '5.1')), recorder.publish, recorder.send_full)
+  def fail(message):
+    raise RuntimeError('not connected')
+  try:
+    inventory.report(software(('bash', '5.2')), fail, recorder.send_full)
+  except RuntimeError:
+    pass
+  assert SoftwareInventory(path).changes(software(('bash', '5.2'))) == ([('bash', '5.2', 'apt')], [('bash', '5.1', 'apt')])
+
+def test_unacknowledged_delta_is_reported_again(tmp_path):
+  path = tmp_path / 'software_inventory.json'
+  recorder = Recorder()
+  inventory = SoftwareInventory(path)
+  inventory.report(software(('bash', '5.1')), recorder.publish, recorder.send_full)
+  assert not inventory.report(software(('bash', '5.2')), lambda message: False, recorder.send_full)
+  assert inventory.changes(software(('bash', '5.2'))) == ([('bash', '5.2', 'apt')], [('bash', '5.1', 'apt')])